@@ -0,0 +1,401 @@
+"""
+流程图编辑器性能基准，在 Qt offscreen 平台下运行，结果输出为 JSON 便于对比。
+
+示例:
+    python benchmarks/bench_flow_chart.py --sizes 1000 10000 --mix mixed -o bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR, QPointF, QRectF, Qt
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtWidgets import QApplication
+
+import diagram_io
+from clusters import ClusterTree, aggregate_edges
+from diagram_diff import diff_diagram
+from diagram_model import DiagramModel
+from flow_chart import (DiagramPainter, DraggableBlock, ExportWorker, MainWindow,
+                        generate_scattered_position)
+from minimap import MinimapRaster
+from placement import PlacementEngine
+from routing import BUNDLED, ORTHOGONAL, EdgeRouter, route_crossings
+from search_index import SearchIndex, parse_query
+
+# 线型编号的抽样权重，编号与 LineType.to_number() 一致
+LINE_MIXES = {
+    "single": {4: 1.0},
+    "mixed": {1: 0.1, 2: 0.2, 3: 0.3, 4: 0.4},
+    "multi": {1: 0.5, 2: 0.5},
+}
+
+
+def synthetic_tables(n_blocks, n_relations, mix="mixed", seed=0):
+    """生成随机图表，方块分布在与数量相称的区域内"""
+    rng = np.random.default_rng(seed)
+    extent = 200 * np.sqrt(n_blocks)
+    numbers, weights = zip(*LINE_MIXES[mix].items())
+    blocks = diagram_io.BlockTable(
+        ids=np.arange(1, n_blocks + 1, dtype=np.int64),
+        names=np.array([f"工作组{i}" for i in range(n_blocks)], dtype=object),
+        x=rng.uniform(-extent, extent, n_blocks),
+        y=rng.uniform(-extent, extent, n_blocks),
+        width=np.full(n_blocks, 100.0),
+        height=np.full(n_blocks, 60.0),
+    )
+    relations = diagram_io.RelationTable(
+        start=rng.integers(1, n_blocks + 1, n_relations),
+        end=rng.integers(1, n_blocks + 1, n_relations),
+        line=rng.choice(np.array(numbers, dtype=np.int8), n_relations, p=weights),
+    )
+    return blocks, relations
+
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, params, func, repeat=None):
+        times = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return self.record(name, params, times)
+
+    def record(self, name, params, times):
+        """记录在别处测得的一组耗时（秒）"""
+        result = {
+            "name": name,
+            "params": params,
+            "min": min(times),
+            "median": statistics.median(times),
+            "runs": len(times),
+        }
+        self.results.append(result)
+        print(f"{name:<28} {json.dumps(params, ensure_ascii=False):<48} "
+              f"min={result['min']:.4f}s median={result['median']:.4f}s", file=sys.stderr)
+        return result
+
+
+def render_to_image(canvas):
+    image = QImage(canvas.viewport().size(), QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    canvas.render(painter)
+    painter.end()
+    return image
+
+
+def bench_size(runner, app, n_blocks, n_relations, mix, workdir):
+    params = {"blocks": n_blocks, "relations": n_relations, "mix": mix}
+    blocks, relations = synthetic_tables(n_blocks, n_relations, mix)
+    window = MainWindow()
+    window.async_import = False
+    window.resize(1200, 800)
+    window.show()
+    app.processEvents()
+    canvas = window.canvas
+
+    # 导入：解析文件 + 批量创建图元，与 _import 的步骤一致
+    for suffix in (diagram_io.NATIVE_SUFFIX, diagram_io.EXCEL_SUFFIX):
+        if suffix == diagram_io.EXCEL_SUFFIX and n_blocks > 20000:
+            continue
+        path = os.path.join(workdir, f"bench_{n_blocks}{suffix}")
+        diagram_io.write_diagram(path, blocks, relations)
+        runner.measure("import.read" + suffix, params, lambda: diagram_io.read_diagram(path))
+    runner.measure("import.load_tables", params,
+                   lambda: canvas.load_tables(blocks, relations), repeat=1)
+    app.processEvents()
+
+    # 合并：各约 1% 的增删改经 merge_tables 落到场景（含撤销、自动保存等监听者），
+    # 与上面整图重建的 import.load_tables 对照；每次合并前重新载入，不计入耗时
+    incoming, links = changed_tables(blocks, relations)
+    diff = canvas.diff_tables(incoming, links)
+    timings = []
+    for _ in range(runner.repeat):
+        canvas.load_tables(blocks, relations)
+        app.processEvents()
+        start = time.perf_counter()
+        canvas.merge_tables(incoming, links, diff)
+        timings.append(time.perf_counter() - start)
+    runner.record("merge.apply", dict(params, virtual=canvas.scene.virtual is not None,
+                                      changes=len(diff)), timings)
+    canvas.load_tables(blocks, relations)
+    app.processEvents()
+
+    # 导出：收集数据 + 写文件，与 _export 的步骤一致
+    runner.measure("export.to_tables", params, canvas.to_tables)
+    path = os.path.join(workdir, f"bench_out_{n_blocks}{diagram_io.NATIVE_SUFFIX}")
+    runner.measure("export.write.fcd", params,
+                   lambda: diagram_io.write_diagram(path, *canvas.to_tables()))
+
+    # 拖动：中心方块连出大量连线，模拟 60 帧拖动
+    fan_out = min(1000, n_blocks - 1)
+    hub = DraggableBlock("hub", 0, 0)
+    canvas.add_block(hub)
+    targets = list(canvas.blocks)[:fan_out]
+    for target in targets:
+        canvas.add_connection(hub, target, window.canvas.current_line_type)
+
+    def drag():
+        for frame in range(60):
+            hub.setPos(frame * 3, frame * 2)
+            canvas.scene.flush_connection_updates()
+    runner.measure("drag.update_line_fanout", dict(params, fan_out=fan_out, frames=60), drag)
+
+    # 缩放：滑块变化后重绘视口
+    for value in (100, 50, 10):
+        def zoom(value=value):
+            window._zoom_canvas(value)
+            render_to_image(canvas)
+        runner.measure("zoom.repaint", dict(params, zoom=value), zoom)
+
+    # 平移：虚拟化模式下包含可见区域图元的回收和创建
+    window._zoom_canvas(100)
+    extent = 200 * np.sqrt(n_blocks)
+
+    def pan():
+        for step in range(10):
+            canvas.centerOn(QPointF(extent * (step / 5 - 1), extent * (1 - step / 5)))
+            app.processEvents()
+            render_to_image(canvas)
+    runner.measure("pan.viewport", dict(params, virtual=canvas.scene.virtual is not None, steps=10),
+                   pan)
+
+    # 整个场景渲染到一张图片
+    def render_scene():
+        source = canvas.scene.itemsBoundingRect()
+        scale = min(1.0, 4096 / max(source.width(), source.height(), 1))
+        image = QImage(int(source.width() * scale) + 1, int(source.height() * scale) + 1,
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.white)
+        painter = QPainter(image)
+        canvas.scene.render(painter, QRectF(image.rect()), source)
+        painter.end()
+    runner.measure("render.full_scene", params, render_scene, repeat=1)
+
+    # 同样尺寸的图片按瓦片渲染并流式写出 PNG
+    source = canvas.scene.itemsBoundingRect()
+    scale = min(1.0, 4096 / max(source.width(), source.height(), 1))
+    path = os.path.join(workdir, f"bench_{n_blocks}.png")
+    runner.measure("export.png_tiled", params,
+                   lambda: ExportWorker(DiagramPainter(canvas.scene.model), path, scale).run(),
+                   repeat=1)
+
+    window.close()
+    canvas.clear_diagram()
+    window.deleteLater()
+    app.processEvents()
+
+
+def bench_placement(runner, n_blocks):
+    params = {"blocks": n_blocks}
+
+    def place_all():
+        engine = PlacementEngine(center=(0, 0), spread=800, spacing=100)
+        for _ in range(n_blocks):
+            engine.place(100, 60)
+    runner.measure("placement.engine", params, place_all)
+
+    engine = PlacementEngine(center=(0, 0), spread=800, spacing=100)
+    placed = [(*engine.place(100, 60), 100, 60) for _ in range(min(n_blocks, 10000))]
+    runner.measure("placement.generate_scattered_position", {"placed": len(placed)},
+                   lambda: generate_scattered_position(placed, 100, 60, spread=800, spacing=100))
+
+
+def bench_model_edits(runner, n_blocks, n_relations, mix):
+    """逐个删除 200 个方块（连同连线）再逐个加回，模拟交互编辑"""
+    blocks, relations = synthetic_tables(n_blocks, n_relations, mix)
+    params = {"blocks": n_blocks, "relations": n_relations, "mix": mix}
+    rows = np.random.default_rng(2).choice(n_blocks, min(200, n_blocks), replace=False)
+
+    def edit():
+        model = DiagramModel(blocks, relations)
+        start = time.perf_counter()
+        for block_id in blocks.ids[rows].tolist():
+            model.remove_block(block_id)
+        for row in rows.tolist():
+            model.add_block(int(blocks.ids[row]), blocks.names[row], blocks.x[row], blocks.y[row],
+                            blocks.width[row], blocks.height[row])
+        return time.perf_counter() - start
+    # 只计编辑本身，不含建立 model
+    timings = [edit() for _ in range(runner.repeat)]
+    runner.record("model.remove_add_block", dict(params, edits=len(rows)), timings)
+
+
+def bench_routing(runner, n_blocks, n_relations, mix):
+    """从空缓存开始为前若干条连线计算线路，正交线路另外统计穿过方块的比例"""
+    model = DiagramModel(*synthetic_tables(n_blocks, n_relations, mix))
+    n_routes = min(500, n_relations)
+    for mode in (ORTHOGONAL, BUNDLED):
+        routers = []
+
+        def route_all(mode=mode):
+            router = EdgeRouter(mode)
+            for uid in range(n_routes):
+                router.route(model, uid)
+            routers.append(router)
+        result = runner.measure("routing." + mode, {"blocks": n_blocks, "routes": n_routes},
+                                route_all)
+        if mode != ORTHOGONAL:
+            continue
+        router = routers[-1]
+        rects = np.column_stack([model.x, model.y, model.width, model.height])
+        start, end = model.edge_rows()
+        crossings = np.array([route_crossings(router.routes[uid], rects, int(start[i]), int(end[i]))
+                              for uid, i in ((uid, model.edge_index(uid)) for uid in range(n_routes))
+                              if start[i] != end[i]])
+        result["crossing_rate"] = float(np.mean(crossings > 0))
+        result["crossings_mean"] = float(crossings.mean())
+        print(f"{'':<28} crossing_rate={result['crossing_rate']:.3f} "
+              f"crossings_mean={result['crossings_mean']:.3f}", file=sys.stderr)
+
+
+def bench_search(runner, n_blocks, n_relations, mix):
+    """建索引一次，再测各类查询"""
+    model = DiagramModel(*synthetic_tables(n_blocks, n_relations, mix))
+    params = {"blocks": n_blocks}
+    index = SearchIndex()
+    runner.measure("search.rebuild", params,
+                   lambda: index.rebuild(model.ids.tolist(), model.names.tolist()), repeat=1)
+    for text in ("工作组12", "组1", "id:99", "工作组1 line:4"):
+        query = parse_query(text)
+        runner.measure("search.query", dict(params, query=text), lambda: index.search(query, model))
+
+
+def changed_tables(blocks, relations):
+    """改名、删除和新增各约 1% 的方块，另外删除约 1% 的连线，返回新的 (BlockTable, RelationTable)"""
+    n_blocks, n_relations = len(blocks), len(relations)
+    rng = np.random.default_rng(1)
+    changed = max(1, n_blocks // 100)
+    names = blocks.names.copy()
+    names[rng.choice(n_blocks, changed, replace=False)] = "改名"
+    keep = np.ones(n_blocks, dtype=bool)
+    keep[rng.choice(n_blocks, changed, replace=False)] = False
+    incoming = diagram_io.BlockTable(
+        ids=np.concatenate([blocks.ids[keep], n_blocks + 1 + np.arange(changed)]),
+        names=np.concatenate([names[keep], np.full(changed, "新增", dtype=object)]),
+        x=np.concatenate([blocks.x[keep], np.zeros(changed)]),
+        y=np.concatenate([blocks.y[keep], np.zeros(changed)]),
+        width=np.concatenate([blocks.width[keep], np.full(changed, 100.0)]),
+        height=np.concatenate([blocks.height[keep], np.full(changed, 60.0)]),
+    )
+    # 删除方块的连线随之删除，否则导入时校验不通过
+    kept = ((rng.random(n_relations) > 0.01) & np.isin(relations.start, incoming.ids)
+            & np.isin(relations.end, incoming.ids))
+    links = diagram_io.RelationTable(start=relations.start[kept], end=relations.end[kept],
+                                     line=relations.line[kept])
+    return incoming, links
+
+
+def bench_diff(runner, n_blocks, n_relations, mix):
+    """改名、删除和新增各约 1% 的方块和连线后与原图表比较"""
+    blocks, relations = synthetic_tables(n_blocks, n_relations, mix)
+    model = DiagramModel(blocks, relations)
+    incoming, links = changed_tables(blocks, relations)
+    runner.measure("merge.diff", {"blocks": n_blocks, "relations": n_relations, "mix": mix},
+                   lambda: diff_diagram(model, incoming, links))
+
+
+def bench_clusters(runner, n_blocks, n_relations, mix):
+    """十个各含一成方块的分组全部折叠后计算隐藏的行和合并的连线"""
+    model = DiagramModel(*synthetic_tables(n_blocks, n_relations, mix))
+    tree = ClusterTree()
+    for part in np.array_split(model.ids, 10):
+        tree.group(f"分组{len(tree) + 1}", part[:max(1, len(part) // 10)].tolist(), collapsed=True)
+    start, end = model.edge_rows()
+
+    def collapse():
+        owners = tree.owners(model)
+        return aggregate_edges(start, end, model.edge_line, owners)
+    runner.measure("clusters.aggregate", {"blocks": n_blocks, "relations": n_relations, "mix": mix},
+                   collapse)
+
+
+def bench_minimap(runner, n_blocks, n_relations, mix):
+    """小地图整图栅格化，以及拖动一个方块（一次鼠标移动）后的局部刷新"""
+    model = DiagramModel(*synthetic_tables(n_blocks, n_relations, mix))
+    params = {"blocks": n_blocks, "relations": n_relations, "mix": mix}
+    raster = MinimapRaster()
+    runner.measure("minimap.rebuild", params, lambda: raster.rebuild(model))
+    rows = np.array([len(model) // 2])
+
+    def move():
+        old_x, old_y = model.x[rows].copy(), model.y[rows].copy()
+        model.x[rows] += 30
+        model.y[rows] -= 20
+        raster.mark_moved(model, rows, old_x, old_y)
+        return raster.refresh(model)
+    runner.measure("minimap.refresh_move", params, move)
+
+
+def bench_startup(runner):
+    """新进程启动到窗口首次绘制、背景图就绪后退出的总耗时"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, os.path.join(root, "flow_chart.py"), "--startup-report"]
+    runner.measure("startup.cold", {}, lambda: subprocess.run(command, cwd=root, check=True,
+                                                               capture_output=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流程图编辑器性能基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="方块数量，连线数量为方块数量乘以 --edge-factor")
+    parser.add_argument("--edge-factor", type=float, default=2.5)
+    parser.add_argument("--mix", choices=sorted(LINE_MIXES), nargs="+", default=["mixed"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="JSON 结果文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    runner = Runner(args.repeat)
+    bench_startup(runner)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_blocks in args.sizes:
+            bench_placement(runner, n_blocks)
+            for mix in args.mix:
+                n_relations = int(n_blocks * args.edge_factor)
+                bench_model_edits(runner, n_blocks, n_relations, mix)
+                bench_routing(runner, n_blocks, n_relations, mix)
+                bench_search(runner, n_blocks, n_relations, mix)
+                bench_diff(runner, n_blocks, n_relations, mix)
+                bench_clusters(runner, n_blocks, n_relations, mix)
+                bench_minimap(runner, n_blocks, n_relations, mix)
+                bench_size(runner, app, n_blocks, n_relations, mix, workdir)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "qt": QT_VERSION_STR,
+            "pyqt": PYQT_VERSION_STR,
+            "platform": platform.platform(),
+            "qpa": os.environ.get("QT_QPA_PLATFORM"),
+            "argv": argv if argv is not None else sys.argv[1:],
+        },
+        "results": runner.results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import numpy as np
+
+import diagram_io
+
+# 聚合连线的权重按线型的线条数计：LineType.to_number() 编号 1~4 分别为四、三、双、单实线
+_LINE_STRENGTH = np.array([0, 4, 3, 2, 1], dtype=np.int64)
+
+
+class Cluster:
+    __slots__ = ("id", "name", "parent", "collapsed")
+
+    def __init__(self, cluster_id, name, parent=0, collapsed=False):
+        self.id = cluster_id
+        self.name = name
+        self.parent = parent
+        self.collapsed = collapsed
+
+
+# ====================== 分组树 ======================
+class ClusterTree:
+    """
+    方块的嵌套分组。
+
+    clusters 为 编号 -> Cluster，parent 为 0 表示顶层分组；members 为 方块编号 -> 直接所属的
+    分组编号。每个方块只记在最内层的分组下，外层分组包含其全部子分组中的方块。
+    """
+
+    def __init__(self):
+        self.clusters = {}
+        self.members = {}
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def __contains__(self, cluster_id):
+        return cluster_id in self.clusters
+
+    @classmethod
+    def from_table(cls, table):
+        """由 diagram_io.ClusterTable 创建，table 为 None 时返回空树"""
+        tree = cls()
+        if table is None:
+            return tree
+        for cluster_id, name, parent, collapsed in zip(
+                table.ids.tolist(), table.names.tolist(), table.parents.tolist(),
+                table.collapsed.tolist()):
+            tree.add(name, parent, cluster_id, bool(collapsed))
+        for cluster in tree.clusters.values():
+            if cluster.parent not in tree.clusters:
+                cluster.parent = 0
+        for block_id, cluster_id in zip(table.block_ids.tolist(), table.block_clusters.tolist()):
+            if cluster_id in tree.clusters:
+                tree.members[block_id] = cluster_id
+        return tree
+
+    def to_table(self, block_ids=None):
+        """
+        转换为 diagram_io.ClusterTable。
+
+        参数:
+            block_ids: 给出时只保留这些方块的归属，已删除的方块不写入文件
+        """
+        clusters = list(self.clusters.values())
+        members = self.members.items()
+        if block_ids is not None:
+            existing = set(np.asarray(block_ids).tolist())
+            members = [(block_id, c) for block_id, c in members if block_id in existing]
+        else:
+            members = list(members)
+        names = np.empty(len(clusters), dtype=object)
+        names[:] = [cluster.name for cluster in clusters]
+        return diagram_io.ClusterTable(
+            ids=np.array([cluster.id for cluster in clusters], dtype=np.int64),
+            names=names,
+            parents=np.array([cluster.parent for cluster in clusters], dtype=np.int64),
+            collapsed=np.array([cluster.collapsed for cluster in clusters], dtype=bool),
+            block_ids=np.array([block_id for block_id, _ in members], dtype=np.int64),
+            block_clusters=np.array([c for _, c in members], dtype=np.int64),
+        )
+
+    def copy(self):
+        return ClusterTree.from_table(self.to_table())
+
+    # ---------- 结构 ----------
+    def add(self, name, parent=0, cluster_id=None, collapsed=False):
+        """新建一个空分组，返回它的编号"""
+        if cluster_id is None:
+            cluster_id = self._next_id
+        elif cluster_id in self.clusters or cluster_id <= 0:
+            raise ValueError(f"分组编号无效: {cluster_id}")
+        self.clusters[cluster_id] = Cluster(cluster_id, name, parent, collapsed)
+        self._next_id = max(self._next_id, cluster_id + 1)
+        return cluster_id
+
+    def ancestors(self, cluster_id):
+        """从 cluster_id 自身到顶层分组的编号列表"""
+        path = []
+        while cluster_id:
+            path.append(cluster_id)
+            cluster_id = self.clusters[cluster_id].parent
+        return path
+
+    def common_ancestor(self, cluster_ids):
+        """这些分组（0 表示顶层）最近的共同上级，没有时为 0"""
+        paths = [self.ancestors(c) for c in cluster_ids]
+        if not paths:
+            return 0
+        shared = set(paths[0]).intersection(*paths[1:])
+        return next((c for c in paths[0] if c in shared), 0)
+
+    def descendants(self, cluster_id):
+        """cluster_id 及其全部子孙分组的编号集合"""
+        result = {cluster_id}
+        frontier = [cluster_id]
+        while frontier:
+            frontier = [c.id for c in self.clusters.values()
+                        if c.parent in frontier and c.id not in result]
+            result.update(frontier)
+        return result
+
+    def group(self, name, block_ids=(), cluster_ids=(), collapsed=False):
+        """
+        新建分组，把方块和已有分组放进去。
+
+        新分组挂在这些方块、分组原来所在位置最近的共同上级下，从而形成嵌套。
+        返回新分组的编号。
+        """
+        cluster_ids = set(cluster_ids)
+        # 同时选中了某个分组和它的子分组时，只移动外层的那个
+        cluster_ids = {c for c in cluster_ids
+                       if not cluster_ids.intersection(self.ancestors(c)[1:])}
+        places = [self.members.get(block_id, 0) for block_id in block_ids]
+        places += [self.clusters[c].parent for c in cluster_ids]
+        parent = self.common_ancestor(places)
+        new_id = self.add(name, parent, collapsed=collapsed)
+        for c in cluster_ids:
+            self.clusters[c].parent = new_id
+        for block_id in block_ids:
+            self.members[block_id] = new_id
+        return new_id
+
+    def ungroup(self, cluster_id):
+        """解散分组，子分组和方块移到它的上级（顶层时方块不再属于任何分组）"""
+        parent = self.clusters.pop(cluster_id).parent
+        for cluster in self.clusters.values():
+            if cluster.parent == cluster_id:
+                cluster.parent = parent
+        for block_id in [b for b, c in self.members.items() if c == cluster_id]:
+            if parent:
+                self.members[block_id] = parent
+            else:
+                del self.members[block_id]
+
+    def assign(self, block_ids, cluster_id):
+        """方块放进已有的分组，替换原来的归属"""
+        for block_id in block_ids:
+            self.members[block_id] = cluster_id
+
+    def remove_blocks(self, block_ids):
+        """方块移出所在的分组"""
+        for block_id in block_ids:
+            self.members.pop(block_id, None)
+
+    def rekey_block(self, old_id, new_id):
+        cluster_id = self.members.pop(old_id, None)
+        if cluster_id is not None:
+            self.members[new_id] = cluster_id
+
+    # ---------- 折叠 ----------
+    def display_owners(self):
+        """分组编号 -> 显示时代表它的折叠分组（最外层折叠的上级或自身），未被折叠时为 0"""
+        owners = {}
+        for cluster_id in self.clusters:
+            owner = 0
+            for c in self.ancestors(cluster_id):
+                if self.clusters[c].collapsed:
+                    owner = c
+            owners[cluster_id] = owner
+        return owners
+
+    def owners(self, model):
+        """
+        model（DiagramModel）每一行被哪个折叠分组隐藏，未隐藏为 0。
+        """
+        result = np.zeros(len(model), dtype=np.int64)
+        if not any(cluster.collapsed for cluster in self.clusters.values()):
+            return result
+        display = self.display_owners()
+        row_of = model.row_of
+        for block_id, cluster_id in self.members.items():
+            owner = display[cluster_id]
+            row = row_of.get(block_id)
+            if owner and row is not None:
+                result[row] = owner
+        return result
+
+    def member_ids(self, cluster_id):
+        """分组（含子分组）中全部方块的编号"""
+        inside = self.descendants(cluster_id)
+        return [block_id for block_id, c in self.members.items() if c in inside]
+
+
+# ====================== 连线聚合 ======================
+def aggregate_edges(start, end, line, owners):
+    """
+    把一端或两端被折叠的连线按显示端点合并。
+
+    参数:
+        start, end: 连线两端的行号数组
+        line: 线型编号数组
+        owners: ClusterTree.owners 的结果
+
+    返回:
+        (hidden, a, b, count, weight, strongest)。hidden 为需要隐藏的连线掩码；
+        a / b 为合并后每条连线的两端，非负数为行号，负数为 -分组编号，不区分方向，
+        两端落在同一个折叠分组内的连线不再显示；count 为合并的条数，weight 为各线型
+        线条数之和，strongest 为其中最粗线型的编号。
+    """
+    owner_a, owner_b = owners[start], owners[end]
+    hidden = (owner_a != 0) | (owner_b != 0)
+    a = np.where(owner_a != 0, -owner_a, start)[hidden]
+    b = np.where(owner_b != 0, -owner_b, end)[hidden]
+    line = np.asarray(line, dtype=np.int64)[hidden]
+    keep = a != b
+    a, b, line = np.minimum(a, b)[keep], np.maximum(a, b)[keep], line[keep]
+    if not len(a):
+        empty = np.zeros(0, dtype=np.int64)
+        return hidden, empty, empty, empty, empty, empty
+    order = np.lexsort((b, a))
+    a, b, line = a[order], b[order], line[order]
+    first = np.ones(len(a), dtype=bool)
+    first[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1])
+    starts = np.flatnonzero(first)
+    count = np.diff(np.append(starts, len(a)))
+    weight = np.add.reduceat(_LINE_STRENGTH[line], starts)
+    strongest = np.minimum.reduceat(line, starts)
+    return hidden, a[starts], b[starts], count, weight, strongest
@@ -0,0 +1,129 @@
+import numpy as np
+
+from graph_layout import position_blocks
+
+
+def _signatures(columns):
+    """按行组合各列的哈希，得到 64 位行签名"""
+    import pandas as pd
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+def block_signatures(names, width, height, x=None, y=None):
+    """方块行签名；给出 x / y 时坐标也参与比较"""
+    columns = {"name": np.asarray(names, dtype=object), "width": width, "height": height}
+    if x is not None:
+        columns.update(x=x, y=y)
+    return _signatures(columns)
+
+
+def relation_signatures(start, end, line):
+    return _signatures({"start": start, "end": end, "line": np.asarray(line, dtype=np.int64)})
+
+
+def _surplus(keys, other):
+    """
+    keys 中多出来的元素下标（多重集合差 keys - other）。
+
+    相同签名的元素按出现顺序编号，第 k 个只有在 other 中该签名不足 k + 1 个时才算多出。
+    """
+    order = np.argsort(keys, kind="stable")
+    ordered = keys[order]
+    first = np.searchsorted(ordered, ordered, side="left")
+    rank = np.arange(len(ordered)) - first
+    other = np.sort(other)
+    available = (np.searchsorted(other, ordered, side="right")
+                 - np.searchsorted(other, ordered, side="left"))
+    return np.sort(order[rank >= available])
+
+
+# ====================== 差异 ======================
+class DiagramDiff:
+    """
+    当前图表与新数据表之间的差异。
+
+    added_blocks / updated_blocks / added_relations 为新数据表中的行号；
+    removed_blocks 为要删除的方块编号，removed_edges 为要删除的连线 uid
+    （不含随删除的方块一起消失的连线）。
+    """
+    __slots__ = ("added_blocks", "removed_blocks", "updated_blocks",
+                 "added_relations", "removed_edges")
+
+    def __init__(self, added_blocks, removed_blocks, updated_blocks, added_relations,
+                 removed_edges):
+        self.added_blocks = added_blocks
+        self.removed_blocks = removed_blocks
+        self.updated_blocks = updated_blocks
+        self.added_relations = added_relations
+        self.removed_edges = removed_edges
+
+    def __len__(self):
+        return (len(self.added_blocks) + len(self.removed_blocks) + len(self.updated_blocks)
+                + len(self.added_relations) + len(self.removed_edges))
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def summary(self):
+        return (f"新增 {len(self.added_blocks)} 个、删除 {len(self.removed_blocks)} 个、"
+                f"修改 {len(self.updated_blocks)} 个模块，新增 {len(self.added_relations)} 条、"
+                f"删除 {len(self.removed_edges)} 条连线")
+
+
+def diff_diagram(model, blocks, relations, compare_positions=False):
+    """
+    按编号比较 DiagramModel 与新的数据表。
+
+    方块以 (名称, 宽, 高[, X, Y]) 的哈希签名判断是否修改；连线没有编号，
+    以 (起始编号, 结束编号, 线型) 的签名按多重集合比较，线型变化视为删除加新增。
+
+    参数:
+        compare_positions: 为 True 时坐标变化也算作修改
+    """
+    new_ids = np.asarray(blocks.ids, dtype=np.int64)
+    common, current_rows, new_rows = np.intersect1d(model.ids, new_ids, assume_unique=True,
+                                                    return_indices=True)
+    added_blocks = np.setdiff1d(np.arange(len(new_ids)), new_rows)
+    removed = np.ones(len(model), dtype=bool)
+    removed[current_rows] = False
+    removed_blocks = model.ids[removed]
+
+    current_xy = incoming_xy = (None, None)
+    if compare_positions:
+        current_xy = (model.x[current_rows], model.y[current_rows])
+        incoming_xy = (np.asarray(blocks.x)[new_rows], np.asarray(blocks.y)[new_rows])
+    current = block_signatures(model.names[current_rows], model.width[current_rows],
+                               model.height[current_rows], *current_xy)
+    incoming = block_signatures(np.asarray(blocks.names)[new_rows],
+                                np.asarray(blocks.width)[new_rows],
+                                np.asarray(blocks.height)[new_rows], *incoming_xy)
+    updated_blocks = np.sort(new_rows[current != incoming])
+
+    current = relation_signatures(model.edge_start, model.edge_end, model.edge_line)
+    incoming = relation_signatures(relations.start, relations.end, relations.line)
+    stale = _surplus(current, incoming)
+    # 删除方块时会连带删除它的连线，这些连线不再单独删除
+    start, end = model.edge_rows()
+    stale = stale[~(removed[start[stale]] | removed[end[stale]])]
+    return DiagramDiff(added_blocks, removed_blocks, updated_blocks,
+                       _surplus(incoming, current), model.edge_uid[stale])
+
+
+def merge_positions(model, blocks, relations, keep_positions=True):
+    """
+    为合并准备新数据表的坐标，结果写回 blocks.x / blocks.y。
+
+    已有的方块沿用当前坐标（keep_positions 为 False 时只补齐缺失的坐标），
+    新方块缺少坐标时避开已有方块分散放置。
+    """
+    x = np.array(blocks.x, dtype=np.float64)
+    y = np.array(blocks.y, dtype=np.float64)
+    _, current_rows, new_rows = np.intersect1d(model.ids, np.asarray(blocks.ids, dtype=np.int64),
+                                               assume_unique=True, return_indices=True)
+    if not keep_positions:
+        missing = np.isnan(x[new_rows]) | np.isnan(y[new_rows])
+        current_rows, new_rows = current_rows[missing], new_rows[missing]
+    x[new_rows] = model.x[current_rows]
+    y[new_rows] = model.y[current_rows]
+    blocks.x, blocks.y = x, y
+    return position_blocks(blocks, relations)
@@ -0,0 +1,393 @@
+import json
+import mmap
+import os
+import struct
+import numpy as np
+
+# pandas 和 Excel 引擎导入较慢，只在读写 Excel 的函数内部导入，
+# 启动程序和读写原生工程文件都不需要加载它们
+
+# ====================== 表格列定义 ======================
+GROUP_SHEET = "group"
+RELATION_SHEET = "relation"
+
+COL_ID = "序号"
+COL_NAME = "group"
+COL_X = "X"
+COL_Y = "Y"
+COL_WIDTH = "Width"
+COL_HEIGHT = "Height"
+
+COL_START = "起始编号"
+COL_END = "结束编号"
+COL_LINE = "线型"
+
+# 分组：group 表的 "分组" 列为方块直接所属的分组编号，cluster 表定义分组的嵌套关系
+CLUSTER_SHEET = "cluster"
+COL_CLUSTER = "分组"
+COL_CLUSTER_ID = "编号"
+COL_CLUSTER_NAME = "名称"
+COL_CLUSTER_PARENT = "上级编号"
+COL_CLUSTER_COLLAPSED = "折叠"
+
+DEFAULT_NAME = "未知模块"
+DEFAULT_WIDTH = 100
+DEFAULT_HEIGHT = 60
+LINE_NUMBERS = (1, 2, 3, 4)
+
+EXCEL_SUFFIX = ".xlsx"
+NATIVE_SUFFIX = ".fcd"
+
+
+# ====================== 列式数据表 ======================
+class BlockTable:
+    """按列存储的工作组数据，X/Y 为 NaN 表示位置待定"""
+    __slots__ = ("ids", "names", "x", "y", "width", "height")
+
+    def __init__(self, ids, names, x, y, width, height):
+        self.ids = ids
+        self.names = names
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __len__(self):
+        return len(self.ids)
+
+    def missing_position(self):
+        return np.isnan(self.x) | np.isnan(self.y)
+
+
+class RelationTable:
+    """按列存储的连线数据，线型为 LineType.to_number() 的编号"""
+    __slots__ = ("start", "end", "line")
+
+    def __init__(self, start, end, line):
+        self.start = start
+        self.end = end
+        self.line = line
+
+    def __len__(self):
+        return len(self.start)
+
+
+class ClusterTable:
+    """
+    按列存储的分组数据：ids / names / parents（0 为顶层）/ collapsed 描述分组，
+    block_ids / block_clusters 为方块编号及其直接所属的分组编号。
+    """
+    __slots__ = ("ids", "names", "parents", "collapsed", "block_ids", "block_clusters")
+
+    def __init__(self, ids, names, parents, collapsed, block_ids, block_clusters):
+        self.ids = ids
+        self.names = names
+        self.parents = parents
+        self.collapsed = collapsed
+        self.block_ids = block_ids
+        self.block_clusters = block_clusters
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object),
+                   np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool),
+                   np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+
+def _float_column(df, column, default):
+    import pandas as pd
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=np.float64)
+    values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    if default is not None:
+        values[np.isnan(values)] = default
+    return values
+
+
+def _int_column(df, column, sheet):
+    import pandas as pd
+    if column not in df.columns:
+        raise ValueError(f"{sheet} 表缺少列: {column}")
+    values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+    invalid = np.isnan(values) | (values != np.round(values))
+    if invalid.any():
+        row = int(np.flatnonzero(invalid)[0]) + 2
+        raise ValueError(f"{sheet} 表第 {row} 行的 {column} 不是整数")
+    return values.astype(np.int64)
+
+
+def block_table_from_frame(df):
+    """校验并按列转换 group 表"""
+    import pandas as pd
+    ids = _int_column(df, COL_ID, GROUP_SHEET)
+    unique, counts = np.unique(ids, return_counts=True)
+    if (counts > 1).any():
+        raise ValueError(f"{GROUP_SHEET} 表存在重复的{COL_ID}: {unique[counts > 1][0]}")
+
+    if COL_NAME in df.columns:
+        names = df[COL_NAME].to_numpy(dtype=object)
+        names[pd.isna(names)] = DEFAULT_NAME
+    else:
+        names = np.full(len(df), DEFAULT_NAME, dtype=object)
+
+    return BlockTable(
+        ids=ids,
+        names=names,
+        x=_float_column(df, COL_X, None),
+        y=_float_column(df, COL_Y, None),
+        width=_float_column(df, COL_WIDTH, DEFAULT_WIDTH),
+        height=_float_column(df, COL_HEIGHT, DEFAULT_HEIGHT),
+    )
+
+
+def relation_table_from_frame(df):
+    """校验并按列转换 relation 表"""
+    line = _int_column(df, COL_LINE, RELATION_SHEET)
+    invalid = ~np.isin(line, LINE_NUMBERS)
+    if invalid.any():
+        row = int(np.flatnonzero(invalid)[0]) + 2
+        raise ValueError(f"{RELATION_SHEET} 表第 {row} 行的{COL_LINE}无效: {line[invalid][0]}")
+    return RelationTable(
+        start=_int_column(df, COL_START, RELATION_SHEET),
+        end=_int_column(df, COL_END, RELATION_SHEET),
+        line=line.astype(np.int8),
+    )
+
+
+def cluster_table_from_frames(group, cluster):
+    """由 group 表的分组列和 cluster 表（可以为 None）得到 ClusterTable"""
+    import pandas as pd
+    if cluster is None or not len(cluster):
+        return ClusterTable.empty()
+    ids = _int_column(cluster, COL_CLUSTER_ID, CLUSTER_SHEET)
+    if COL_CLUSTER_NAME in cluster.columns:
+        names = cluster[COL_CLUSTER_NAME].to_numpy(dtype=object)
+        missing = pd.isna(names)
+        names[missing] = [f"分组{i}" for i in ids[missing].tolist()]
+    else:
+        names = np.array([f"分组{i}" for i in ids.tolist()], dtype=object)
+    members = _float_column(group, COL_CLUSTER, 0.0)
+    assigned = members != 0
+    return ClusterTable(
+        ids=ids,
+        names=names,
+        parents=_float_column(cluster, COL_CLUSTER_PARENT, 0.0).astype(np.int64),
+        collapsed=_float_column(cluster, COL_CLUSTER_COLLAPSED, 0.0) != 0,
+        block_ids=_int_column(group, COL_ID, GROUP_SHEET)[assigned],
+        block_clusters=members[assigned].astype(np.int64),
+    )
+
+
+def resolve_endpoints(block_ids, relations):
+    """
+    把连线两端的编号向量化地映射为 block_ids 中的下标。
+
+    返回:
+        (start_index, end_index): 与 relations 等长的下标数组
+    """
+    order = np.argsort(block_ids, kind="stable")
+    sorted_ids = block_ids[order]
+    result = []
+    for ids in (relations.start, relations.end):
+        pos = np.searchsorted(sorted_ids, ids)
+        found = pos < len(sorted_ids)
+        found[found] = sorted_ids[pos[found]] == ids[found]
+        if not found.all():
+            raise ValueError(f"{RELATION_SHEET} 表引用了不存在的编号: {ids[~found][0]}")
+        result.append(order[pos])
+    return result[0], result[1]
+
+
+def read_excel(path, clusters=False):
+    """
+    读取 Excel 工作簿，返回 (BlockTable, RelationTable)；
+    clusters 为 True 时再返回 ClusterTable，没有 cluster 表时为空表。
+    """
+    import pandas as pd
+    with pd.ExcelFile(path) as book:
+        names = [GROUP_SHEET, RELATION_SHEET]
+        if clusters and CLUSTER_SHEET in book.sheet_names:
+            names.append(CLUSTER_SHEET)
+        sheets = pd.read_excel(book, sheet_name=names)
+    tables = (block_table_from_frame(sheets[GROUP_SHEET]),
+              relation_table_from_frame(sheets[RELATION_SHEET]))
+    if clusters:
+        tables += (cluster_table_from_frames(sheets[GROUP_SHEET], sheets.get(CLUSTER_SHEET)),)
+    return tables
+
+
+def write_excel(path, blocks, relations, clusters=None):
+    """把数据表写成 group / relation 两个工作表，有分组时加上分组列和 cluster 表"""
+    import pandas as pd
+    modules = pd.DataFrame({
+        COL_ID: blocks.ids,
+        COL_NAME: blocks.names,
+        COL_X: blocks.x,
+        COL_Y: blocks.y,
+        COL_WIDTH: blocks.width,
+        COL_HEIGHT: blocks.height,
+    })
+    connections = pd.DataFrame({
+        COL_START: relations.start,
+        COL_END: relations.end,
+        COL_LINE: relations.line,
+    })
+    groups = None
+    if clusters is not None and len(clusters):
+        member_of = pd.Series(clusters.block_clusters, index=clusters.block_ids)
+        modules[COL_CLUSTER] = pd.Series(blocks.ids).map(member_of).astype("Int64")
+        groups = pd.DataFrame({
+            COL_CLUSTER_ID: clusters.ids,
+            COL_CLUSTER_NAME: clusters.names,
+            COL_CLUSTER_PARENT: clusters.parents,
+            COL_CLUSTER_COLLAPSED: np.asarray(clusters.collapsed, dtype=np.int8),
+        })
+    with pd.ExcelWriter(path) as writer:
+        modules.to_excel(writer, sheet_name=GROUP_SHEET, index=False)
+        connections.to_excel(writer, sheet_name=RELATION_SHEET, index=False)
+        if groups is not None:
+            groups.to_excel(writer, sheet_name=CLUSTER_SHEET, index=False)
+
+
+# ====================== 原生工程文件 ======================
+# 文件结构: 魔数(8) | 版本(uint32) | 头长度(uint32) | JSON 头 | 按 64 字节对齐的数组区
+# JSON 头记录每个数组的 dtype、相对数组区的偏移和元素个数，读取时直接映射为 numpy 数组
+NATIVE_MAGIC = b"FCDIAG\0\0"
+NATIVE_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _encode_names(names):
+    encoded = [str(name).encode("utf-8") for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_names(data, offsets):
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    names = np.empty(len(bounds) - 1, dtype=object)
+    names[:] = [raw[a:b].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+    return names
+
+
+def write_native(path, blocks, relations, clusters=None):
+    """写入原生工程文件，先写临时文件再替换，避免保存中断损坏原文件"""
+    name_data, name_offsets = _encode_names(blocks.names)
+    arrays = {
+        "block.ids": np.ascontiguousarray(blocks.ids, dtype="<i8"),
+        "block.x": np.ascontiguousarray(blocks.x, dtype="<f8"),
+        "block.y": np.ascontiguousarray(blocks.y, dtype="<f8"),
+        "block.width": np.ascontiguousarray(blocks.width, dtype="<f8"),
+        "block.height": np.ascontiguousarray(blocks.height, dtype="<f8"),
+        "block.name_offsets": name_offsets,
+        "block.name_data": name_data,
+        "relation.start": np.ascontiguousarray(relations.start, dtype="<i8"),
+        "relation.end": np.ascontiguousarray(relations.end, dtype="<i8"),
+        "relation.line": np.ascontiguousarray(relations.line, dtype="|i1"),
+    }
+    # 分组数组是可选的，旧版本读取时忽略不认识的数组
+    if clusters is not None and len(clusters):
+        cluster_data, cluster_offsets = _encode_names(clusters.names)
+        arrays.update({
+            "cluster.ids": np.ascontiguousarray(clusters.ids, dtype="<i8"),
+            "cluster.parents": np.ascontiguousarray(clusters.parents, dtype="<i8"),
+            "cluster.collapsed": np.ascontiguousarray(clusters.collapsed, dtype="|u1"),
+            "cluster.name_offsets": cluster_offsets,
+            "cluster.name_data": cluster_data,
+            "cluster.block_ids": np.ascontiguousarray(clusters.block_ids, dtype="<i8"),
+            "cluster.block_clusters": np.ascontiguousarray(clusters.block_clusters, dtype="<i8"),
+        })
+    directory = {}
+    offset = 0
+    for key, array in arrays.items():
+        directory[key] = {"dtype": array.dtype.str, "offset": offset, "length": len(array)}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({"arrays": directory}).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(NATIVE_MAGIC, NATIVE_VERSION, len(header)))
+        f.write(header)
+        for key, array in arrays.items():
+            f.seek(data_start + directory[key]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_native(path, clusters=False):
+    """
+    内存映射方式读取原生工程文件，clusters 的含义同 read_excel。
+
+    数值列直接引用映射内存，不做拷贝；映射在所有返回的数组释放后关闭。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _PREAMBLE.size:
+            raise ValueError("文件已损坏或不是流程图工程文件")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_len = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != NATIVE_MAGIC:
+        raise ValueError("不是流程图工程文件")
+    if version > NATIVE_VERSION:
+        raise ValueError(f"不支持的工程文件版本: {version}")
+    header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_len]))
+    data_start = _align(_PREAMBLE.size + header_len)
+
+    def array(key):
+        entry = header["arrays"][key]
+        return np.frombuffer(buffer, dtype=np.dtype(entry["dtype"]),
+                             count=entry["length"],
+                             offset=data_start + entry["offset"])
+
+    blocks = BlockTable(
+        ids=array("block.ids"),
+        names=_decode_names(array("block.name_data"), array("block.name_offsets")),
+        x=array("block.x"),
+        y=array("block.y"),
+        width=array("block.width"),
+        height=array("block.height"),
+    )
+    relations = RelationTable(
+        start=array("relation.start"),
+        end=array("relation.end"),
+        line=array("relation.line"),
+    )
+    if not clusters:
+        return blocks, relations
+    if "cluster.ids" not in header["arrays"]:
+        return blocks, relations, ClusterTable.empty()
+    return blocks, relations, ClusterTable(
+        ids=array("cluster.ids"),
+        names=_decode_names(array("cluster.name_data"), array("cluster.name_offsets")),
+        parents=array("cluster.parents"),
+        collapsed=array("cluster.collapsed").astype(bool),
+        block_ids=array("cluster.block_ids"),
+        block_clusters=array("cluster.block_clusters"),
+    )
+
+
+def read_diagram(path, clusters=False):
+    """按扩展名选择读取方式，clusters 为 True 时同时返回 ClusterTable"""
+    if os.path.splitext(path)[1].lower() == NATIVE_SUFFIX:
+        return read_native(path, clusters)
+    return read_excel(path, clusters)
+
+
+def write_diagram(path, blocks, relations, clusters=None):
+    """按扩展名选择写入方式，clusters 为 ClusterTable 或 None"""
+    if os.path.splitext(path)[1].lower() == NATIVE_SUFFIX:
+        write_native(path, blocks, relations, clusters)
+    else:
+        write_excel(path, blocks, relations, clusters)
@@ -0,0 +1,293 @@
+import numpy as np
+
+import diagram_io
+
+BLOCK_COLUMNS = ("ids", "names", "x", "y", "width", "height", "_order")
+EDGE_COLUMNS = ("edge_uid", "edge_start", "edge_end", "edge_line")
+# 缓冲区容量不足时翻倍，最少这么多行
+MIN_CAPACITY = 1024
+
+
+# ====================== 图表数据模型 ======================
+class DiagramModel:
+    """
+    与 Qt 无关的图表数据，方块和连线各自以列式数组保存。
+
+    方块按行存放，row_of 为 编号 -> 行号；连线用递增的 uid 标识，
+    删除连线不影响其他连线的 uid，edge_uid 始终保持升序。
+    导出、校验、布局和分析都直接读这些数组，不需要遍历图元。
+
+    各列是按容量翻倍的缓冲区的前 n 行视图，逐个新增为均摊 O(1)。删除单个方块时
+    把最后一行移到它的位置，行号因此会变化；_order 记录方块的加入顺序，
+    to_tables 按它输出，导出文件中的顺序不受删除影响。
+    """
+    __slots__ = BLOCK_COLUMNS + EDGE_COLUMNS + ("row_of", "_buffers", "_next_order", "_next_uid",
+                                                "_edge_rows")
+
+    def __init__(self, blocks=None, relations=None):
+        if blocks is None:
+            blocks = diagram_io.BlockTable(
+                ids=np.empty(0, dtype=np.int64), names=np.empty(0, dtype=object),
+                x=np.empty(0), y=np.empty(0), width=np.empty(0), height=np.empty(0))
+        if relations is None:
+            relations = diagram_io.RelationTable(
+                start=np.empty(0, dtype=np.int64), end=np.empty(0, dtype=np.int64),
+                line=np.empty(0, dtype=np.int8))
+        # 复制一份，读入的数组可能是只读的内存映射
+        self._buffers = {
+            "ids": np.array(blocks.ids, dtype=np.int64),
+            "names": np.array(blocks.names, dtype=object),
+            "x": np.array(blocks.x, dtype=np.float64),
+            "y": np.array(blocks.y, dtype=np.float64),
+            "width": np.array(blocks.width, dtype=np.float64),
+            "height": np.array(blocks.height, dtype=np.float64),
+            "_order": np.arange(len(blocks), dtype=np.int64),
+            "edge_uid": np.arange(len(relations), dtype=np.int64),
+            "edge_start": np.array(relations.start, dtype=np.int64),
+            "edge_end": np.array(relations.end, dtype=np.int64),
+            "edge_line": np.array(relations.line, dtype=np.int8),
+        }
+        self._resize(BLOCK_COLUMNS, len(blocks))
+        self._resize(EDGE_COLUMNS, len(relations))
+        self._next_order = len(blocks)
+        self._next_uid = len(relations)
+        self._rows_changed()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_uid)
+
+    def _rows_changed(self):
+        self.row_of = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        self._edge_rows = None
+
+    # ---------- 缓冲区 ----------
+    def _resize(self, columns, n):
+        """把 columns 的公开数组设为缓冲区的前 n 行"""
+        for name in columns:
+            setattr(self, name, self._buffers[name][:n])
+
+    def _append(self, columns, values):
+        """在 columns 末尾追加一行，容量不足时翻倍"""
+        buffers = self._buffers
+        n = len(getattr(self, columns[0]))
+        if n == len(buffers[columns[0]]):
+            capacity = max(2 * n, MIN_CAPACITY)
+            for name in columns:
+                grown = np.empty(capacity, dtype=buffers[name].dtype)
+                grown[:n] = buffers[name][:n]
+                buffers[name] = grown
+        for name, value in zip(columns, values):
+            buffers[name][n] = value
+        self._resize(columns, n + 1)
+
+    # ---------- 查询 ----------
+    def edge_rows(self):
+        """返回 (src, dst)：连线两端在方块数组中的行号"""
+        if self._edge_rows is None:
+            order = np.argsort(self.ids, kind="stable")
+            sorted_ids = self.ids[order]
+            self._edge_rows = (order[np.searchsorted(sorted_ids, self.edge_start)],
+                               order[np.searchsorted(sorted_ids, self.edge_end)])
+        return self._edge_rows
+
+    def edge_index(self, uid):
+        """uid 对应连线在连线数组中的位置，连线不存在（如已删除）时抛出 KeyError"""
+        i = int(np.searchsorted(self.edge_uid, uid))
+        if i == len(self.edge_uid) or self.edge_uid[i] != uid:
+            raise KeyError(f"找不到连线 uid {uid}")
+        return i
+
+    def find_edge(self, start, end, line):
+        """按两端编号和线型编号查找连线，返回 uid"""
+        match = np.flatnonzero((self.edge_start == start) & (self.edge_end == end)
+                               & (self.edge_line == line))
+        if not len(match):
+            raise KeyError(f"找不到连线 {start} -> {end}")
+        return int(self.edge_uid[match[0]])
+
+    def incident_edges(self, block_id):
+        """与方块相连的全部连线 uid"""
+        return self.edge_uid[(self.edge_start == block_id) | (self.edge_end == block_id)]
+
+    def centers(self):
+        return self.x + self.width / 2, self.y + self.height / 2
+
+    def bounds(self):
+        """返回 (x0, y0, x1, y1)，没有方块时返回 None"""
+        if not len(self.ids):
+            return None
+        return (float(self.x.min()), float(self.y.min()),
+                float((self.x + self.width).max()), float((self.y + self.height).max()))
+
+    def blocks_in(self, x0, y0, x1, y1):
+        """与矩形区域相交的方块掩码"""
+        return ((self.x <= x1) & (self.x + self.width >= x0)
+                & (self.y <= y1) & (self.y + self.height >= y0))
+
+    def edges_through(self, x0, y0, x1, y1):
+        """外接矩形与区域相交的连线掩码，保守但足够便宜"""
+        start, end = self.edge_rows()
+        cx, cy = self.centers()
+        sx, ex, sy, ey = cx[start], cx[end], cy[start], cy[end]
+        return ((np.minimum(sx, ex) <= x1) & (np.maximum(sx, ex) >= x0)
+                & (np.minimum(sy, ey) <= y1) & (np.maximum(sy, ey) >= y0))
+
+    def to_tables(self):
+        """导出为 (BlockTable, RelationTable)，数组均为副本，方块按加入顺序排列"""
+        order = self._order
+        if len(order) > 1 and not (order[1:] > order[:-1]).all():
+            rows = np.argsort(order, kind="stable")
+        else:
+            rows = slice(None)
+        blocks = diagram_io.BlockTable(ids=self.ids[rows].copy(), names=self.names[rows].copy(),
+                                       x=self.x[rows].copy(), y=self.y[rows].copy(),
+                                       width=self.width[rows].copy(),
+                                       height=self.height[rows].copy())
+        relations = diagram_io.RelationTable(start=self.edge_start.copy(),
+                                             end=self.edge_end.copy(),
+                                             line=self.edge_line.copy())
+        return blocks, relations
+
+    # ---------- 修改 ----------
+    def add_block(self, block_id, name, x, y, width, height):
+        # 新方块没有连线，已有连线两端的行号不变
+        self._append(BLOCK_COLUMNS, (block_id, name, x, y, width, height, self._next_order))
+        self._next_order += 1
+        self.row_of[block_id] = len(self.ids) - 1
+
+    def remove_block(self, block_id):
+        """删除方块及其全部连线，返回被删除连线的 uid 数组"""
+        row = self.row_of.pop(block_id)
+        last = len(self.ids) - 1
+        if row != last:
+            self.row_of[int(self.ids[last])] = row
+            for name in BLOCK_COLUMNS:
+                column = getattr(self, name)
+                column[row] = column[last]
+        self._buffers["names"][last] = None
+        self._resize(BLOCK_COLUMNS, last)
+        incident = np.flatnonzero((self.edge_start == block_id) | (self.edge_end == block_id))
+        removed = self.edge_uid[incident]
+        self._drop_edges(incident)
+        self._edge_rows = None
+        return removed
+
+    def remove_blocks(self, block_ids, edge_uids=()):
+        """
+        一次删除多个方块、它们的全部连线以及 edge_uids 中的连线，返回被删除连线的 uid 数组。
+
+        方块和连线各按一个掩码压缩（保持原有顺序），row_of 只重建一次。
+        """
+        block_ids = np.asarray(block_ids, dtype=np.int64)
+        drop = self._removed_edges(block_ids, edge_uids)
+        removed = self.edge_uid[drop]
+        self._compact(BLOCK_COLUMNS, ~np.isin(self.ids, block_ids))
+        self._compact(EDGE_COLUMNS, ~drop)
+        self._rows_changed()
+        return removed
+
+    def removal(self, block_ids, edge_uids=()):
+        """
+        remove_blocks(block_ids, edge_uids) 将删除的数据，在删除之前调用。
+
+        返回:
+            (BlockTable, RelationTable, 连线 uid 数组)，数组均为副本，方块按 block_ids 的顺序排列
+        """
+        block_ids = np.asarray(block_ids, dtype=np.int64)
+        rows = np.array([self.row_of[block_id] for block_id in block_ids.tolist()], dtype=np.int64)
+        drop = self._removed_edges(block_ids, edge_uids)
+        blocks = diagram_io.BlockTable(ids=self.ids[rows], names=self.names[rows],
+                                       x=self.x[rows], y=self.y[rows],
+                                       width=self.width[rows], height=self.height[rows])
+        relations = diagram_io.RelationTable(start=self.edge_start[drop], end=self.edge_end[drop],
+                                             line=self.edge_line[drop])
+        return blocks, relations, self.edge_uid[drop]
+
+    def _removed_edges(self, block_ids, edge_uids):
+        """与 block_ids 中的方块相连或 uid 在 edge_uids 中的连线的掩码"""
+        return (np.isin(self.edge_start, block_ids) | np.isin(self.edge_end, block_ids)
+                | np.isin(self.edge_uid, np.asarray(edge_uids, dtype=np.int64)))
+
+    def edit_block(self, old_id, block_id, name, width, height):
+        row = self.row_of.pop(old_id)
+        self.row_of[block_id] = row
+        self.ids[row] = block_id
+        self.names[row] = name
+        self.width[row] = width
+        self.height[row] = height
+        if old_id != block_id:
+            # 行号不变，edge_rows 的缓存仍然有效
+            self.edge_start[self.edge_start == old_id] = block_id
+            self.edge_end[self.edge_end == old_id] = block_id
+
+    def set_positions(self, ids, x, y):
+        """按编号批量设置左上角坐标，不存在的编号跳过"""
+        rows = np.array([self.row_of.get(block_id, -1) for block_id in ids], dtype=np.int64)
+        keep = rows >= 0
+        self.x[rows[keep]] = np.asarray(x, dtype=np.float64)[keep]
+        self.y[rows[keep]] = np.asarray(y, dtype=np.float64)[keep]
+
+    def set_centers(self, ids, center_x, center_y):
+        """按编号批量设置中心坐标（布局结果）"""
+        rows = np.array([self.row_of.get(block_id, -1) for block_id in ids], dtype=np.int64)
+        keep = rows >= 0
+        rows = rows[keep]
+        self.x[rows] = np.asarray(center_x)[keep] - self.width[rows] / 2
+        self.y[rows] = np.asarray(center_y)[keep] - self.height[rows] / 2
+
+    def add_edge(self, start, end, line):
+        uid = self._next_uid
+        self._next_uid += 1
+        self._append(EDGE_COLUMNS, (uid, start, end, line))
+        if self._edge_rows is not None:
+            # 缓存的行号数组可能被调用方持有，追加时生成新数组而不是原地修改
+            src, dst = self._edge_rows
+            self._edge_rows = (np.append(src, self.row_of[start]), np.append(dst, self.row_of[end]))
+        return uid
+
+    def remove_edge(self, uid):
+        i = self.edge_index(uid)
+        self._drop_edges([i])
+        if self._edge_rows is not None:
+            self._edge_rows = tuple(np.delete(rows, i) for rows in self._edge_rows)
+
+    def set_edge_line(self, uid, line):
+        self.edge_line[self.edge_index(uid)] = line
+
+    def truncate(self, n_blocks, n_edges):
+        """只保留前 n_blocks 个方块和前 n_edges 条连线（分块导入中途取消时使用）"""
+        self._resize(BLOCK_COLUMNS, n_blocks)
+        self._resize(EDGE_COLUMNS, n_edges)
+        self._rows_changed()
+
+    def _compact(self, columns, keep):
+        """columns 只保留 keep 为 True 的行，顺序不变"""
+        n, kept = len(keep), int(np.count_nonzero(keep))
+        for name in columns:
+            self._buffers[name][:kept] = getattr(self, name)[keep]
+        if "names" in columns:
+            # 释放删除的名称对象
+            self._buffers["names"][kept:n] = None
+        self._resize(columns, kept)
+
+    def _drop_edges(self, positions):
+        """
+        删除给定位置（升序）的连线。
+
+        连线须按 uid 保持升序，这里把各段依次前移；删除的条数很少时比按掩码重新复制快得多。
+        """
+        n = len(self.edge_uid)
+        if not len(positions):
+            return
+        bounds = np.append(positions, n).tolist()
+        for name in EDGE_COLUMNS:
+            column = self._buffers[name]
+            write = bounds[0]
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                column[write:write + hi - lo - 1] = column[lo + 1:hi]
+                write += hi - lo - 1
+        self._resize(EDGE_COLUMNS, n - len(positions))
@@ -1,15 +1,41 @@
 import sys
 import os
-import pandas as pd
-import random
+import glob
+import uuid
+# 最先导入，启动计时从这里开始
+from profiler import PROFILER, STARTUP
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import diagram_io
+from diagram_model import DiagramModel
+from diagram_diff import diff_diagram, merge_positions
+from journal import Journal, clusters_op
+from placement import PlacementEngine
+import routing
+from routing import EdgeRouter, offset_polyline
+from graph_analysis import DiagramGraph, top_k
+from search_index import SearchIndex, parse_query
+from clusters import ClusterTree, aggregate_edges
+from minimap import MinimapRaster, PALETTE
+from png_writer import PngStreamWriter
+from graph_layout import layered_layout, force_directed_layout, position_blocks
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QGraphicsView, QGraphicsScene, QGraphicsRectItem,
     QMenu, QAction, QVBoxLayout, QWidget, QPushButton, QFileDialog, QGraphicsTextItem,
     QToolBar, QMessageBox, QInputDialog, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QGraphicsPathItem,
-    QGraphicsLineItem, QGraphicsPixmapItem, QSlider, QHBoxLayout, QLabel
+    QGraphicsLineItem, QSlider, QHBoxLayout, QLabel, QStyleOptionGraphicsItem,
+    QProgressDialog, QUndoStack, QUndoCommand, QGraphicsItem, QActionGroup, QDockWidget,
+    QListWidget, QListWidgetItem, QCheckBox, QGridLayout
+)
+from PyQt5.QtCore import (
+    Qt, QPoint, QPointF, QLineF, QRectF, QSize, QSizeF, QMarginsF, QTimer, QThread, QObject,
+    QVariantAnimation, QEasingCurve, QEvent, QLockFile, pyqtSignal
+)
+from PyQt5.QtGui import (
+    QBrush, QPen, QColor, QPainter, QTransform, QCursor, QPainterPath, QIcon, QPixmap, QKeySequence,
+    QImage, QPolygonF, QPainterPathStroker, QPdfWriter, QPageSize, QPageLayout
 )
-from PyQt5.QtCore import Qt, QPointF, QLineF, QRectF, QSizeF
-from PyQt5.QtGui import QBrush, QPen, QColor, QPainter, QTransform, QCursor, QPainterPath, QIcon, QPixmap
 from enum import Enum
 
 def resource_path(relative_path):
@@ -20,6 +46,18 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+# 文件对话框过滤器及其默认扩展名，Excel 作为交换格式保留
+FILE_FILTERS = ["Excel 文件 (*.xlsx)", "流程图工程文件 (*.fcd)"]
+FILE_SUFFIXES = {
+    FILE_FILTERS[0]: diagram_io.EXCEL_SUFFIX,
+    FILE_FILTERS[1]: diagram_io.NATIVE_SUFFIX,
+}
+IMAGE_FILTERS = ["PNG 图片 (*.png)", "SVG 矢量图 (*.svg)", "PDF 文档 (*.pdf)"]
+IMAGE_SUFFIXES = dict(zip(IMAGE_FILTERS, (".png", ".svg", ".pdf")))
+# 一次有超过这个数量的图元进出场景或改变几何时暂停场景索引，结束后整体重建：
+# 长连线逐个移出 BSP 树或更新位置，单条就可能比整体重建索引还慢
+BULK_THRESHOLD = 50
+
 def generate_scattered_position(placed_positions, width, height,
                                 center=(0, 0),
                                 spread=1000, spacing=200):
@@ -30,25 +68,18 @@ def generate_scattered_position(placed_positions, width, height,
         placed_positions: 已放置的 (x, y, w, h) 列表
         width, height: 当前模块的宽高
         center: 分布中心点 (x, y)
-        spread: 随机分布范围（半径）
+        spread: 随机分布范围（半径），区域放满时会自动扩大
         spacing: 模块之间最小间距
 
     返回:
         (x, y): 合适的位置
+
+    批量放置时请直接使用 PlacementEngine，避免每次调用都重建索引。
     """
-    cx, cy = center
-    attempts = 0
-    # 第一个模块直接放在中心
-    if not placed_positions:
-        return cx, cy
-    while attempts < 500:
-        x = cx + random.randint(-spread, spread)
-        y = cy + random.randint(-spread, spread)
-        if not is_overlapping(x, y, width, height, placed_positions, spacing):
-            return x, y
-        attempts += 1
-    # 如果找不到合适位置，返回中心点
-    return cx, cy
+    engine = PlacementEngine(center=center, spread=spread, spacing=spacing)
+    for px, py, pw, ph in placed_positions:
+        engine.add(px, py, pw, ph)
+    return engine.place(width, height)
 
 def is_overlapping(x, y, width, height, placed_positions, spacing=20):
     for px, py, pw, ph in placed_positions:
@@ -86,6 +117,15 @@ class LineType(Enum):
     def get_style(self):
         return Qt.SolidLine if self == LineType.SINGLE else Qt.SolidLine
 
+    def get_pen(self):
+        """同一线型共用一支画笔，避免每次重绘连线都新建 QPen"""
+        pen = _PEN_CACHE.get(self)
+        if pen is None:
+            pen = QPen(self.get_color(), 2)
+            pen.setStyle(self.get_style())
+            _PEN_CACHE[self] = pen
+        return pen
+
     def to_number(self):
         mapping = {
             LineType.SINGLE: 4,
@@ -104,6 +144,28 @@ class LineType(Enum):
         }
         return mapping[number]
 
+    def from_numbers(numbers):
+        """向量化版本的 from_number，numbers 为整数数组"""
+        return _LINE_TYPES_BY_NUMBER[np.asarray(numbers, dtype=np.intp)]
+
+
+_PEN_CACHE = {}
+
+# 按编号下标查找线型，0 号位置不使用
+_LINE_TYPES_BY_NUMBER = np.array(
+    [None, LineType.QUADRUPLE, LineType.TRIPLE, LineType.DOUBLE, LineType.SINGLE],
+    dtype=object)
+# ====================== 细节层次 ======================
+# 按视图缩放比例逐级简化绘制，缩小查看大图时减少绘制开销
+LOD_HIDE_TEXT = 0.5       # 低于该比例不绘制工作组文字
+LOD_SINGLE_STROKE = 0.4   # 低于该比例多线连线合并为一条
+LOD_PLAIN_BLOCKS = 0.2    # 低于该比例工作组只填充、不画边框
+
+
+def level_of_detail(painter):
+    return QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+
+
 # ====================== 方块编辑对话框 ======================
 class BlockEditDialog(QDialog):
     def __init__(self, parent=None):
@@ -129,6 +191,14 @@ class BlockEditDialog(QDialog):
         self.setLayout(layout)
 
 
+# ====================== 工作组文字 ======================
+class BlockLabel(QGraphicsTextItem):
+    def paint(self, painter, option, widget=None):
+        if level_of_detail(painter) < LOD_HIDE_TEXT:
+            return
+        super().paint(painter, option, widget)
+
+
 # ====================== 可拖拽方块类 ======================
 class DraggableBlock(QGraphicsRectItem):
     _next_id = 1
@@ -140,6 +210,8 @@ class DraggableBlock(QGraphicsRectItem):
         self.id = block_id if block_id is not None else DraggableBlock._next_id
         self.setPos(x, y)
         self.connections = []
+        # 所在分组折叠后方块从场景中移除，移动仍要同步到原来的场景
+        self.detached_scene = None
         self._init_ui()
         self.setAcceptHoverEvents(True)
         self.resizing = False
@@ -159,19 +231,35 @@ class DraggableBlock(QGraphicsRectItem):
 
     def _update_text(self):
         if hasattr(self, 'text'):
-            self.scene().removeItem(self.text)
-        self.text = QGraphicsTextItem(f"ID: {self.id}\n{self.name}", self)
+            self.text.setPlainText(f"ID: {self.id}\n{self.name}")
+            return
+        self.text = BlockLabel(f"ID: {self.id}\n{self.name}", self)
         self.text.setPos(5, 5)
 
     def get_center(self):
         return self.mapToScene(self.rect().center())
 
+    def paint(self, painter, option, widget=None):
+        if level_of_detail(painter) < LOD_PLAIN_BLOCKS:
+            painter.fillRect(self.rect(), self.brush())
+            return
+        super().paint(painter, option, widget)
+
     def itemChange(self, change, value):
+        if change == QGraphicsRectItem.ItemPositionChange:
+            scene = self.scene() or self.detached_scene
+            if isinstance(scene, FlowScene):
+                scene.mark_moving(self)
         # 位置或尺寸变化时更新所有连接线
         if change in [QGraphicsRectItem.ItemPositionHasChanged,
                       QGraphicsRectItem.ItemTransformHasChanged]:
-            for conn in self.connections:
-                conn.update_line()
+            scene = self.scene() or self.detached_scene
+            if isinstance(scene, FlowScene):
+                # 拖动时只标记为脏，每帧统一刷新一次
+                scene.schedule_connection_updates(self.connections)
+            else:
+                for conn in self.connections:
+                    conn.update_line()
         return super().itemChange(change, value)
 
     def contextMenuEvent(self, event):
@@ -180,10 +268,25 @@ class DraggableBlock(QGraphicsRectItem):
         menu = QMenu()
         edit_action = menu.addAction("编辑工作组")
         # delete_action = menu.addAction("删除")
+        scene = self.scene()
+        cluster_actions = {}
+        group_action = menu.addAction("分组选中的工作组")
+        clusters = scene.clusters
+        cluster_id = clusters.members.get(self.id)
+        if cluster_id is not None:
+            for c in clusters.ancestors(cluster_id):
+                cluster_actions[menu.addAction(f"折叠分组「{clusters.clusters[c].name}」")] = c
+            leave_action = menu.addAction("移出分组")
         action = menu.exec_(event.screenPos())
 
         if action == edit_action:
             self.edit_properties()
+        elif action == group_action:
+            scene.group_selection()
+        elif action in cluster_actions:
+            scene.set_collapsed(cluster_actions[action], True)
+        elif cluster_id is not None and action == leave_action:
+            scene.leave_cluster([block.id for block in scene.selected_blocks()])
         # if action == delete_action:
         #     self.delete_block()
 
@@ -196,32 +299,21 @@ class DraggableBlock(QGraphicsRectItem):
 
         if dialog.exec_() == QDialog.Accepted:
             # 更新工作组属性
-            self.name = dialog.name_edit.text()
+            new_name = dialog.name_edit.text()
             new_id = int(dialog.id_edit.text())
             new_width = float(dialog.width_edit.text())
             new_height = float(dialog.height_edit.text())
 
             # 检查ID冲突
-            if new_id != self.id:
-                existing_ids = {block.id for block in self.scene().items()
-                                if isinstance(block, DraggableBlock)}
-                if new_id in existing_ids:
-                    QMessageBox.warning(None, "错误", "ID已存在！")
-                    return
-
-            self.id = new_id
-            self.setRect(0, 0, new_width, new_height)
-            self._update_text()
-
-            # 更新所有相关连接线
-            for conn in self.connections:
-                conn.update_line()
+            scene = self.scene()
+            if new_id != self.id and scene.has_block(new_id):
+                QMessageBox.warning(None, "错误", "ID已存在！")
+                return
+
+            scene.edit_block(self, new_id, new_name, new_width, new_height)
 
     def delete_block(self):
-        # 删除所有关联的连接线
-        for conn in self.connections.copy():
-            conn.delete_connection()
-        self.scene().removeItem(self)
+        self.scene().remove_block(self)
 
 
 # ====================== 连接线类 ======================
@@ -231,6 +323,13 @@ class Connection(QGraphicsPathItem):
         self.start_block = start_block
         self.end_block = end_block
         self.line_type = line_type
+        # 虚拟化模式下对应 VirtualDiagram 中的连线
+        self.edge_uid = None
+        self._pen_type = None
+        self._center_line = QLineF()
+        # 使用路由时的中心折线，直线连接时为 None
+        self._center_path = None
+        self._shape = None
         self.setFlag(QGraphicsPathItem.ItemIsSelectable)
         self.setZValue(-1)
         self.update_line()
@@ -239,21 +338,75 @@ class Connection(QGraphicsPathItem):
         path = QPainterPath()
         start = self.start_block.get_center()
         end = self.end_block.get_center()
+        self._center_line = QLineF(start, end)
+        scene = self.scene()
+        route = scene.route_points(self) if scene is not None else None
 
-        pen = QPen(self.line_type.get_color(), 2)
-        pen.setStyle(self.line_type.get_style())
-
-        for offset in self.line_type.get_offset():
-            line_path = QLineF(start, end)
-            if offset != 0:
-                angle = line_path.angle()
-                normal = QLineF.fromPolar(abs(offset), angle + 90).p2()
-                line_path.translate(normal * (offset / abs(offset)))
-            path.moveTo(line_path.p1())
-            path.lineTo(line_path.p2())
+        strokes = []
+        if route is None:
+            self._center_path = None
+            center = QPolygonF([start, end])
+            for offset in self.line_type.get_offset():
+                line_path = QLineF(start, end)
+                if offset != 0:
+                    angle = line_path.angle()
+                    normal = QLineF.fromPolar(abs(offset), angle + 90).p2()
+                    line_path.translate(normal * (offset / abs(offset)))
+                strokes.append(QPolygonF([line_path.p1(), line_path.p2()]))
+        else:
+            # 多线沿折线两侧平移，拐角处斜接
+            center = _polygon(route)
+            self._center_path = QPainterPath()
+            self._center_path.addPolygon(center)
+            for offset in self.line_type.get_offset():
+                strokes.append(center if offset == 0 else _polygon(offset_polyline(route, offset)))
+        for polygon in strokes:
+            path.addPolygon(polygon)
 
+        self._shape = None
         self.setPath(path)
-        self.setPen(pen)
+        if self._pen_type is not self.line_type:
+            self.setPen(self.line_type.get_pen())
+            self._pen_type = self.line_type
+        bundles = scene.bundles if scene is not None else None
+        if bundles is not None:
+            # 捆绑模式下由共用的 BundleLayer 绘制，选中时才自己画出高亮
+            bundles.set_route(self, strokes, center)
+            self.setFlag(QGraphicsItem.ItemHasNoContents, not self.isSelected())
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItem.ItemSceneChange:
+            scene = self.scene()
+            if scene is not None and scene.bundles is not None:
+                # 移出场景（含虚拟化模式回收到对象池）后恢复自己绘制
+                scene.bundles.discard(self)
+                self.setFlag(QGraphicsItem.ItemHasNoContents, False)
+        elif change == QGraphicsItem.ItemSelectedHasChanged:
+            scene = self.scene()
+            if scene is not None and scene.bundles is not None and self in scene.bundles:
+                self.setFlag(QGraphicsItem.ItemHasNoContents, not value)
+        return super().itemChange(change, value)
+
+    def shape(self):
+        if self._center_path is None:
+            return super().shape()
+        # 折线路径按填充计算会包含拐角围出的区域，只取描边
+        if self._shape is None:
+            stroker = QPainterPathStroker()
+            stroker.setWidth(self.pen().widthF())
+            self._shape = stroker.createStroke(self.path())
+        return self._shape
+
+    def paint(self, painter, option, widget=None):
+        if (len(self.line_type.get_offset()) > 1
+                and level_of_detail(painter) < LOD_SINGLE_STROKE):
+            painter.setPen(self.pen())
+            if self._center_path is not None:
+                painter.drawPath(self._center_path)
+            else:
+                painter.drawLine(self._center_line)
+            return
+        super().paint(painter, option, widget)
 
     def contextMenuEvent(self, event):
         menu = QMenu()
@@ -263,377 +416,4131 @@ class Connection(QGraphicsPathItem):
         #     self.delete_connection()
 
     def delete_connection(self):
-        self.start_block.connections.remove(self)
-        self.end_block.connections.remove(self)
-        self.scene().removeItem(self)
+        self.scene().remove_connection(self)
 
 
-# ====================== 画布类 ======================
-class Canvas(QGraphicsView):
+def _polygon(points):
+    return QPolygonF([QPointF(x, y) for x, y in points.tolist()])
+
+
+# ====================== 图元索引 ======================
+class DiagramRegistry:
+    """
+    维护 编号->方块、连线集合 和 方块邻接关系，
+    查找和遍历不再需要扫描 scene.items()。
+    """
+
     def __init__(self):
-        super().__init__()
-        self.scene = QGraphicsScene()
-        self.setRenderHint(QPainter.Antialiasing, False)
-        self.setScene(self.scene)
-        self.setRenderHint(QPainter.Antialiasing)
-        self.setDragMode(QGraphicsView.RubberBandDrag)
-        self.blocks = []
-        self.dragging_block = None
-        self.preview_line = None
-        self.current_line_type = LineType.SINGLE
+        self.blocks = {}
+        # 以字典作为有序集合，导出时保持连线的创建顺序
+        self.connections = {}
+        self.adjacency = {}
 
-        # 添加背景图片
-        self.background_image = None
-        self._load_background_image(resource_path("background.png"))  # 替换为你的图片路径
+    def add_block(self, block):
+        self.blocks[block.id] = block
+        self.adjacency.setdefault(block, {})
 
-        # self.draw_grid()
+    def remove_block(self, block):
+        if self.blocks.get(block.id) is block:
+            del self.blocks[block.id]
+        self.adjacency.pop(block, None)
 
-    def fit_background_to_view(self):
-        if not self.background_image:
-            return
+    def rekey_block(self, block, old_id):
+        if self.blocks.get(old_id) is block:
+            del self.blocks[old_id]
+        self.blocks[block.id] = block
 
-        view_width = self.viewport().width()
-        view_height = self.viewport().height()
+    def add_connection(self, conn):
+        self.connections[conn] = None
+        for a, b in ((conn.start_block, conn.end_block), (conn.end_block, conn.start_block)):
+            neighbors = self.adjacency.setdefault(a, {})
+            neighbors[b] = neighbors.get(b, 0) + 1
 
-        pixmap = self.background_image.pixmap()
-        if pixmap.isNull():
+    def remove_connection(self, conn):
+        if conn not in self.connections:
             return
+        del self.connections[conn]
+        for a, b in ((conn.start_block, conn.end_block), (conn.end_block, conn.start_block)):
+            neighbors = self.adjacency.get(a)
+            if neighbors is None or b not in neighbors:
+                continue
+            neighbors[b] -= 1
+            if not neighbors[b]:
+                del neighbors[b]
+
+    def neighbors(self, block):
+        return self.adjacency.get(block, {}).keys()
+
+    def clear(self):
+        self.blocks.clear()
+        self.connections.clear()
+        self.adjacency.clear()
+
+
+# ====================== 场景类 ======================
+class FlowScene(QGraphicsScene):
+    """
+    收集待更新的连线，每帧统一重算一次几何。
+
+    图表的每次修改都通过 diagram_changed(类型, 数据) 发出：
+        "add_block": 方块
+        "remove_block": (方块, 随之删除的连线列表, 原来直接所属的分组编号，0 为不属于分组)
+        "remove_items": (删除的方块 BlockTable, 删除的全部连线 RelationTable, 这些连线的 uid 数组,
+            {方块编号: 原来直接所属的分组编号})，remove_items 批量删除时只发出这一条
+        "add_connection" / "remove_connection": 连线
+        "edit": (方块, 修改前的 {"id", "name", "w", "h"})
+        "move": [(方块, 移动前的位置), ...]，每帧合并一次
+        "line_type": [(连线, 修改前的线型), ...]
+        "clear": 替换前的 (BlockTable, RelationTable)
+        "reset": 整个图表被替换；布局批量改写坐标时为 move_group，否则为 None
+        "clusters": 分组或折叠状态改变，数据为修改前的 ClusterTable
+
+    move_group 在每次鼠标按下或重新布局时递增，同一组内的移动视为一次操作。
+
+    图表数据同时保存在 model（DiagramModel）中，场景在发出通知前先更新它，
+    导出和分析直接读取 model。load_virtual 之后场景进入虚拟化模式，
+    只有视口附近的方块和连线存在图元；按编号查找图元时按需创建。
+
+    set_routing 开启正交或捆绑路由后，线路按连线 uid 缓存在 router 中，
+    修改通知只让受影响的线路失效；一帧内需要重算的线路较多时交给后台线程。
+
+    方块的嵌套分组保存在 clusters（ClusterTree）中，折叠分组的方块和连线由
+    cluster_layer 移出场景，换成一个代理方块和按端点合并的连线。
+    """
+    FRAME_INTERVAL_MS = 16
+    diagram_changed = pyqtSignal(str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.registry = DiagramRegistry()
+        self.model = DiagramModel()
+        self.clusters = ClusterTree()
+        self.virtual = None
+        self.move_group = 0
+        self.router = None
+        # 捆绑路由时所有连线共用的绘制层
+        self.bundles = None
+        self.route_in_background = True
+        self._route_worker = None
+        self._edges_by_uid = None
+        self._dirty_connections = set()
+        self._moving_blocks = {}
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(self.FRAME_INTERVAL_MS)
+        # 经 lambda 在触发时才查找方法，性能监视开启后替换的计时包装才会生效
+        self._flush_timer.timeout.connect(lambda: self.flush_connection_updates())
+        self.cluster_layer = ClusterLayer(self)
+
+    @contextmanager
+    def suspend_index(self, count=None):
+        """
+        批量增删图元或更新几何期间暂停场景索引，结束后整体重建。
+        外层已经暂停索引时（Canvas.bulk_update、分块导入）保持原样，由外层恢复。
 
-        img_w = pixmap.width()
-        img_h = pixmap.height()
-        if img_w == 0 or img_h == 0:
+        参数:
+            count: 涉及的图元数量，不超过 BULK_THRESHOLD 时不暂停；None 表示总是暂停
+        """
+        if ((count is not None and count <= BULK_THRESHOLD)
+                or self.itemIndexMethod() != QGraphicsScene.BspTreeIndex):
+            yield
             return
+        self.setItemIndexMethod(QGraphicsScene.NoIndex)
+        try:
+            yield
+        finally:
+            self.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
 
-        # 按宽度拉伸，保持宽高比
-        scale = view_width / img_w
-        scaled_h = img_h * scale
+    def notify(self, kind, payload=None):
+        self._sync_model(kind, payload)
+        if self.router is not None:
+            self._invalidate_routes(kind, payload)
+        self.diagram_changed.emit(kind, payload)
 
-        # 设置缩放
-        self.background_image.setScale(scale)
+    def _sync_model(self, kind, payload):
+        model = self.model
+        if kind == "move":
+            model.set_positions([block.id for block, _ in payload],
+                                [block.x() for block, _ in payload],
+                                [block.y() for block, _ in payload])
+        elif kind == "add_block":
+            rect = payload.rect()
+            model.add_block(payload.id, payload.name, payload.x(), payload.y(),
+                            rect.width(), rect.height())
+        elif kind == "remove_block":
+            model.remove_block(payload[0].id)
+            self.clusters.remove_blocks([payload[0].id])
+        elif kind == "remove_items":
+            model.remove_blocks(payload[0].ids, payload[2])
+            self.clusters.remove_blocks(payload[0].ids.tolist())
+        elif kind == "add_connection":
+            payload.edge_uid = model.add_edge(payload.start_block.id, payload.end_block.id,
+                                              payload.line_type.to_number())
+        elif kind == "remove_connection":
+            model.remove_edge(payload.edge_uid)
+        elif kind == "edit":
+            block, old = payload
+            model.edit_block(old["id"], block.id, block.name,
+                             block.rect().width(), block.rect().height())
+            if old["id"] != block.id:
+                self.clusters.rekey_block(old["id"], block.id)
+        elif kind == "line_type":
+            for conn, _ in payload:
+                model.set_edge_line(conn.edge_uid, conn.line_type.to_number())
 
-        # 设置图片中心为 (0, 0)，即 scene 原点
-        x = -img_w * scale / 2
-        y = -img_h * scale / 2
-        self.background_image.setPos(x, y)
+    def _insert_block(self, block):
+        self.addItem(block)
+        self.registry.add_block(block)
 
-    def _load_background_image(self, image_path):
-        pixmap = QPixmap(image_path)
-        if not pixmap.isNull():
-            # 设置缩放模式为快速缩放，避免模糊
-            scaled_pixmap = pixmap.scaled(
-                pixmap.size() * 2,  # 可选：提高分辨率
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation  # 或 Qt.FastTransformation
-            )
-            self.background_image = QGraphicsPixmapItem(scaled_pixmap)
-            self.background_image.setZValue(-2)
-            self.scene.addItem(self.background_image)
-            self.fit_background_to_view()
+    def _insert_connection(self, start_block, end_block, line_type):
+        connection = Connection(start_block, end_block, line_type)
+        self._attach_connection(connection)
+        return connection
 
-    def center_background_image(self):
-        if self.background_image:
-            rect = self.background_image.boundingRect()
-            scene_rect = self.scene.sceneRect()
-            x = scene_rect.width() / 2 - rect.width() / 2
-            y = scene_rect.height() / 2 - rect.height() / 2
-            self.background_image.setPos(x, y)
+    def _attach_connection(self, connection):
+        self.addItem(connection)
+        # 双向绑定
+        connection.start_block.connections.append(connection)
+        connection.end_block.connections.append(connection)
+        self.registry.add_connection(connection)
+        self._edges_by_uid = None
 
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        self.fit_background_to_view()
+    def _detach_connection(self, conn):
+        conn.start_block.connections.remove(conn)
+        conn.end_block.connections.remove(conn)
+        self.registry.remove_connection(conn)
+        self._edges_by_uid = None
+        self._dirty_connections.discard(conn)
+        # 折叠分组中的连线已经不在场景里
+        if conn.scene() is self:
+            self.removeItem(conn)
 
-    # def draw_grid(self):
-    #     grid_pen = QPen(QColor(220, 220, 220), 1, Qt.DotLine)
-    #     for x in range(-1000, 1000, 20):
-    #         self.scene.addLine(x, -1000, x, 1000, grid_pen)
-    #     for y in range(-1000, 1000, 20):
-    #         self.scene.addLine(-1000, y, 1000, y, grid_pen)
+    def add_block(self, block):
+        self._insert_block(block)
+        self.notify("add_block", block)
 
-    # def contextMenuEvent(self, event):
-    #     # 转换坐标系并检查该位置是否有图元
-    #     item = self.itemAt(event.pos())
-    #
-    #     if item is None:
-    #         # 如果当前位置没有图元，则显示画布的菜单
-    #         menu = QMenu()
-    #         new_block_action = menu.addAction("新建工作组")
-    #         action = menu.exec_(self.mapToGlobal(event.pos()))
-    #         if action == new_block_action:
-    #             self.create_new_block(event.pos())
-    #     else:
-    #         # 否则，允许图元自行处理其上下文菜单事件
-    #         super().contextMenuEvent(event)
+    def add_connection(self, start_block, end_block, line_type):
+        connection = self._insert_connection(start_block, end_block, line_type)
+        self.notify("add_connection", connection)
+        return connection
 
-    def create_new_block(self, pos):
-        dialog = BlockEditDialog()
-        dialog.name_edit.setText("New Block")
-        dialog.id_edit.setText(str(DraggableBlock._next_id))
-        dialog.width_edit.setText("100")
-        dialog.height_edit.setText("60")
+    def remove_connection(self, conn):
+        self._detach_connection(conn)
+        self.notify("remove_connection", conn)
 
-        if dialog.exec_() == QDialog.Accepted:
-            name = dialog.name_edit.text()
-            block_id = int(dialog.id_edit.text())
-            width = float(dialog.width_edit.text())
-            height = float(dialog.height_edit.text())
+    def remove_block(self, block):
+        if self.virtual is not None:
+            self.virtual.materialize_incident(block)
+        # 删除所有关联的连接线，与方块一起作为一次修改通知
+        connections = block.connections.copy()
+        for conn in connections:
+            self._detach_connection(conn)
+        self.registry.remove_block(block)
+        self._moving_blocks.pop(block, None)
+        if block.scene() is self:
+            self.removeItem(block)
+        block.detached_scene = None
+        # 分组归属在 _sync_model 中随方块删除，通知中带上原来的分组供撤销时恢复
+        self.notify("remove_block", (block, connections, self.clusters.members.get(block.id, 0)))
 
-            # 检查ID是否重复
-            existing_ids = {block.id for block in self.blocks}
-            if block_id in existing_ids:
-                QMessageBox.warning(self, "错误", "ID已存在！")
-                return
+    def remove_items(self, block_ids, edge_uids=()):
+        """
+        按编号一次删除多个方块（连同它们的连线）和 uid 在 edge_uids 中的连线，
+        只发出一条 "remove_items" 通知。
 
-            scene_pos = self.mapToScene(pos)
-            block = DraggableBlock(name, scene_pos.x(), scene_pos.y(),
-                                   width, height, block_id)
-            self.scene.addItem(block)
-            self.blocks.append(block)
+        通知中的数据直接取自 model，只有已经存在的图元才需要移出场景；虚拟化模式下
+        不必像 remove_block 那样先为每条连线和邻居方块创建图元。model 也只按掩码压缩一次。
+        """
+        # 移动按帧合并后才写入 model，取数据前先提交
+        self.flush_connection_updates()
+        blocks, relations, uids = self.model.removal(block_ids, edge_uids)
+        live = [block for block in map(self.registry.blocks.get, blocks.ids.tolist())
+                if block is not None]
+        # 两端都存在图元的连线才会有图元，与删除方块相连的都在方块的连线列表中
+        removed = dict.fromkeys(self._live_connections(uids))
+        for block in live:
+            removed.update(dict.fromkeys(block.connections))
+        with self.suspend_index(len(removed) + len(live)):
+            for conn in removed:
+                self._detach_connection(conn)
+            for block in live:
+                self.registry.remove_block(block)
+                self._moving_blocks.pop(block, None)
+                if block.scene() is self:
+                    self.removeItem(block)
+                block.detached_scene = None
+        members = self.clusters.members
+        clusters = {block_id: members[block_id] for block_id in blocks.ids.tolist()
+                    if block_id in members}
+        self.notify("remove_items", (blocks, relations, uids, clusters))
 
-    # def mousePressEvent(self, event):
-    #     if event.button() == Qt.LeftButton:
-    #         item = self.itemAt(event.pos())
-    #         if isinstance(item, DraggableBlock):
-    #             self._start_connection(item)
-    #             return
-    #     super().mousePressEvent(event)
+    def edit_block(self, block, block_id, name, width, height):
+        old = {"id": block.id, "name": block.name,
+               "w": block.rect().width(), "h": block.rect().height()}
+        block.id = block_id
+        block.name = name
+        self.registry.rekey_block(block, old["id"])
+        block.setRect(0, 0, width, height)
+        block._update_text()
 
-    def _start_connection(self, block):
-        self.dragging_block = block
-        start_point = block.get_center()
-        self.preview_line = QGraphicsLineItem()
-        self.preview_line.setPen(QPen(Qt.gray, 2, Qt.DashLine))
-        self.scene.addItem(self.preview_line)
-        self.preview_line.setLine(QLineF(start_point, start_point))
+        # 更新所有相关连接线
+        for conn in block.connections:
+            conn.update_line()
+        self.notify("edit", (block, old))
 
-    def mouseMoveEvent(self, event):
-        if self.dragging_block:
-            end_pos = self.mapToScene(event.pos())
-            start_point = self.dragging_block.get_center()
-            self.preview_line.setLine(QLineF(start_point, end_pos))
-        else:
-            super().mouseMoveEvent(event)
+    def set_line_type(self, connections, line_type):
+        self.set_line_types(connections, [line_type] * len(connections))
 
-    def mouseReleaseEvent(self, event):
-        if self.dragging_block:
-            end_pos = self.mapToScene(event.pos())
-            end_block = None
-            # 查找目标方块
-            for item in self.scene.items():
-                if isinstance(item, DraggableBlock) and item != self.dragging_block:
-                    if item.contains(item.mapFromScene(end_pos)):
-                        end_block = item
-                        break
-            if end_block:
-                # 创建新连接
-                connection = Connection(
-                    self.dragging_block,
-                    end_block,
-                    self.current_line_type
-                )
-                self.scene.addItem(connection)
-                # 双向绑定
-                self.dragging_block.connections.append(connection)
-                end_block.connections.append(connection)
-            # 清理预览线
-            self.scene.removeItem(self.preview_line)
-            self.dragging_block = None
-            self.preview_line = None
-        else:
-            super().mouseReleaseEvent(event)
+    def set_line_types(self, connections, line_types):
+        """逐条设置线型，实际发生变化的连线合并为一次通知"""
+        changed = []
+        for conn, line_type in zip(connections, line_types):
+            if conn.line_type is not line_type:
+                changed.append((conn, conn.line_type))
+                conn.line_type = line_type
+                conn.update_line()
+        if changed:
+            self.notify("line_type", changed)
 
+    def has_block(self, block_id):
+        return block_id in self.model.row_of
 
-# ====================== 主窗口类 ======================
-class MainWindow(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.canvas = Canvas()
-        self._init_ui()
+    def owns(self, block):
+        """方块仍在这个图表中（包括折叠分组里移出场景的方块）"""
+        return block.scene() is self or block.detached_scene is self
 
-    def _init_ui(self):
-        self.setWindowTitle("重大工作组流程图工具")
-        self.setGeometry(100, 100, 1200, 800)
-        self.setWindowIcon(QIcon(resource_path("logo.png")))  # 替换为你的图标文件路径
-        # 工具栏
-        toolbar = self.addToolBar("工具")
-        line_types = [
-            LineType.SINGLE,
-            LineType.DOUBLE,
-            LineType.TRIPLE,
-            LineType.QUADRUPLE
-        ]
-        for lt in line_types:
-            action = QAction(lt.value.capitalize(), self)
-            action.triggered.connect(lambda _,lt=lt: self.set_line_type(lt))
-            toolbar.addAction(action)
+    def selected_blocks(self):
+        return [item for item in self.selectedItems() if isinstance(item, DraggableBlock)]
 
-        # 控制面板
-        control_panel = QWidget()
-        layout = QVBoxLayout()
-        layout.addWidget(self._create_button("导出Excel", self._export))
-        layout.addWidget(self._create_button("导入Excel", self._import))
-        control_panel.setLayout(layout)
+    # ---------- 分组 ----------
+    def _change_clusters(self, change):
+        """在 clusters 上执行 change，之后发出带修改前状态的 "clusters" 通知"""
+        before = self.clusters.to_table()
+        result = change(self.clusters)
+        self.notify("clusters", before)
+        return result
 
-        # 缩放控件
-        zoom_layout = QHBoxLayout()
-        self.zoom_slider = QSlider(Qt.Horizontal)
-        self.zoom_slider.setMinimum(10)
-        self.zoom_slider.setMaximum(300)
-        self.zoom_slider.setValue(100)
-        self.zoom_slider.valueChanged.connect(self._zoom_canvas)
+    def set_clusters(self, table):
+        """整体替换分组（撤销重做时使用）"""
+        self._change_clusters(lambda _: setattr(self, "clusters", ClusterTree.from_table(table)))
 
-        self.zoom_label = QLabel("100%")
-        self.zoom_label.setFixedWidth(40)
+    def group(self, name, block_ids=(), cluster_ids=()):
+        """把方块和已有分组放进一个新分组，返回新分组的编号"""
+        return self._change_clusters(lambda tree: tree.group(name, block_ids, cluster_ids))
 
-        zoom_layout.addWidget(self.zoom_slider)
-        zoom_layout.addWidget(self.zoom_label)
+    def ungroup(self, cluster_id):
+        self._change_clusters(lambda tree: tree.ungroup(cluster_id))
 
-        layout.addLayout(zoom_layout)
+    def leave_cluster(self, block_ids):
+        """方块移出所在的分组"""
+        self._change_clusters(lambda tree: tree.remove_blocks(block_ids))
 
-        control_panel.setLayout(layout)
-        # 主界面
-        central_widget = QWidget()
-        main_layout = QVBoxLayout()
-        main_layout.addWidget(control_panel)
-        main_layout.addWidget(self.canvas)
-        central_widget.setLayout(main_layout)
-        self.setCentralWidget(central_widget)
+    def join_cluster(self, block_ids, cluster_id):
+        """方块放进已有的分组"""
+        self._change_clusters(lambda tree: tree.assign(block_ids, cluster_id))
 
-    def _zoom_canvas(self, value):
-        scale_factor = value / 100.0
-        self.canvas.resetTransform()
-        self.canvas.scale(scale_factor, scale_factor)
-        self.zoom_label.setText(f"{value}%")
+    def rename_cluster(self, cluster_id, name):
+        self._change_clusters(lambda tree: setattr(tree.clusters[cluster_id], "name", name))
 
-    def _create_button(self, text, callback):
-        btn = QPushButton(text)
-        btn.clicked.connect(callback)
-        return btn
+    def set_collapsed(self, cluster_id, collapsed):
+        if self.clusters.clusters[cluster_id].collapsed != collapsed:
+            self._change_clusters(
+                lambda tree: setattr(tree.clusters[cluster_id], "collapsed", collapsed))
 
-    def set_line_type(self, line_type):
-        self.canvas.current_line_type = line_type
-        # 更新选中连线的样式
-        for item in self.canvas.scene.selectedItems():
-            if isinstance(item, Connection):
-                item.line_type = line_type
-                item.update_line()
+    def expand_all(self):
+        if any(cluster.collapsed for cluster in self.clusters.clusters.values()):
+            def expand(tree):
+                for cluster in tree.clusters.values():
+                    cluster.collapsed = False
+            self._change_clusters(expand)
 
-    def _export(self):
-        try:
-            # 弹出保存文件对话框
-            options = QFileDialog.Options()
-            file_path, _ = QFileDialog.getSaveFileName(
-                self,
-                "保存文件",
-                "diagram.xlsx",  # 默认文件名
-                "Excel 文件 (*.xlsx)",  # 文件类型过滤
-                options=options
-            )
+    def group_selection(self):
+        """询问名称后把选中的方块和折叠的分组放进一个新分组"""
+        block_ids = [block.id for block in self.selected_blocks()]
+        cluster_ids = [item.cluster_id for item in self.selectedItems()
+                       if isinstance(item, ClusterProxy)]
+        if not block_ids and not cluster_ids:
+            return None
+        name, ok = QInputDialog.getText(None, "分组", "分组名称:",
+                                        text=f"分组{self.clusters._next_id}")
+        if not ok or not name:
+            return None
+        return self.group(name, block_ids, cluster_ids)
 
-            if not file_path:
-                return  # 用户取消操作
+    def move_blocks_by(self, block_ids, dx, dy):
+        """平移一组方块，移出场景的方块同样记录移动"""
+        for block_id in block_ids:
+            block = self.block_by_id(block_id)
+            block.setPos(block.x() + dx, block.y() + dy)
+        self.flush_connection_updates()
 
-            # 收集模块数据
-            modules = []
-            for block in self.canvas.blocks:
-                modules.append({
-                    "序号": block.id,
-                    "group": block.name,
-                    "X": block.x(),
-                    "Y": block.y(),
-                    "Width": block.rect().width(),
-                    "Height": block.rect().height()
-                })
-
-            # 收集连接数据
-            connections = []
-            for item in self.canvas.scene.items():
-                if isinstance(item, Connection):
-                    connections.append({
-                        "起始编号": item.start_block.id,
-                        "结束编号": item.end_block.id,
-                        "线型": item.line_type.to_number()
-                    })
-
-            # 写入Excel
-            with pd.ExcelWriter(file_path) as writer:
-                pd.DataFrame(modules).to_excel(writer, sheet_name="group", index=False)
-                pd.DataFrame(connections).to_excel(writer, sheet_name="relation", index=False)
+    def apply_diff(self, diff, blocks, relations):
+        """
+        按 diff_diagram 的结果只增删改有变化的方块和连线，其余图元保持不动。
 
-            QMessageBox.information(self, "导出成功", f"数据已保存到\n{file_path}")
+        删除的方块和连线经 remove_items 一次完成，其余每一步都发出普通的修改通知，
+        撤销、自动保存、路由缓存等都按增量更新。blocks / relations 为参与比较的新数据表。
+        """
+        if len(diff.removed_blocks) or len(diff.removed_edges):
+            self.remove_items(diff.removed_blocks, diff.removed_edges)
 
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+        ids, names = blocks.ids, blocks.names
+        for i in diff.updated_blocks.tolist():
+            block = self.block_by_id(int(ids[i]))
+            x, y, width, height = (float(blocks.x[i]), float(blocks.y[i]),
+                                   float(blocks.width[i]), float(blocks.height[i]))
+            rect = block.rect()
+            if (block.name, rect.width(), rect.height()) != (names[i], width, height):
+                self.edit_block(block, block.id, names[i], width, height)
+            if (block.x(), block.y()) != (x, y):
+                block.setPos(x, y)
+        for i in diff.added_blocks.tolist():
+            self.add_block(DraggableBlock(names[i], float(blocks.x[i]), float(blocks.y[i]),
+                                          float(blocks.width[i]), float(blocks.height[i]),
+                                          block_id=int(ids[i])))
+        for start, end, line in zip(relations.start[diff.added_relations].tolist(),
+                                    relations.end[diff.added_relations].tolist(),
+                                    relations.line[diff.added_relations].tolist()):
+            self.add_connection(self.block_by_id(start), self.block_by_id(end),
+                                _LINE_TYPES_BY_NUMBER[line])
+        # 坐标变化按帧合并发出，这里立即提交，使它与其余修改属于同一次合并
+        self.flush_connection_updates()
+
+    def find_block(self, block_id):
+        """按编号返回方块图元，不存在时返回 None"""
+        if not self.has_block(block_id):
+            return None
+        return self.block_by_id(block_id)
+
+    def block_by_id(self, block_id):
+        if self.virtual is not None:
+            return self.virtual.materialize_block(block_id)
+        return self.registry.blocks[block_id]
+
+    def find_connection(self, start, end, line):
+        """按两端编号和线型编号查找一条连线"""
+        if self.virtual is not None:
+            return self.virtual.materialize_edge(self.model.find_edge(start, end, line))
+        block = self.registry.blocks[start]
+        for conn in block.connections:
+            if (conn.start_block is block and conn.end_block.id == end
+                    and conn.line_type.to_number() == line):
+                return conn
+        raise KeyError(f"找不到连线 {start} -> {end}")
+
+    def to_tables(self):
+        """把当前图表导出为列式数据表"""
+        # 移动按帧合并后才写入 model，导出前先提交
+        self.flush_connection_updates()
+        return self.model.to_tables()
+
+    def clear_diagram(self):
+        if self.receivers(self.diagram_changed):
+            self.notify("clear", self.to_tables())
+        for conn in self.registry.connections:
+            if conn.scene() is self:
+                self.removeItem(conn)
+        for block in self.registry.blocks.values():
+            if block.scene() is self:
+                self.removeItem(block)
+            block.detached_scene = None
+        self.registry.clear()
+        self.model = DiagramModel()
+        self.clusters = ClusterTree()
+        self.cluster_layer.clear()
+        if self.router is not None:
+            self.stop_routing()
+            self.router.reset()
+        if self.bundles is not None:
+            self.bundles.release()
+        self._dirty_connections.clear()
+        self._moving_blocks.clear()
+        if self.virtual is not None:
+            self.virtual.detach()
+            self.virtual = None
+            self.setSceneRect(QRectF())
+
+    def load_virtual(self, blocks, relations):
+        """以虚拟化模式载入图表，图元由视图按可见区域创建"""
+        self.model = DiagramModel(blocks, relations)
+        self.virtual = VirtualDiagram(self)
+        DraggableBlock._next_id = max(DraggableBlock._next_id, int(blocks.ids.max(initial=0)) + 1)
+        self.setSceneRect(self.virtual.bounds())
+        self.notify("reset")
+
+    def populate(self, blocks, relations, endpoints=None):
+        """
+        按列式数据表批量创建工作组和连线，返回新建的方块列表。
+
+        参数:
+            blocks: diagram_io.BlockTable，位置必须已经确定
+            relations: diagram_io.RelationTable
+            endpoints: resolve_endpoints 的结果，未提供时在这里计算
+        """
+        created = []
+        for _ in self.populate_iter(blocks, relations, endpoints, created=created):
+            pass
+        self.notify("reset")
+        return created
+
+    def populate_iter(self, blocks, relations, endpoints=None, chunk_size=None, created=None):
+        """
+        分块创建图元的生成器，每处理完一块产出已创建的图元数量。
+
+        先创建全部方块再创建连线，中途停止时场景中的图元仍然一致。
+        逐个图元的修改通知不会发出，调用方在结束后负责发出 "reset"。
+        """
+        if endpoints is None:
+            endpoints = diagram_io.resolve_endpoints(blocks.ids, relations)
+        start_index, end_index = endpoints
+        created = [] if created is None else created
+        n_blocks = len(blocks)
+        n_relations = len(relations)
+        chunk_size = chunk_size or max(n_blocks, n_relations, 1)
+        # model 先整体载入；中途停止时截断到已创建的部分，连线 uid 即行号
+        self.model = DiagramModel(blocks, relations)
+        n_edges = 0
 
-    def _import(self):
         try:
-            path, _ = QFileDialog.getOpenFileName(
-                self, "打开文件", "", "Excel文件 (*.xlsx)")
-            if not path:
-                return
+            for lo in range(0, n_blocks, chunk_size):
+                hi = min(lo + chunk_size, n_blocks)
+                for block_id, name, x, y, width, height in zip(
+                        blocks.ids[lo:hi].tolist(), blocks.names[lo:hi].tolist(),
+                        blocks.x[lo:hi].tolist(), blocks.y[lo:hi].tolist(),
+                        blocks.width[lo:hi].tolist(), blocks.height[lo:hi].tolist()):
+                    block = DraggableBlock(name, x, y, width, height, block_id=block_id)
+                    self._insert_block(block)
+                    created.append(block)
+                yield hi
 
-            CENTER_X, CENTER_Y = 0, 0  # 分布中心点
-            SPREAD_RADIUS = 800  # 分散半径
-            MIN_SPACING = 100  # 模块之间最小间距
-
-            # 读取模块
-            modules_df = pd.read_excel(path, sheet_name="group")
-            for item in self.canvas.scene.items():
-                if isinstance(item, (DraggableBlock, Connection)):
-                    self.canvas.scene.removeItem(item)
-            self.canvas.blocks = []
-            # self.canvas.draw_grid()
-            id_map = {}
-            placed_positions = []
-            for _, row in modules_df.iterrows():
-                block_id = row["序号"]
-                name = row.get("group", "未知模块")
-                x = row.get("X", None)
-                y = row.get("Y", None)
-                width = row.get("Width", 100)
-                height = row.get("Height", 60)
-
-                # 如果不存在 X/Y/Width/Height 列，则使用默认值
-                if x is None or y is None:
-                    x, y = generate_scattered_position(
-                        placed_positions, width, height,
-                        center=(CENTER_X, CENTER_Y),
-                        spread=SPREAD_RADIUS,
-                        spacing=MIN_SPACING
-                    )
-
-
-                block = DraggableBlock(name, x, y, width, height, block_id=block_id)
-                self.canvas.scene.addItem(block)
-                self.canvas.blocks.append(block)
-                id_map[block.id] = block
-                # 最后再加入 placed_positions
-                placed_positions.append((x, y, width, height))
-
-            # 读取连接
-            connections_df = pd.read_excel(path, sheet_name="relation")
-            for _, row in connections_df.iterrows():
-                start_block = id_map[row["起始编号"]]
-                end_block = id_map[row["结束编号"]]
-                line_type_number = int(row["线型"])  # 假设 Excel 中列名为 "线型"
-                line_type = LineType.from_number(line_type_number)
-                connection = Connection(
-                    start_block,
-                    end_block,
-                    line_type
-                )
-                self.canvas.scene.addItem(connection)
-                # 双向绑定
-                start_block.connections.append(connection)
-                end_block.connections.append(connection)
-            QMessageBox.information(self, "导入成功",
-                                    f"已导入 {len(modules_df)} 个模块和 {len(connections_df)} 条连线")
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"导入失败: {str(e)}")
+            for lo in range(0, n_relations, chunk_size):
+                hi = min(lo + chunk_size, n_relations)
+                line_types = LineType.from_numbers(relations.line[lo:hi])
+                for start, end, line_type in zip(start_index[lo:hi].tolist(),
+                                                 end_index[lo:hi].tolist(),
+                                                 line_types.tolist()):
+                    conn = self._insert_connection(created[start], created[end], line_type)
+                    conn.edge_uid = n_edges
+                    n_edges += 1
+                yield n_blocks + hi
+        finally:
+            if len(created) < n_blocks or n_edges < n_relations:
+                self.model.truncate(len(created), n_edges)
 
+    def mousePressEvent(self, event):
+        self.move_group += 1
+        super().mousePressEvent(event)
 
+    def mark_moving(self, block):
+        # 记录本帧内第一次移动前的位置
+        if block not in self._moving_blocks:
+            self._moving_blocks[block] = block.pos()
+            if not self._flush_timer.isActive():
+                self._flush_timer.start()
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec_())
+    def schedule_connection_updates(self, connections):
+        # 两端同时移动的连线在集合中只出现一次
+        self._dirty_connections.update(connections)
+        if self._dirty_connections and not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def flush_connection_updates(self):
+        # 先提交移动，路由失效的连线会加入本帧的更新
+        if self._moving_blocks:
+            moved = [(block, old) for block, old in self._moving_blocks.items()
+                     if block.pos() != old]
+            self._moving_blocks = {}
+            if moved:
+                self.notify("move", moved)
+        self._flush_timer.stop()
+        dirty = [conn for conn in self._dirty_connections if conn.scene() is self]
+        self._dirty_connections = set()
+        if self.router is not None:
+            self._plan_routes(dirty)
+        # 框选拖动大量方块时每条连线的 setPath 都要在 BSP 树中重新登记，整体重建快得多
+        with self.suspend_index(len(dirty)):
+            for conn in dirty:
+                conn.update_line()
+
+    # ---------- 连线路由 ----------
+    def set_routing(self, mode):
+        """
+        切换连线的绘制方式。
+
+        参数:
+            mode: routing.STRAIGHT、routing.ORTHOGONAL 或 routing.BUNDLED
+        """
+        if mode not in routing.ROUTING_MODES:
+            raise ValueError(f"未知的路由方式: {mode}")
+        self.stop_routing()
+        self.router = None if mode == routing.STRAIGHT else EdgeRouter(mode)
+        if self.bundles is not None:
+            self.bundles.release()
+            self.removeItem(self.bundles)
+            self.bundles = None
+        if mode == routing.BUNDLED:
+            self.bundles = BundleLayer()
+            self.addItem(self.bundles)
+        self.schedule_connection_updates(self.registry.connections)
+
+    @property
+    def routing_mode(self):
+        return routing.STRAIGHT if self.router is None else self.router.mode
+
+    def route_points(self, conn):
+        """连线的路由折线，直线连接或线路正在后台计算时返回 None"""
+        router = self.router
+        uid = conn.edge_uid
+        if router is None or uid is None or uid in router.pending:
+            return None
+        return router.route(self.model, uid)
+
+    def _live_connections(self, uids):
+        if self.virtual is not None:
+            live = self.virtual.live_edges
+        else:
+            if self._edges_by_uid is None:
+                self._edges_by_uid = {conn.edge_uid: conn for conn in self.registry.connections}
+            live = self._edges_by_uid
+        return [live[uid] for uid in np.asarray(uids).tolist() if uid in live]
+
+    def _invalidate_routes(self, kind, payload):
+        router = self.router
+        model = self.model
+        if kind in ("clear", "reset"):
+            self.stop_routing()
+            router.reset()
+            self.schedule_connection_updates(self.registry.connections)
+            return
+        if kind == "move":
+            uids = router.blocks_changed(model, [block.id for block, _ in payload])
+        elif kind == "add_block":
+            uids = router.blocks_changed(model, [payload.id])
+        elif kind == "edit":
+            uids = router.blocks_changed(model, [payload[0].id])
+        elif kind == "remove_block":
+            uids = router.block_removed([conn.edge_uid for conn in payload[1]])
+        elif kind == "remove_items":
+            uids = router.block_removed(payload[2])
+        elif kind == "remove_connection":
+            uids = router.invalidate([payload.edge_uid])
+        elif kind == "add_connection":
+            # 虚拟化模式下新连线此时还不在 live_edges 中
+            self.schedule_connection_updates([payload])
+            return
+        else:
+            return
+        self.schedule_connection_updates(self._live_connections(uids))
+
+    def _plan_routes(self, connections):
+        # 本帧需要新算的线路较多时整批交给后台线程，期间这些连线暂时画成直线
+        router = self.router
+        missing = [conn.edge_uid for conn in connections
+                   if conn.edge_uid is not None and conn.edge_uid not in router.routes
+                   and conn.edge_uid not in router.pending]
+        if len(missing) > ROUTE_SYNC_LIMIT and self.route_in_background:
+            self._start_routing(missing)
+
+    def _start_routing(self, uids):
+        uids = set(uids)
+        if self._route_worker is not None:
+            # 上一批还没算完的连线并入新的一批
+            uids |= self.router.pending
+            self.stop_routing()
+        worker = RouteWorker(self.router.job(self.model, uids), self)
+        worker.routed.connect(self._routes_ready)
+        worker.finished.connect(lambda: self._routing_finished(worker))
+        self._route_worker = worker
+        worker.start()
+
+    def _routes_ready(self, job, uids, routes):
+        if self.router is None:
+            return
+        accepted = self.router.accept(job, uids, routes)
+        self.schedule_connection_updates(self._live_connections(accepted))
+
+    def _routing_finished(self, worker):
+        if self._route_worker is worker:
+            self._route_worker = None
+        worker.deleteLater()
+
+    def stop_routing(self, wait=False):
+        """停止后台路由，wait 为 True 时等待线程退出（关闭窗口时使用）"""
+        worker = self._route_worker
+        self._route_worker = None
+        if worker is not None and worker.isRunning():
+            worker.requestInterruption()
+            worker.routed.disconnect()
+            if wait:
+                worker.wait()
+
+
+# ====================== 连线路由 ======================
+# 一帧内需要新算的线路超过这个数量时在后台线程计算
+ROUTE_SYNC_LIMIT = 64
+ROUTE_CHUNK = 200
+
+
+class RouteWorker(QThread):
+    """在后台线程计算一批连线的线路，每算完一块发出一次结果"""
+    routed = pyqtSignal(object, object, object)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+
+    def run(self):
+        for uids, routes in self.job.run(ROUTE_CHUNK, self.isInterruptionRequested):
+            self.routed.emit(self.job, uids, routes)
+
+
+class BundleLayer(QGraphicsItem):
+    """
+    捆绑路由下所有连线共用的绘制层。
+
+    捆绑后的线路汇成贯穿全图的主干，每条连线的外接矩形都接近整个视图，逐条作为
+    图元绘制时，拖动一个方块就要把视口内每条连线的 1~4 条偏移折线重描一遍。
+    这里把没有变化的线路按视图变换画进一张缓存位图，正在变化的线路（拖动中的方块
+    的连线等）每帧在位图上方重画；没有正在变化的线路时只画与重绘区域相交的线路。
+    连线图元仍负责选取和命中测试，只在选中时自己绘制。
+    """
+
+    def __init__(self):
+        super().__init__()
+        # 连线 -> (线型, 各条偏移折线, 中心折线, 外接矩形)
+        self._routes = {}
+        # 不在缓存位图中、每帧重画的线路
+        self._active = {}
+        # 上次绘制之后变化过的线路
+        self._fresh = set()
+        # ((视口, 视图变换, 视口尺寸), 位图)
+        self._cache = None
+        self._rect = QRectF()
+        self.setZValue(-1)
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def __contains__(self, conn):
+        return conn in self._routes
+
+    def set_route(self, conn, strokes, center):
+        """登记或替换连线的线路，strokes 为各条偏移折线，center 为中心折线"""
+        old = self._routes.get(conn)
+        if old is not None:
+            self.update(old[3])
+        if conn not in self._active:
+            if old is not None:
+                # 缓存位图里还是旧的线路
+                self._cache = None
+            self._active[conn] = None
+        rect = conn.path().boundingRect().adjusted(-2, -2, 2, 2)
+        self._routes[conn] = (conn.line_type, strokes, center, rect)
+        self._fresh.add(conn)
+        if not self._rect.contains(rect):
+            self.prepareGeometryChange()
+            self._rect = self._rect.united(rect)
+        self.update(rect)
+
+    def discard(self, conn):
+        entry = self._routes.pop(conn, None)
+        if entry is None:
+            return
+        if conn in self._active:
+            del self._active[conn]
+        else:
+            # 缓存位图里有这条线路
+            self._cache = None
+        self._fresh.discard(conn)
+        self.update(entry[3])
+
+    def release(self):
+        """移除全部线路，连线图元恢复自己绘制"""
+        for conn in self._routes:
+            conn.setFlag(QGraphicsItem.ItemHasNoContents, False)
+        self._routes.clear()
+        self._active.clear()
+        self._fresh.clear()
+        self._cache = None
+        self.prepareGeometryChange()
+        self._rect = QRectF()
+
+    def boundingRect(self):
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        if widget is None or not self._active:
+            # 导出或没有正在变化的线路：和逐条绘制一样只画重绘区域内的线路
+            self._draw(painter, self.scene().registry.connections, option.exposedRect)
+        else:
+            key = (widget, painter.worldTransform(), widget.size())
+            settled = sum(1 for conn in self._active if conn not in self._fresh)
+            if self._cache is None or self._cache[0] != key or settled > BULK_THRESHOLD:
+                self._render_cache(key, painter)
+            painter.save()
+            painter.resetTransform()
+            painter.drawPixmap(0, 0, self._cache[1])
+            painter.restore()
+            self._draw(painter, self._active, option.exposedRect)
+        self._fresh.clear()
+
+    def _render_cache(self, key, painter):
+        # 上次绘制后不再变化的线路并入位图
+        self._active = {conn: None for conn in self._active if conn in self._fresh}
+        widget = key[0]
+        ratio = widget.devicePixelRatioF()
+        pixmap = QPixmap(widget.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        cache_painter = QPainter(pixmap)
+        cache_painter.setRenderHints(painter.renderHints())
+        cache_painter.setWorldTransform(painter.worldTransform())
+        visible = painter.worldTransform().inverted()[0].mapRect(QRectF(widget.rect()))
+        self._draw(cache_painter, [conn for conn in self.scene().registry.connections
+                                   if conn not in self._active], visible)
+        cache_painter.end()
+        self._cache = (key, pixmap)
+
+    def _draw(self, painter, connections, rect):
+        # 按连线的创建顺序绘制，重叠处的上下次序和逐条绘制时相同
+        single = level_of_detail(painter) < LOD_SINGLE_STROKE
+        painter.setBrush(Qt.NoBrush)
+        pen_type = None
+        for conn in connections:
+            entry = self._routes.get(conn)
+            if entry is None or not entry[3].intersects(rect):
+                continue
+            line_type, strokes, center, _ = entry
+            if line_type is not pen_type:
+                painter.setPen(line_type.get_pen())
+                pen_type = line_type
+            if single and len(strokes) > 1:
+                painter.drawPolyline(center)
+            else:
+                for polygon in strokes:
+                    painter.drawPolyline(polygon)
+
+
+# ====================== 虚拟化场景 ======================
+# 导入的方块与连线总数达到这个值时使用虚拟化模式
+VIRTUAL_THRESHOLD = 50000
+# 视口之外额外保留的范围（相对视口尺寸）以及可见区域的量化网格
+VIRTUAL_OVERSCAN = 0.25
+VIRTUAL_TILE_SIZE = 512
+# 可见方块超过这个数量时不再创建图元，改为直接绘制概览
+MAX_LIVE_BLOCKS = 2000
+MAX_LIVE_EDGES = 6000
+OVERVIEW_EDGE_LIMIT = 10000
+ITEM_POOL_LIMIT = 2000
+
+
+class VirtualDiagram:
+    """
+    虚拟化模式下的图元管理，数据全部在场景的 DiagramModel 中。
+
+    只为可见区域（含外扩范围）内的方块、连线创建图元，离开视口的图元回收到对象池
+    供下次复用。图元上的修改由场景同步到 model，这里只维护 编号/uid -> 图元 的映射。
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.live_blocks = {}
+        self.live_edges = {}
+        self._pinned_blocks = set()
+        self._pinned_edges = set()
+        self._block_pool = []
+        self._edge_pool = []
+        self.overview = False
+        self.through_overflow = False
+        scene.diagram_changed.connect(self._sync)
+
+    @property
+    def model(self):
+        return self.scene.model
+
+    def bounds(self, margin=1000):
+        bounds = self.model.bounds()
+        if bounds is None:
+            return QRectF(-margin, -margin, 2 * margin, 2 * margin)
+        x0, y0, x1, y1 = bounds
+        return QRectF(x0 - margin, y0 - margin, x1 - x0 + 2 * margin, y1 - y0 + 2 * margin)
+
+    def set_centers(self, ids, center_x, center_y):
+        """布局结果直接写入 model，作为一次整图替换通知"""
+        scene = self.scene
+        model = self.model
+        before = model.to_tables()
+        model.set_centers(ids.tolist(), center_x, center_y)
+        for block_id, block in self.live_blocks.items():
+            row = model.row_of[block_id]
+            block.setPos(model.x[row], model.y[row])
+            # 坐标已经写入 model，不再作为逐个方块的移动发出
+            scene._moving_blocks.pop(block, None)
+        scene.setSceneRect(scene.sceneRect().united(self.bounds()))
+        scene.notify("clear", before)
+        scene.notify("reset", scene.move_group)
+
+    # ---------- 图元 ----------
+    def materialize_block(self, block_id):
+        """返回编号对应的方块图元，必要时创建，并保留到下次可见区域更新"""
+        block = self.live_blocks.get(block_id)
+        if block is None:
+            model = self.model
+            row = model.row_of[block_id]
+            args = (model.names[row], float(model.x[row]), float(model.y[row]),
+                    float(model.width[row]), float(model.height[row]))
+            if self._block_pool:
+                block = self._block_pool.pop()
+                block.id = block_id
+                block.name = args[0]
+                block.setRect(0, 0, args[3], args[4])
+                block.setPos(args[1], args[2])
+                block._update_text()
+            else:
+                block = DraggableBlock(*args, block_id=block_id)
+            self.scene._insert_block(block)
+            self.live_blocks[block_id] = block
+        self._pinned_blocks.add(block_id)
+        return block
+
+    def materialize_edge(self, uid):
+        conn = self.live_edges.get(uid)
+        if conn is None:
+            model = self.model
+            i = model.edge_index(uid)
+            start = self.materialize_block(int(model.edge_start[i]))
+            end = self.materialize_block(int(model.edge_end[i]))
+            line_type = _LINE_TYPES_BY_NUMBER[model.edge_line[i]]
+            if self._edge_pool:
+                conn = self._edge_pool.pop()
+                conn.start_block = start
+                conn.end_block = end
+                conn.line_type = line_type
+                conn.update_line()
+            else:
+                conn = Connection(start, end, line_type)
+            conn.edge_uid = uid
+            self.scene._attach_connection(conn)
+            self.live_edges[uid] = conn
+            if self.scene.router is not None:
+                self.scene.schedule_connection_updates([conn])
+        self._pinned_edges.add(uid)
+        return conn
+
+    def materialize_incident(self, block):
+        """删除方块前创建它的全部连线图元，使删除通知包含完整的连线"""
+        for uid in self.model.incident_edges(block.id).tolist():
+            self.materialize_edge(uid)
+
+    def _release_edge(self, uid):
+        conn = self.live_edges.pop(uid)
+        self.scene._detach_connection(conn)
+        if len(self._edge_pool) < ITEM_POOL_LIMIT:
+            self._edge_pool.append(conn)
+
+    def _release_block(self, block_id):
+        block = self.live_blocks.pop(block_id)
+        block.setSelected(False)
+        self.scene.registry.remove_block(block)
+        self.scene.removeItem(block)
+        if len(self._block_pool) < ITEM_POOL_LIMIT:
+            self._block_pool.append(block)
+
+    def update_visible(self, rect):
+        """
+        按可见区域增减图元。
+
+        参数:
+            rect: 场景坐标下的可见区域（已含外扩范围）
+        """
+        scene = self.scene
+        scene.flush_connection_updates()
+        model = self.model
+        area = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        visible = model.blocks_in(*area)
+        # 折叠分组中的方块和连到它们的连线不创建图元
+        hidden = scene.cluster_layer.hidden_mask()
+        shown_edges = None
+        if hidden is not None:
+            visible &= ~hidden
+            start, end = model.edge_rows()
+            shown_edges = ~(hidden[start] | hidden[end])
+
+        # 被选中或正在拖动的图元始终保留，保留的连线两端方块也要保留
+        grabber = scene.mouseGrabberItem()
+        for block_id, block in self.live_blocks.items():
+            if block.isSelected() or block is grabber:
+                self._pinned_blocks.add(block_id)
+        for uid, conn in self.live_edges.items():
+            if conn.isSelected() or uid in self._pinned_edges:
+                self._pinned_edges.add(uid)
+                self._pinned_blocks.update((conn.start_block.id, conn.end_block.id))
+        needed_blocks = set(self._pinned_blocks)
+        needed_edges = set(self._pinned_edges)
+
+        self.overview = int(visible.sum()) > MAX_LIVE_BLOCKS
+        self.through_overflow = False
+        if not self.overview and model.n_edges:
+            start, end = model.edge_rows()
+            incident = visible[start] | visible[end]
+            through = model.edges_through(*area) & ~incident
+            if shown_edges is not None:
+                incident &= shown_edges
+                through &= shown_edges
+            if int(incident.sum()) > MAX_LIVE_EDGES:
+                self.overview = True
+            else:
+                # 两端都不可见、只是穿过视口的长连线超出预算时直接绘制，不创建图元
+                if int(incident.sum()) + int(through.sum()) <= MAX_LIVE_EDGES:
+                    incident |= through
+                else:
+                    self.through_overflow = True
+                needed_edges.update(model.edge_uid[incident].tolist())
+                needed_blocks.update(model.ids[start[incident]].tolist())
+                needed_blocks.update(model.ids[end[incident]].tolist())
+        if not self.overview:
+            needed_blocks.update(model.ids[visible].tolist())
+            # 长连线另一端的方块也要创建图元，总数同样受限
+            if len(needed_blocks) > MAX_LIVE_BLOCKS:
+                self.overview = True
+                self.through_overflow = False
+                needed_blocks = set(self._pinned_blocks)
+                needed_edges = set(self._pinned_edges)
+        if hidden is not None:
+            needed_blocks -= scene.cluster_layer.hidden_ids
+            needed_edges -= set(model.edge_uid[~shown_edges].tolist())
+
+        stale_edges = [uid for uid in self.live_edges if uid not in needed_edges]
+        stale_blocks = [b for b in self.live_blocks if b not in needed_blocks]
+        # 折叠分组等一次回收大量图元时同样暂停索引
+        created = (len(needed_blocks) - len(self.live_blocks) + len(stale_blocks)
+                   + len(needed_edges) - len(self.live_edges) + len(stale_edges))
+        with scene.suspend_index(created + len(stale_edges) + len(stale_blocks)):
+            for uid in stale_edges:
+                self._release_edge(uid)
+            for block_id in stale_blocks:
+                self._release_block(block_id)
+            for block_id in needed_blocks:
+                self.materialize_block(block_id)
+            for uid in needed_edges:
+                self.materialize_edge(uid)
+        self._pinned_blocks.clear()
+        self._pinned_edges.clear()
+
+    def _paint_edges(self, painter, selected):
+        start, end = self.model.edge_rows()
+        start, end = start[selected], end[selected]
+        step = max(1, len(start) // OVERVIEW_EDGE_LIMIT)
+        start, end = start[::step], end[::step]
+        cx, cy = self.model.centers()
+        painter.setPen(QPen(Qt.black, 0))
+        painter.drawLines([QLineF(a, b, c, d) for a, b, c, d in zip(
+            cx[start].tolist(), cy[start].tolist(), cx[end].tolist(), cy[end].tolist())])
+
+    def paint_overview(self, painter, rect):
+        """
+        直接按数组绘制没有图元的部分：可见方块过多时绘制全部方块和（抽样的）连线，
+        否则只绘制穿过视口、超出图元预算的长连线。
+        """
+        model = self.model
+        area = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        visible = model.blocks_in(*area)
+        hidden = self.scene.cluster_layer.hidden_mask()
+        if hidden is not None:
+            visible &= ~hidden
+        if model.n_edges:
+            through = model.edges_through(*area)
+            start, end = model.edge_rows()
+            if hidden is not None:
+                through &= ~(hidden[start] | hidden[end])
+            if not self.overview:
+                through &= ~(visible[start] | visible[end])
+            self._paint_edges(painter, through)
+        if not self.overview:
+            return
+        visible = np.flatnonzero(visible)
+        brush = QBrush(QColor(173, 216, 230))
+        painter.setPen(Qt.NoPen)
+        for x, y, w, h in zip(model.x[visible].tolist(), model.y[visible].tolist(),
+                              model.width[visible].tolist(), model.height[visible].tolist()):
+            painter.fillRect(QRectF(x, y, w, h), brush)
+
+    def detach(self):
+        self.scene.diagram_changed.disconnect(self._sync)
+        self.live_blocks.clear()
+        self.live_edges.clear()
+        self._block_pool.clear()
+        self._edge_pool.clear()
+
+    # ---------- 同步 ----------
+    def _sync(self, kind, payload):
+        # model 已由场景更新，这里只维护图元映射和场景范围
+        if kind == "move":
+            rect = self.scene.sceneRect()
+            for block, _ in payload:
+                if not rect.contains(block.sceneBoundingRect()):
+                    self.scene.setSceneRect(rect.united(self.bounds()))
+                    break
+        elif kind == "add_block":
+            self.live_blocks[payload.id] = payload
+        elif kind in ("remove_block", "remove_items"):
+            # 已删除的图元不能留在保留集合中，否则下次更新可见区域时会按编号重新创建
+            if kind == "remove_block":
+                block_ids = [payload[0].id]
+                uids = [conn.edge_uid for conn in payload[1]]
+            else:
+                block_ids, uids = payload[0].ids.tolist(), payload[2].tolist()
+            for block_id in block_ids:
+                self.live_blocks.pop(block_id, None)
+                self._pinned_blocks.discard(block_id)
+            for uid in uids:
+                self.live_edges.pop(uid, None)
+                self._pinned_edges.discard(uid)
+        elif kind == "add_connection":
+            self.live_edges[payload.edge_uid] = payload
+        elif kind == "remove_connection":
+            self.live_edges.pop(payload.edge_uid, None)
+            self._pinned_edges.discard(payload.edge_uid)
+        elif kind == "edit":
+            block, old = payload
+            self.live_blocks[block.id] = self.live_blocks.pop(old["id"])
+            if old["id"] in self._pinned_blocks:
+                self._pinned_blocks.discard(old["id"])
+                self._pinned_blocks.add(block.id)
+
+
+# ====================== 分组 ======================
+# 折叠分组的代理方块尺寸以及展开分组外框的留白
+PROXY_WIDTH = 140
+PROXY_HEIGHT = 70
+CLUSTER_PADDING = 12
+# 聚合连线的宽度随权重增加，最粗不超过这个值
+PROXY_LINK_MAX_WIDTH = 10
+
+
+class ClusterProxy(QGraphicsRectItem):
+    """折叠分组在场景中的代理方块，拖动时整组方块一起移动"""
+
+    def __init__(self, cluster_id):
+        super().__init__(0, 0, PROXY_WIDTH, PROXY_HEIGHT)
+        self.cluster_id = cluster_id
+        self.links = []
+        self._press_pos = None
+        self.setBrush(QBrush(QColor(255, 236, 179)))
+        self.setPen(QPen(Qt.darkYellow, 2, Qt.DashLine))
+        self.setFlags(QGraphicsRectItem.ItemIsMovable |
+                      QGraphicsRectItem.ItemSendsGeometryChanges |
+                      QGraphicsRectItem.ItemIsSelectable)
+        self.text = BlockLabel("", self)
+        self.text.setPos(5, 5)
+
+    def set_label(self, name, count):
+        self.text.setPlainText(f"{name}\n（{count} 个工作组）")
+
+    def get_center(self):
+        return self.mapToScene(self.rect().center())
+
+    @staticmethod
+    def top_left(cx, cy):
+        """中心位于 (cx, cy) 时代理的位置"""
+        return QPointF(cx - PROXY_WIDTH / 2, cy - PROXY_HEIGHT / 2)
+
+    def place(self, cx, cy):
+        self.setPos(self.top_left(cx, cy))
+
+    def itemChange(self, change, value):
+        if change == QGraphicsRectItem.ItemPositionHasChanged:
+            for link in self.links:
+                link.update_line()
+        return super().itemChange(change, value)
+
+    def mousePressEvent(self, event):
+        self._press_pos = self.pos()
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        start, self._press_pos = self._press_pos, None
+        if start is not None and self.pos() != start:
+            delta = self.pos() - start
+            scene = self.scene()
+            scene.move_blocks_by(scene.clusters.member_ids(self.cluster_id), delta.x(), delta.y())
+
+    def mouseDoubleClickEvent(self, event):
+        self.scene().set_collapsed(self.cluster_id, False)
+
+    def contextMenuEvent(self, event):
+        scene = self.scene()
+        menu = QMenu()
+        expand_action = menu.addAction("展开分组")
+        rename_action = menu.addAction("重命名分组")
+        ungroup_action = menu.addAction("取消分组")
+        action = menu.exec_(event.screenPos())
+        if action == expand_action:
+            scene.set_collapsed(self.cluster_id, False)
+        elif action == rename_action:
+            name, ok = QInputDialog.getText(None, "重命名分组", "分组名称:",
+                                            text=scene.clusters.clusters[self.cluster_id].name)
+            if ok and name:
+                scene.rename_cluster(self.cluster_id, name)
+        elif action == ungroup_action:
+            scene.ungroup(self.cluster_id)
+
+
+class ProxyConnection(QGraphicsPathItem):
+    """
+    合并后的连线，端点为方块编号（非负）或 -分组编号。
+
+    颜色取合并的连线中最粗的线型，宽度随线条数之和增加。
+    """
+
+    def __init__(self, layer, a, b, count, weight, strongest):
+        super().__init__()
+        self.layer = layer
+        self.keys = (a, b)
+        self.stats = None
+        self.set_stats(count, weight, strongest)
+        self.setZValue(-1)
+        self.update_line()
+
+    def set_stats(self, count, weight, strongest):
+        """合并的线条数、权重之和与最粗的线型编号变化时更新画笔和提示"""
+        self.stats = (count, weight, strongest)
+        line_type = _LINE_TYPES_BY_NUMBER[strongest]
+        width = min(PROXY_LINK_MAX_WIDTH, 1 + weight ** 0.5)
+        self.setPen(QPen(line_type.get_color(), width))
+        self.setToolTip(f"{count} 条连线，权重 {weight}（最粗为{line_type.value}）")
+
+    def update_line(self):
+        layer = self.layer
+        path = QPainterPath(layer.endpoint(self.keys[0]))
+        path.lineTo(layer.endpoint(self.keys[1]))
+        self.setPath(path)
+
+
+class ClusterLayer(QObject):
+    """
+    按场景的 clusters 维护折叠分组的显示。
+
+    折叠分组中的方块和连线移出场景（虚拟化模式下不再创建图元），每个最外层的
+    折叠分组换成一个 ClusterProxy，端点被隐藏的连线经 aggregate_edges 合并成
+    ProxyConnection。分组变化时立即重建；其余修改只在涉及被折叠的方块或连线时，
+    在下一次事件循环中合并重建。重建按端点比较新旧聚合连线，只增删有变化的图元。
+    """
+    changed = pyqtSignal()
+
+    def __init__(self, scene):
+        super().__init__(scene)
+        self.scene = scene
+        self.proxies = {}
+        self.links = []
+        self.hidden_ids = set()
+        # model 每一行所属的折叠分组（ClusterTree.owners），None 表示需要重算
+        self._owners = None
+        self._outlines = None
+        self._rebuild_timer = QTimer(self)
+        self._rebuild_timer.setSingleShot(True)
+        self._rebuild_timer.setInterval(0)
+        self._rebuild_timer.timeout.connect(self.rebuild)
+        scene.diagram_changed.connect(self._diagram_changed)
+
+    def _diagram_changed(self, kind, payload):
+        self._outlines = None
+        if kind == "clear":
+            return
+        if kind == "move":
+            self._blocks_moved([block.id for block, _ in payload])
+            return
+        if kind in ("add_block", "remove_block", "remove_items", "edit"):
+            self._owners = None
+        if kind in ("clusters", "reset"):
+            self.rebuild()
+        elif (self.proxies or self.hidden_ids) and self._touches_hidden(kind, payload):
+            self._rebuild_timer.start()
+
+    def _touches_hidden(self, kind, payload):
+        """修改是否涉及被折叠的方块或连到它们的连线，不涉及时代理和聚合连线都不变"""
+        hidden = self.hidden_ids
+        if kind == "add_block":
+            # 新方块不属于任何分组，加入分组时另有 "clusters" 通知
+            return False
+        if kind in ("add_connection", "remove_connection"):
+            return payload.start_block.id in hidden or payload.end_block.id in hidden
+        if kind == "line_type":
+            return any(conn.start_block.id in hidden or conn.end_block.id in hidden
+                       for conn, _ in payload)
+        if kind == "remove_block":
+            block, connections = payload[:2]
+            return block.id in hidden or any(
+                conn.start_block.id in hidden or conn.end_block.id in hidden
+                for conn in connections)
+        if kind == "remove_items":
+            blocks, relations = payload[:2]
+            keys = np.concatenate([blocks.ids, relations.start, relations.end])
+            return bool(np.isin(keys, np.fromiter(hidden, dtype=np.int64, count=len(hidden))).any())
+        if kind == "edit":
+            # 编号变化后聚合连线的端点也随之变化
+            block, old = payload
+            return old["id"] in hidden or old["id"] != block.id
+        return True
+
+    def owners(self):
+        if self._owners is None or len(self._owners) != len(self.scene.model):
+            self._owners = self.scene.clusters.owners(self.scene.model)
+        return self._owners
+
+    def hidden_mask(self):
+        """model 中被折叠的行，没有折叠分组时为 None"""
+        if not self.hidden_ids:
+            return None
+        return self.owners() != 0
+
+    def endpoint(self, key):
+        """聚合连线端点的场景坐标"""
+        if key < 0:
+            return self.proxies[-key].get_center()
+        model = self.scene.model
+        row = model.row_of[key]
+        return QPointF(model.x[row] + model.width[row] / 2, model.y[row] + model.height[row] / 2)
+
+    def clear(self):
+        """图表清空时移除代理图元，方块和连线由场景自己处理"""
+        self._rebuild_timer.stop()
+        for item in [*self.links, *self.proxies.values()]:
+            if item.scene() is self.scene:
+                self.scene.removeItem(item)
+        self.proxies = {}
+        self.links = []
+        self.hidden_ids = set()
+        self._owners = None
+        self._outlines = None
+
+    # ---------- 重建 ----------
+    def rebuild(self):
+        self._rebuild_timer.stop()
+        scene = self.scene
+        model = scene.model
+        clusters = scene.clusters
+        self._owners = None
+        owners = self.owners()
+        hidden_rows = owners != 0
+        hidden = set(model.ids[hidden_rows].tolist())
+        if scene.virtual is None:
+            self._apply_hidden(hidden)
+        self.hidden_ids = hidden
+
+        roots = np.unique(owners[hidden_rows])
+        counts = np.bincount(np.searchsorted(roots, owners[hidden_rows]), minlength=len(roots))
+        stats = {}
+        if len(roots):
+            start, end = model.edge_rows()
+            _, a, b, count, weight, strongest = aggregate_edges(start, end, model.edge_line, owners)
+            ids = model.ids
+            a = np.where(a >= 0, ids[np.maximum(a, 0)], a)
+            b = np.where(b >= 0, ids[np.maximum(b, 0)], b)
+            stats = {(link_a, link_b): values for link_a, link_b, *values in zip(
+                a.tolist(), b.tolist(), count.tolist(), weight.tolist(), strongest.tolist())}
+
+        # 端点相同的聚合连线保留原来的图元，只增删有变化的部分
+        old = {link.keys: link for link in self.links}
+        stale = [link for keys, link in old.items() if keys not in stats]
+        added = [keys for keys in stats if keys not in old]
+        shown = set(roots.tolist())
+        centers = {cluster_id: self._members_center(owners == cluster_id)
+                   for cluster_id in shown}
+        moved = sum(len(proxy.links) for cluster_id, proxy in self.proxies.items()
+                    if cluster_id in shown
+                    and proxy.pos() != ClusterProxy.top_left(*centers[cluster_id]))
+        with scene.suspend_index(len(stale) + len(added) + moved):
+            for link in stale:
+                scene.removeItem(link)
+            self.links = [link for keys, link in old.items() if keys in stats]
+            for cluster_id in [c for c in self.proxies if c not in shown]:
+                scene.removeItem(self.proxies.pop(cluster_id))
+            for proxy in self.proxies.values():
+                proxy.links = []
+            for link in self.links:
+                if link.stats != tuple(stats[link.keys]):
+                    link.set_stats(*stats[link.keys])
+                self._attach_link(link)
+            # 已有的代理移动时由 itemChange 更新保留下来的聚合连线
+            for cluster_id, count in zip(roots.tolist(), counts.tolist()):
+                proxy = self.proxies.get(cluster_id)
+                if proxy is None:
+                    proxy = self.proxies[cluster_id] = ClusterProxy(cluster_id)
+                    scene.addItem(proxy)
+                proxy.set_label(clusters.clusters[cluster_id].name, count)
+                proxy.place(*centers[cluster_id])
+            for keys in added:
+                link = ProxyConnection(self, *keys, *stats[keys])
+                scene.addItem(link)
+                self.links.append(link)
+                self._attach_link(link)
+        self._outlines = None
+        self.changed.emit()
+
+    def _attach_link(self, link):
+        for key in link.keys:
+            if key < 0:
+                self.proxies[-key].links.append(link)
+
+    def _members_center(self, rows):
+        model = self.scene.model
+        x0, y0 = model.x[rows].min(), model.y[rows].min()
+        x1 = (model.x[rows] + model.width[rows]).max()
+        y1 = (model.y[rows] + model.height[rows]).max()
+        return float(x0 + x1) / 2, float(y0 + y1) / 2
+
+    def _apply_hidden(self, hidden):
+        """非虚拟化模式下把方块和连线移出或放回场景"""
+        scene = self.scene
+        blocks = scene.registry.blocks
+        shown_items = [blocks[b] for b in self.hidden_ids - hidden if b in blocks]
+        hidden_items = [blocks[b] for b in hidden - self.hidden_ids if b in blocks]
+        # 新增的连线可能连到已隐藏的方块，这里连同所有隐藏方块的连线一起检查
+        for block_id in self.hidden_ids | hidden:
+            block = blocks.get(block_id)
+            if block is None:
+                continue
+            for conn in block.connections:
+                shown = conn.start_block.id not in hidden and conn.end_block.id not in hidden
+                if shown and conn.scene() is None:
+                    shown_items.append(conn)
+                elif not shown and conn.scene() is scene:
+                    hidden_items.append(conn)
+        shown_items = list({item: None for item in shown_items if item.scene() is None})
+        hidden_items = list({item: None for item in hidden_items if item.scene() is scene})
+        # 大量图元进出场景时暂停索引，长连线逐个移出 BSP 树比整体重建慢得多
+        with scene.suspend_index(len(shown_items) + len(hidden_items)):
+            for item in hidden_items:
+                item.setSelected(False)
+                scene.removeItem(item)
+                if isinstance(item, DraggableBlock):
+                    item.detached_scene = scene
+            for item in shown_items:
+                scene.addItem(item)
+                if isinstance(item, DraggableBlock):
+                    item.detached_scene = None
+                else:
+                    item.update_line()
+
+    def _blocks_moved(self, block_ids):
+        # 隐藏的方块移动（撤销、拖动代理）时代理跟随，连到移动方块的聚合连线重画
+        if not self.proxies:
+            return
+        owners = self.owners()
+        row_of = self.scene.model.row_of
+        moved = set(block_ids)
+        clusters = {int(owners[row_of[block_id]]) for block_id in moved} - {0}
+        for cluster_id in clusters:
+            proxy = self.proxies.get(cluster_id)
+            if proxy is not None and proxy is not self.scene.mouseGrabberItem():
+                proxy.place(*self._members_center(owners == cluster_id))
+        for link in self.links:
+            if link.keys[0] in moved or link.keys[1] in moved:
+                link.update_line()
+
+    # ---------- 外框 ----------
+    def outlines(self):
+        """展开的分组的外框 [(QRectF, 名称)]，包含其中可见的方块和折叠子分组的代理"""
+        if self._outlines is not None:
+            return self._outlines
+        scene = self.scene
+        clusters = scene.clusters
+        model = scene.model
+        self._outlines = []
+        if not clusters.clusters:
+            return self._outlines
+        display = clusters.display_owners()
+        rows_of = {}
+        for block_id, cluster_id in clusters.members.items():
+            row = model.row_of.get(block_id)
+            if row is not None:
+                rows_of.setdefault(cluster_id, []).append(row)
+        for cluster_id, cluster in clusters.clusters.items():
+            if display[cluster_id]:
+                continue
+            rect = QRectF()
+            descendants = clusters.descendants(cluster_id)
+            for c in descendants:
+                proxy = self.proxies.get(c)
+                if proxy is not None:
+                    rect = rect.united(proxy.sceneBoundingRect())
+                elif not display[c] and c in rows_of:
+                    rows = np.array(rows_of[c], dtype=np.int64)
+                    x0, y0 = model.x[rows].min(), model.y[rows].min()
+                    x1 = (model.x[rows] + model.width[rows]).max()
+                    y1 = (model.y[rows] + model.height[rows]).max()
+                    rect = rect.united(QRectF(x0, y0, x1 - x0, y1 - y0))
+            if not rect.isNull():
+                # 外层分组的外框按嵌套层数加大留白，包住内层的外框
+                depth = len(clusters.ancestors(cluster_id))
+                levels = max(len(clusters.ancestors(c)) for c in descendants) - depth + 1
+                pad = CLUSTER_PADDING * levels
+                self._outlines.append((rect.adjusted(-pad, -pad, pad, pad), cluster.name))
+        return self._outlines
+
+    def paint_outlines(self, painter, rect):
+        outlines = [item for item in self.outlines() if item[0].intersects(rect)]
+        if not outlines:
+            return
+        painter.setPen(QPen(Qt.darkYellow, 0, Qt.DashLine))
+        painter.setBrush(Qt.NoBrush)
+        for outline, name in outlines:
+            painter.drawRect(outline)
+            painter.drawText(outline.topLeft() + QPointF(4, -4), name)
+
+
+# ====================== 背景 ======================
+BACKGROUND_TILE_SIZE = 256
+BACKGROUND_MIN_LEVEL = 64
+MAX_BACKGROUND_SIDE = 8192
+# 缩放或改变窗口大小停止后多久生成与屏幕尺寸一致的清晰层
+BACKGROUND_SETTLE_MS = 150
+
+
+class BackgroundLoader(QThread):
+    """在后台线程解码背景图，图片无效时发出 None"""
+    loaded = pyqtSignal(object)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        image = QImage(self.path)
+        self.loaded.emit(None if image.isNull() else image)
+
+
+class BackgroundScaler(QThread):
+    """在后台线程缩放背景图，QImage 可以跨线程使用"""
+    scaled = pyqtSignal(int, object)
+
+    def __init__(self, token, image, widths, parent=None):
+        super().__init__(parent)
+        self.token = token
+        self.image = image
+        self.widths = widths
+
+    def run(self):
+        images = [self.image.scaledToWidth(width, Qt.SmoothTransformation)
+                  for width in self.widths]
+        self.scaled.emit(self.token, images)
+
+
+class CanvasBackground(QObject):
+    """
+    视图背景图：预先生成逐级减半的金字塔，按当前缩放选最接近的一层，
+    切成小块缓存为 QPixmap，在 drawBackground 中只绘制露出的块。
+
+    图片在场景中按视口宽度拉伸、中心位于原点；缩放或改变大小停止后，
+    在后台生成与屏幕尺寸一致的一层替换近似层。
+    """
+
+    def __init__(self, canvas, image):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.image = image
+        self.rect = QRectF()
+        # 每层为 QImage，按宽度升序；_tiles 只保存当前正在使用的层
+        self.levels = [image]
+        self._tiles = {}
+        self._tile_level = None
+        self._token = 0
+        self._workers = set()
+        self._pending_width = None
+        # 不绘制任何内容，只让场景范围包含背景区域
+        self.anchor = QGraphicsRectItem()
+        self.anchor.setFlag(QGraphicsRectItem.ItemHasNoContents)
+        self.anchor.setZValue(-2)
+        canvas.scene.addItem(self.anchor)
+
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(BACKGROUND_SETTLE_MS)
+        self._settle_timer.timeout.connect(self._request_exact)
+
+        widths = []
+        width = image.width() // 2
+        while width >= BACKGROUND_MIN_LEVEL:
+            widths.append(width)
+            width //= 2
+        self._scale(widths)
+
+    def fit(self, view_width):
+        """按宽度拉伸，保持宽高比，图片中心为场景原点"""
+        width = float(view_width)
+        height = width * self.image.height() / self.image.width()
+        self.rect = QRectF(-width / 2, -height / 2, width, height)
+        self.anchor.setRect(self.rect)
+        self.invalidate()
+
+    def invalidate(self):
+        self.canvas.resetCachedContent()
+        self.canvas.viewport().update()
+        self._settle_timer.start()
+
+    # ---------- 缩放 ----------
+    def _scale(self, widths):
+        self._token += 1
+        worker = BackgroundScaler(self._token, self.image, widths, self)
+        worker.scaled.connect(self._on_scaled)
+        worker.finished.connect(lambda: self._worker_finished(worker))
+        self._workers.add(worker)
+        worker.start()
+
+    def _worker_finished(self, worker):
+        self._workers.discard(worker)
+        worker.deleteLater()
+
+    def _on_scaled(self, token, images):
+        levels = {level.width(): level for level in self.levels}
+        for image in images:
+            levels[image.width()] = image
+        # 同一宽度只保留一层，金字塔之外只保留最近一次请求的清晰层
+        self.levels = sorted(levels.values(), key=QImage.width)
+        self._drop_stale_levels(keep=self._pending_width)
+        self._tile_level = None
+        self._tiles = {}
+        self.canvas.resetCachedContent()
+        self.canvas.viewport().update()
+
+    def _drop_stale_levels(self, keep):
+        pyramid = set()
+        width = self.image.width()
+        while width >= BACKGROUND_MIN_LEVEL:
+            pyramid.add(width)
+            width //= 2
+        self.levels = [level for level in self.levels
+                       if level.width() in pyramid or level.width() == keep]
+
+    def shutdown(self):
+        """等待后台缩放结束，关闭窗口前调用"""
+        self._settle_timer.stop()
+        for worker in list(self._workers):
+            worker.wait()
+
+    def _needed_width(self):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.canvas.transform())
+        ratio = self.canvas.devicePixelRatioF()
+        return int(min(self.rect.width() * scale * ratio, MAX_BACKGROUND_SIDE))
+
+    def _request_exact(self):
+        needed = self._needed_width()
+        if needed < BACKGROUND_MIN_LEVEL:
+            return
+        best = self._pick_level(needed)
+        # 已有足够接近的一层时不再生成
+        if abs(best.width() - needed) <= needed * 0.1:
+            return
+        self._pending_width = needed
+        self._scale([needed])
+
+    def _pick_level(self, needed):
+        for level in self.levels:
+            if level.width() >= needed:
+                return level
+        return self.levels[-1]
+
+    # ---------- 绘制 ----------
+    def _tile(self, level, tx, ty):
+        key = (tx, ty)
+        if self._tile_level is not level:
+            self._tile_level = level
+            self._tiles = {}
+        pixmap = self._tiles.get(key)
+        if pixmap is None:
+            size = BACKGROUND_TILE_SIZE
+            pixmap = QPixmap.fromImage(level.copy(tx * size, ty * size, size, size))
+            self._tiles[key] = pixmap
+        return pixmap
+
+    def paint(self, painter, exposed):
+        """绘制与 exposed（场景坐标）相交的背景块"""
+        area = exposed.intersected(self.rect)
+        if area.isEmpty():
+            return
+        level = self._pick_level(max(self._needed_width(), 1))
+        factor = level.width() / self.rect.width()
+        size = BACKGROUND_TILE_SIZE
+        left = (area.left() - self.rect.left()) * factor
+        top = (area.top() - self.rect.top()) * factor
+        right = (area.right() - self.rect.left()) * factor
+        bottom = (area.bottom() - self.rect.top()) * factor
+        tx0 = max(int(left // size), 0)
+        ty0 = max(int(top // size), 0)
+        tx1 = min(int(right // size), (level.width() - 1) // size)
+        ty1 = min(int(bottom // size), (level.height() - 1) // size)
+
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                pixmap = self._tile(level, tx, ty)
+                target = QRectF(self.rect.left() + tx * size / factor,
+                                self.rect.top() + ty * size / factor,
+                                pixmap.width() / factor, pixmap.height() / factor)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.restore()
+
+
+# ====================== 缩放 ======================
+ZOOM_MIN = 0.1
+ZOOM_MAX = 3.0
+# 滚轮每格的缩放倍数
+ZOOM_STEP = 1.25
+ZOOM_ANIMATION_MS = 150
+# 最后一次缩放之后多久视为手势结束，恢复清晰绘制
+ZOOM_SETTLE_MS = 200
+# 手势期间最多为这么多个方块开启图元缓存
+ZOOM_CACHE_LIMIT = 3000
+
+
+class ZoomController(QObject):
+    """
+    视图缩放：直接设置缩放矩阵，并保持锚点（光标或视口中心）下的场景位置不动。
+
+    缩放手势期间可见方块及其文字改用 ItemCoordinateCache，按缓存的位图缩放绘制；
+    手势停止后关闭缓存，重新清晰绘制一次。
+    """
+    changed = pyqtSignal(float)
+
+    def __init__(self, canvas):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.scale = 1.0
+        self._anchor = None
+        self._cached = None
+
+        self._animation = QVariantAnimation(self)
+        self._animation.setDuration(ZOOM_ANIMATION_MS)
+        self._animation.setEasingCurve(QEasingCurve.OutCubic)
+        self._animation.valueChanged.connect(self._apply)
+
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(ZOOM_SETTLE_MS)
+        self._settle_timer.timeout.connect(self._settled)
+
+    def zoom_to(self, scale, anchor=None, animate=False):
+        """
+        缩放到 scale。
+
+        参数:
+            scale: 目标缩放比例，限制在 ZOOM_MIN 到 ZOOM_MAX 之间
+            anchor: 视口坐标下保持不动的点，默认为视口中心
+            animate: 是否以动画过渡
+        """
+        scale = min(max(scale, ZOOM_MIN), ZOOM_MAX)
+        viewport = self.canvas.viewport().rect()
+        anchor = QPointF(anchor) if anchor is not None else QPointF(viewport.center())
+        self._anchor = (anchor, self.canvas.mapToScene(anchor.toPoint()))
+        self._animation.stop()
+        if animate and abs(scale - self.scale) > 1e-6:
+            self._animation.setStartValue(float(self.scale))
+            self._animation.setEndValue(float(scale))
+            self._animation.start()
+        else:
+            self._apply(scale)
+
+    def zoom_by(self, factor, anchor=None):
+        """在当前（或动画中的目标）缩放比例上再乘以 factor，带动画"""
+        base = self.scale
+        if self._animation.state() == QVariantAnimation.Running:
+            base = self._animation.endValue()
+        self.zoom_to(base * factor, anchor, animate=True)
+
+    def _apply(self, scale):
+        canvas = self.canvas
+        self._begin_gesture()
+        self.scale = scale
+        canvas.setTransform(QTransform.fromScale(scale, scale))
+        if self._anchor is not None:
+            # 平移滚动条，使锚点下的场景位置回到原来的视口位置
+            anchor, scene_point = self._anchor
+            moved = canvas.mapFromScene(scene_point)
+            hbar = canvas.horizontalScrollBar()
+            vbar = canvas.verticalScrollBar()
+            hbar.setValue(hbar.value() + round(moved.x() - anchor.x()))
+            vbar.setValue(vbar.value() + round(moved.y() - anchor.y()))
+        canvas.schedule_virtual_update()
+        if canvas.background is not None:
+            canvas.background.invalidate()
+        self.changed.emit(scale)
+        self._settle_timer.start()
+
+    def _begin_gesture(self):
+        if self._cached is not None:
+            return
+        canvas = self.canvas
+        visible = canvas.mapToScene(canvas.viewport().rect()).boundingRect()
+        blocks = [item for item in canvas.scene.items(visible)
+                  if isinstance(item, DraggableBlock)]
+        self._cached = []
+        if len(blocks) > ZOOM_CACHE_LIMIT:
+            return
+        for block in blocks:
+            for item in (block, block.text):
+                item.setCacheMode(QGraphicsItem.ItemCoordinateCache)
+                self._cached.append(item)
+
+    def _settled(self):
+        if self._animation.state() == QVariantAnimation.Running:
+            self._settle_timer.start()
+            return
+        for item in self._cached or ():
+            item.setCacheMode(QGraphicsItem.NoCache)
+        self._cached = None
+        self.canvas.viewport().update()
+
+
+# ====================== 画布类 ======================
+HIGHLIGHT_COLOR = QColor(255, 128, 0, 200)
+HIGHLIGHT_WIDTH = 4
+HIGHLIGHT_ROUTE_LIMIT = 2000
+# 搜索时盖在不匹配图元上的半透明遮罩
+SEARCH_DIM_COLOR = QColor(255, 255, 255, 180)
+# 合并导入的差异超过图表规模的这一比例时直接整图重建
+MERGE_REBUILD_RATIO = 0.5
+
+
+class Canvas(QGraphicsView):
+    # 背景图解码完成（或确认没有背景图）后发出
+    background_ready = pyqtSignal()
+    # 可见范围因滚动或视口尺寸变化而改变
+    view_changed = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.scene = FlowScene()
+        self.setRenderHint(QPainter.Antialiasing, False)
+        self.setScene(self.scene)
+        self.setRenderHint(QPainter.Antialiasing)
+        self.setDragMode(QGraphicsView.RubberBandDrag)
+        self.registry = self.scene.registry
+        self.zoom = ZoomController(self)
+        self.virtual_threshold = VIRTUAL_THRESHOLD
+        self._virtual_rect = None
+        self._virtual_timer = QTimer(self)
+        self._virtual_timer.setSingleShot(True)
+        self._virtual_timer.setInterval(0)
+        self._virtual_timer.timeout.connect(lambda: self.update_virtual_items())  # 见 FlowScene.__init__
+        self.dragging_block = None
+        self.preview_line = None
+        self.current_line_type = LineType.SINGLE
+        # 分析结果高亮：(方块行号数组, 连线下标数组)，均指向 scene.model
+        self.highlight = None
+        # 搜索结果：(方块行号数组, 连线下标数组)，其余图元变暗
+        self.search_matches = None
+        self.scene.diagram_changed.connect(self._diagram_changed)
+        self.scene.cluster_layer.changed.connect(self._clusters_changed)
+
+        # 添加背景图片，滚动时只重绘新露出的部分；图片在后台解码，不拖慢窗口显示
+        self.setCacheMode(QGraphicsView.CacheBackground)
+        self.background = None
+        self._background_loader = None
+        self.load_background(resource_path("background.png"))  # 替换为你的图片路径
+
+        # self.draw_grid()
+
+    def load_background(self, path):
+        """在后台线程解码背景图，完成后替换当前背景"""
+        self.stop_background()
+        loader = BackgroundLoader(path, self)
+        loader.loaded.connect(self._background_loaded)
+        loader.finished.connect(loader.deleteLater)
+        self._background_loader = loader
+        loader.start()
+
+    def _background_loaded(self, image):
+        if self.sender() is not self._background_loader:
+            return
+        self._background_loader = None
+        if image is not None:
+            self.background = CanvasBackground(self, image)
+            self.fit_background_to_view()
+        self.background_ready.emit()
+
+    def stop_background(self):
+        """等待背景图的解码和缩放线程结束，关闭窗口前调用"""
+        loader = self._background_loader
+        self._background_loader = None
+        if loader is not None:
+            loader.wait()
+        if self.background is not None:
+            self.background.shutdown()
+
+    def fit_background_to_view(self):
+        if self.background is not None:
+            self.background.fit(self.viewport().width())
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if self.background is not None:
+            self.background.paint(painter, rect)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.fit_background_to_view()
+        self.schedule_virtual_update()
+        self.view_changed.emit()
+
+    def wheelEvent(self, event):
+        # Ctrl+滚轮以光标为中心缩放，普通滚轮仍然滚动
+        if event.modifiers() & Qt.ControlModifier:
+            steps = event.angleDelta().y() / 120
+            if steps:
+                self.zoom.zoom_by(ZOOM_STEP ** steps, event.pos())
+            event.accept()
+            return
+        super().wheelEvent(event)
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.schedule_virtual_update()
+        self.view_changed.emit()
+
+    def paintEvent(self, event):
+        # 开启性能监视时每次视口重绘记为一帧
+        with PROFILER.frame():
+            super().paintEvent(event)
+
+    def drawForeground(self, painter, rect):
+        super().drawForeground(painter, rect)
+        virtual = self.scene.virtual
+        if virtual is not None and (virtual.overview or virtual.through_overflow):
+            virtual.paint_overview(painter, rect)
+        self.scene.cluster_layer.paint_outlines(painter, rect)
+        if self.search_matches is not None:
+            self._paint_search(painter, rect)
+        if self.highlight is not None:
+            self._paint_highlight(painter, rect)
+
+    # ---------- 高亮 ----------
+    def set_highlight(self, rows=(), edges=()):
+        """
+        在前景层高亮一组方块和连线，不修改图元，虚拟化模式下同样有效。
+
+        参数:
+            rows: 方块在 scene.model 中的行号
+            edges: 连线在 scene.model 中的下标
+        """
+        self.highlight = (np.asarray(rows, dtype=np.int64), np.asarray(edges, dtype=np.int64))
+        self.viewport().update()
+
+    def clear_highlight(self):
+        if self.highlight is not None:
+            self.highlight = None
+            self.viewport().update()
+
+    def set_search_matches(self, rows, edges):
+        """搜索结果之外的方块和连线变暗，参数含义同 set_highlight"""
+        self.search_matches = (np.asarray(rows, dtype=np.int64), np.asarray(edges, dtype=np.int64))
+        self.viewport().update()
+
+    def clear_search_matches(self):
+        if self.search_matches is not None:
+            self.search_matches = None
+            self.viewport().update()
+
+    def _diagram_changed(self, kind, payload):
+        # 删除和整图替换会改变行号和连线下标，高亮随之失效
+        if kind in ("remove_block", "remove_items", "remove_connection", "clear", "reset"):
+            self.clear_highlight()
+            self.clear_search_matches()
+
+    def _draw_edges(self, painter, edges):
+        """用当前画笔绘制一组连线，数量不多时沿已缓存的路由线路绘制，否则画中心连线"""
+        model = self.scene.model
+        start, end = model.edge_rows()
+        cx, cy = model.centers()
+        routes = {}
+        if self.scene.router is not None and len(edges) <= HIGHLIGHT_ROUTE_LIMIT:
+            routes = self.scene.router.routes
+        lines = []
+        for uid, a, b in zip(model.edge_uid[edges].tolist(), start[edges].tolist(),
+                             end[edges].tolist()):
+            route = routes.get(uid)
+            if route is not None:
+                painter.drawPolyline(_polygon(route))
+            else:
+                lines.append(QLineF(cx[a], cy[a], cx[b], cy[b]))
+        painter.drawLines(lines)
+
+    def _paint_search(self, painter, rect):
+        model = self.scene.model
+        rows, edges = self.search_matches
+        area = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        # 奇偶填充：可见区域减去匹配的方块，匹配的方块保持原样
+        mask = QPainterPath()
+        mask.setFillRule(Qt.OddEvenFill)
+        mask.addRect(rect)
+        rows = rows[model.blocks_in(*area)[rows]]
+        for x, y, w, h in zip(model.x[rows].tolist(), model.y[rows].tolist(),
+                              model.width[rows].tolist(), model.height[rows].tolist()):
+            mask.addRect(x, y, w, h)
+        painter.fillPath(mask, SEARCH_DIM_COLOR)
+        edges = edges[model.edges_through(*area)[edges]]
+        if not len(edges):
+            return
+        # 匹配的连线重新画在遮罩之上，裁掉方块内部，保持方块盖住连线
+        painter.save()
+        painter.setClipPath(mask)
+        painter.setBrush(Qt.NoBrush)
+        lines = model.edge_line[edges]
+        for number in np.unique(lines).tolist():
+            painter.setPen(LineType.from_number(number).get_pen())
+            self._draw_edges(painter, edges[lines == number])
+        painter.restore()
+
+    def _paint_highlight(self, painter, rect):
+        model = self.scene.model
+        rows, edges = self.highlight
+        area = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        pen = QPen(HIGHLIGHT_COLOR, HIGHLIGHT_WIDTH)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.setBrush(Qt.NoBrush)
+        if len(edges):
+            self._draw_edges(painter, edges[model.edges_through(*area)[edges]])
+        if len(rows):
+            rows = rows[model.blocks_in(*area)[rows]]
+            painter.drawRects([QRectF(x, y, w, h) for x, y, w, h in zip(
+                model.x[rows].tolist(), model.y[rows].tolist(),
+                model.width[rows].tolist(), model.height[rows].tolist())])
+
+    # ---------- 虚拟化 ----------
+    def should_virtualize(self, blocks, relations):
+        return len(blocks) + len(relations) >= self.virtual_threshold
+
+    def _clusters_changed(self):
+        # 折叠状态改变后即使视口没动也要重新挑选图元
+        self._virtual_rect = None
+        self.schedule_virtual_update()
+        self.viewport().update()
+
+    def schedule_virtual_update(self):
+        """平移、缩放后在下一次事件循环中按可见区域更新图元"""
+        if self.scene.virtual is not None and not self._virtual_timer.isActive():
+            self._virtual_timer.start()
+
+    def update_virtual_items(self):
+        virtual = self.scene.virtual
+        if virtual is None:
+            return
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        rect.adjust(-rect.width() * VIRTUAL_OVERSCAN, -rect.height() * VIRTUAL_OVERSCAN,
+                    rect.width() * VIRTUAL_OVERSCAN, rect.height() * VIRTUAL_OVERSCAN)
+        # 对齐到网格，小幅平移不改变图元集合
+        tile = VIRTUAL_TILE_SIZE
+        x0 = np.floor(rect.left() / tile) * tile
+        y0 = np.floor(rect.top() / tile) * tile
+        x1 = np.ceil(rect.right() / tile) * tile
+        y1 = np.ceil(rect.bottom() / tile) * tile
+        rect = QRectF(x0, y0, x1 - x0, y1 - y0)
+        if rect == self._virtual_rect:
+            return
+        self._virtual_rect = rect
+        virtual.update_visible(rect)
+        self.viewport().update()
+
+    @contextmanager
+    def bulk_update(self):
+        """批量增删图元期间暂停场景索引和视图刷新，嵌套使用时由最外层恢复"""
+        updates = self.updatesEnabled()
+        self.setUpdatesEnabled(False)
+        try:
+            with self.scene.suspend_index():
+                yield
+        finally:
+            if updates:
+                self.setUpdatesEnabled(True)
+                self.viewport().update()
+
+    def to_tables(self):
+        """把当前图表导出为列式数据表"""
+        return self.scene.to_tables()
+
+    def diff_tables(self, blocks, relations, keep_positions=True):
+        """
+        按编号比较重新导入的数据表与当前图表，返回 DiagramDiff。
+
+        新数据表的坐标在这里确定，之后交给 merge_tables。
+
+        参数:
+            keep_positions: 为 True 时已有方块保持当前位置，忽略表中的坐标
+        """
+        diagram_io.resolve_endpoints(blocks.ids, relations)
+        self.scene.flush_connection_updates()
+        model = self.scene.model
+        merge_positions(model, blocks, relations, keep_positions)
+        return diff_diagram(model, blocks, relations, compare_positions=not keep_positions)
+
+    def merge_tables(self, blocks, relations, diff):
+        """
+        只对有变化的行增删改图元；差异超过图表规模的 MERGE_REBUILD_RATIO 时改为整图重建。
+        """
+        scene = self.scene
+        if len(diff) > MERGE_REBUILD_RATIO * (len(scene.model) + scene.model.n_edges):
+            self.load_tables(blocks, relations, clusters=scene.clusters.to_table(blocks.ids))
+            return
+        scene.move_group += 1
+        with self.bulk_update() if len(diff) > BULK_THRESHOLD else nullcontext():
+            scene.apply_diff(diff, blocks, relations)
+        self.schedule_virtual_update()
+
+    def layout_inputs(self):
+        """
+        返回布局所需的 (ids, src, dst, widths, heights, centers)，直接取自 DiagramModel。
+
+        src/dst 为连线两端在 ids 中的下标数组，ids 原样交给 apply_layout。
+        """
+        self.scene.flush_connection_updates()
+        model = self.scene.model
+        src, dst = model.edge_rows()
+        cx, cy = model.centers()
+        return (model.ids.copy(), src, dst, model.width.copy(), model.height.copy(),
+                np.column_stack([cx, cy]))
+
+    def apply_layout(self, ids, center_x, center_y):
+        """按布局结果（方块中心坐标）移动方块，已被删除的方块跳过"""
+        if self.scene.virtual is not None:
+            self.scene.virtual.set_centers(ids, center_x, center_y)
+            self._virtual_rect = None
+            self.schedule_virtual_update()
+            return
+        blocks = self.registry.blocks
+        with self.bulk_update():
+            for block_id, cx, cy in zip(ids.tolist(), center_x.tolist(), center_y.tolist()):
+                block = blocks.get(block_id)
+                if block is not None:
+                    rect = block.rect()
+                    block.setPos(cx - rect.width() / 2, cy - rect.height() / 2)
+
+    @property
+    def blocks(self):
+        return self.registry.blocks.values()
+
+    def add_block(self, block):
+        self.scene.add_block(block)
+
+    def add_connection(self, start_block, end_block, line_type):
+        return self.scene.add_connection(start_block, end_block, line_type)
+
+    def block_at(self, scene_pos, exclude=None):
+        """借助场景索引查找位置下的方块"""
+        for item in self.scene.items(scene_pos):
+            if isinstance(item, BlockLabel):
+                item = item.parentItem()
+            if isinstance(item, DraggableBlock) and item is not exclude:
+                return item
+        return None
+
+    def clear_diagram(self):
+        with self.bulk_update():
+            self.scene.clear_diagram()
+        self.scene.notify("reset")
+
+    def load_tables(self, blocks, relations, endpoints=None, clusters=None):
+        """
+        用列式数据表替换当前图表，批量创建工作组和连线。
+
+        图元总数达到 virtual_threshold 时以虚拟化模式载入，只创建可见区域的图元。
+
+        参数:
+            blocks: diagram_io.BlockTable，位置必须已经确定
+            relations: diagram_io.RelationTable
+            endpoints: resolve_endpoints 的结果，未提供时在这里计算
+            clusters: diagram_io.ClusterTable，None 表示没有分组
+        """
+        if endpoints is None:
+            endpoints = diagram_io.resolve_endpoints(blocks.ids, relations)
+        with self.bulk_update():
+            self.scene.clear_diagram()
+            self.scene.clusters = ClusterTree.from_table(clusters)
+            if self.should_virtualize(blocks, relations):
+                self.scene.load_virtual(blocks, relations)
+            else:
+                self.scene.populate(blocks, relations, endpoints)
+        self._virtual_rect = None
+        self.update_virtual_items()
+
+    # def draw_grid(self):
+    #     grid_pen = QPen(QColor(220, 220, 220), 1, Qt.DotLine)
+    #     for x in range(-1000, 1000, 20):
+    #         self.scene.addLine(x, -1000, x, 1000, grid_pen)
+    #     for y in range(-1000, 1000, 20):
+    #         self.scene.addLine(-1000, y, 1000, y, grid_pen)
+
+    # def contextMenuEvent(self, event):
+    #     # 转换坐标系并检查该位置是否有图元
+    #     item = self.itemAt(event.pos())
+    #
+    #     if item is None:
+    #         # 如果当前位置没有图元，则显示画布的菜单
+    #         menu = QMenu()
+    #         new_block_action = menu.addAction("新建工作组")
+    #         action = menu.exec_(self.mapToGlobal(event.pos()))
+    #         if action == new_block_action:
+    #             self.create_new_block(event.pos())
+    #     else:
+    #         # 否则，允许图元自行处理其上下文菜单事件
+    #         super().contextMenuEvent(event)
+
+    def create_new_block(self, pos):
+        dialog = BlockEditDialog()
+        dialog.name_edit.setText("New Block")
+        dialog.id_edit.setText(str(DraggableBlock._next_id))
+        dialog.width_edit.setText("100")
+        dialog.height_edit.setText("60")
+
+        if dialog.exec_() == QDialog.Accepted:
+            name = dialog.name_edit.text()
+            block_id = int(dialog.id_edit.text())
+            width = float(dialog.width_edit.text())
+            height = float(dialog.height_edit.text())
+
+            # 检查ID是否重复
+            if self.scene.has_block(block_id):
+                QMessageBox.warning(self, "错误", "ID已存在！")
+                return
+
+            scene_pos = self.mapToScene(pos)
+            block = DraggableBlock(name, scene_pos.x(), scene_pos.y(),
+                                   width, height, block_id)
+            self.add_block(block)
+
+    # def mousePressEvent(self, event):
+    #     if event.button() == Qt.LeftButton:
+    #         item = self.itemAt(event.pos())
+    #         if isinstance(item, DraggableBlock):
+    #             self._start_connection(item)
+    #             return
+    #     super().mousePressEvent(event)
+
+    def _start_connection(self, block):
+        self.dragging_block = block
+        start_point = block.get_center()
+        self.preview_line = QGraphicsLineItem()
+        self.preview_line.setPen(QPen(Qt.gray, 2, Qt.DashLine))
+        self.scene.addItem(self.preview_line)
+        self.preview_line.setLine(QLineF(start_point, start_point))
+
+    def mouseMoveEvent(self, event):
+        if self.dragging_block:
+            end_pos = self.mapToScene(event.pos())
+            start_point = self.dragging_block.get_center()
+            self.preview_line.setLine(QLineF(start_point, end_pos))
+        else:
+            super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if self.dragging_block:
+            end_pos = self.mapToScene(event.pos())
+            # 查找目标方块
+            end_block = self.block_at(end_pos, exclude=self.dragging_block)
+            if end_block:
+                # 创建新连接
+                self.add_connection(self.dragging_block, end_block, self.current_line_type)
+            # 清理预览线
+            self.scene.removeItem(self.preview_line)
+            self.dragging_block = None
+            self.preview_line = None
+        else:
+            super().mouseReleaseEvent(event)
+
+
+# ====================== 布局线程 ======================
+class LayoutWorker(QThread):
+    """在后台线程计算布局，力导向布局过程中定期发出中间结果"""
+    progress = pyqtSignal(object, object)
+    finished_layout = pyqtSignal(object, object)
+
+    def __init__(self, kind, src, dst, widths, heights, init, parent=None):
+        super().__init__(parent)
+        self.kind = kind
+        self.src = src
+        self.dst = dst
+        self.widths = widths
+        self.heights = heights
+        self.init = init
+
+    def run(self):
+        x, y = compute_layout(self.kind, self.src, self.dst, self.widths, self.heights,
+                              self.init, callback=self._report)
+        if not self.isInterruptionRequested():
+            self.finished_layout.emit(x, y)
+
+    def _report(self, iteration, positions):
+        if self.isInterruptionRequested():
+            return False
+        self.progress.emit(positions[:, 0].copy(), positions[:, 1].copy())
+
+
+def compute_layout(kind, src, dst, widths, heights, init=None, callback=None):
+    """kind 为 "layered" 或 "force"，返回方块中心坐标"""
+    n = len(widths)
+    if kind == "layered":
+        return layered_layout(n, src, dst, widths, heights)
+    return force_directed_layout(n, src, dst, init=init, callback=callback)
+
+
+# ====================== 异步导入 ======================
+class ImportWorker(QThread):
+    """在后台线程读取、校验并定位图表数据"""
+    parsed = pyqtSignal(object, object, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        try:
+            blocks, relations, clusters = diagram_io.read_diagram(self.path, clusters=True)
+            if self.isInterruptionRequested():
+                return
+            with PROFILER.span("import.position"):
+                position_blocks(blocks, relations)
+                endpoints = diagram_io.resolve_endpoints(blocks.ids, relations)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if not self.isInterruptionRequested():
+            self.parsed.emit(blocks, relations, endpoints, clusters)
+
+
+class StreamingImport(QObject):
+    """
+    非阻塞导入：后台线程解析工作簿，GUI 线程由定时器分块创建图元。
+
+    每块之间回到事件循环，第一块创建后画布即可操作；进度对话框可随时取消，
+    取消时已创建的方块和连线保留在画布上。
+    """
+    # 状态为 "ok"、"failed" 或 "canceled"
+    finished = pyqtSignal(str, str)
+    CHUNK_SIZE = 500
+
+    def __init__(self, canvas, path, parent):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.path = path
+        self.done = False
+        self._steps = None
+        self._steps_started = False
+        self._counts = (0, 0)
+        self._created = 0
+
+        self.progress = QProgressDialog("正在读取文件...", "取消", 0, 0, parent)
+        self.progress.setWindowTitle("导入")
+        self.progress.setWindowModality(Qt.NonModal)
+        self.progress.setMinimumDuration(0)
+        self.progress.setAutoClose(False)
+        self.progress.setAutoReset(False)
+        self.progress.canceled.connect(self.cancel)
+
+        self.worker = ImportWorker(path, parent)
+        self.worker.parsed.connect(self._on_parsed)
+        self.worker.failed.connect(lambda message: self._finish("failed", f"导入失败: {message}"))
+        self.worker.finished.connect(self._worker_finished)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(lambda: self._step())  # 见 FlowScene.__init__
+
+    def start(self):
+        self.progress.show()
+        self.worker.start()
+
+    def _worker_finished(self):
+        self.worker.deleteLater()
+        self.worker = None
+
+    def cancel(self):
+        if self.done:
+            return
+        if self.worker is not None:
+            self.worker.requestInterruption()
+        n_blocks, n_relations = self._counts
+        created_blocks = min(self._created, n_blocks)
+        self._finish("canceled", f"导入已取消，已导入 {created_blocks} 个模块和 "
+                            f"{max(self._created - n_blocks, 0)} 条连线")
+
+    def _on_parsed(self, blocks, relations, endpoints, clusters):
+        if self.done:
+            return
+        self._counts = (len(blocks), len(relations))
+        self.progress.setLabelText("正在创建图元...")
+        self.progress.setRange(0, max(len(blocks) + len(relations), 1))
+        if self.canvas.should_virtualize(blocks, relations):
+            # 虚拟化模式只创建可见区域的图元，不需要分块
+            self.canvas.load_tables(blocks, relations, endpoints, clusters)
+            self._finish("ok", f"已导入 {len(blocks)} 个模块和 {len(relations)} 条连线")
+            return
+        scene = self.canvas.scene
+        # 导入期间暂停场景索引，全部创建完成后再重建
+        scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        scene.clear_diagram()
+        # 分组在结束时的 "reset" 通知中生效，取消导入时未创建的方块不会被折叠
+        scene.clusters = ClusterTree.from_table(clusters)
+        self._steps = scene.populate_iter(blocks, relations, endpoints, self.CHUNK_SIZE)
+        self._steps_started = True
+        self.timer.start()
+
+    def _step(self):
+        try:
+            self._created = next(self._steps)
+        except StopIteration:
+            n_blocks, n_relations = self._counts
+            self._finish("ok", f"已导入 {n_blocks} 个模块和 {n_relations} 条连线")
+            return
+        self.progress.setValue(self._created)
+
+    def _finish(self, status, message):
+        if self.done:
+            return
+        self.done = True
+        self.timer.stop()
+        self._steps = None
+        self.canvas.scene.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
+        if self._steps_started:
+            self.canvas.scene.notify("reset")
+        self.progress.canceled.disconnect(self.cancel)
+        self.progress.close()
+        self.progress.deleteLater()
+        self.finished.emit(status, message)
+
+
+# ====================== 图片导出 ======================
+EXPORT_MARGIN = 20                # 图表四周留白（场景单位）
+EXPORT_TILE_SIZE = 2048           # PNG 渲染瓦片边长（像素）
+EXPORT_BAND_BYTES = 32 << 20      # 一行瓦片的像素缓冲上限，PNG 导出共用两块这样的缓冲
+EXPORT_PNG_LEVEL = 3              # PNG 压缩级别，图表大片留白，更高级别只是更慢
+EXPORT_VECTOR_CHUNK = 5000        # 矢量导出每次绘制的图元数，两次之间报告进度
+PDF_MAX_POINTS = 14400            # PDF 页面边长上限（点）
+
+
+class DiagramPainter:
+    """
+    直接按 DiagramModel 的数组绘制整张图表，不经过图元，可以在后台线程中使用。
+
+    构造时复制数据和已缓存的路由线路，之后场景的修改不影响绘制结果；
+    虚拟化模式下没有图元的部分同样会被绘制。画法与 DraggableBlock / Connection 一致。
+    """
+
+    def __init__(self, model, routes=None):
+        self.model = DiagramModel(*model.to_tables())
+        # 路由线路按连线顺序排列，没有路由的连线为 None
+        self.routes = None
+        if routes:
+            self.routes = [routes.get(uid) for uid in model.edge_uid.tolist()]
+        self._route_boxes = None
+
+    def bounds(self):
+        """含留白的场景范围，没有方块时返回 None"""
+        bounds = self.model.bounds()
+        if bounds is None:
+            return None
+        x0, y0, x1, y1 = bounds
+        if self.routes is not None:
+            boxes = self._boxes()
+            routed = ~np.isnan(boxes[:, 0])
+            if routed.any():
+                x0, y0 = min(x0, boxes[routed, 0].min()), min(y0, boxes[routed, 1].min())
+                x1, y1 = max(x1, boxes[routed, 2].max()), max(y1, boxes[routed, 3].max())
+        return QRectF(x0, y0, x1 - x0, y1 - y0).adjusted(-EXPORT_MARGIN, -EXPORT_MARGIN,
+                                                        EXPORT_MARGIN, EXPORT_MARGIN)
+
+    def _boxes(self):
+        # 路由线路的外接矩形，没有路由的连线为 NaN
+        if self._route_boxes is None:
+            boxes = np.full((self.model.n_edges, 4), np.nan)
+            for i, route in enumerate(self.routes):
+                if route is not None:
+                    boxes[i, :2] = route.min(axis=0)
+                    boxes[i, 2:] = route.max(axis=0)
+            self._route_boxes = boxes
+        return self._route_boxes
+
+    def edges_in(self, rect):
+        model = self.model
+        area = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        selected = model.edges_through(*area)
+        if self.routes is not None:
+            boxes = self._boxes()
+            routed = ~np.isnan(boxes[:, 0])
+            selected[routed] = ((boxes[routed, 0] <= area[2]) & (boxes[routed, 2] >= area[0])
+                                & (boxes[routed, 1] <= area[3]) & (boxes[routed, 3] >= area[1]))
+        return np.flatnonzero(selected)
+
+    def blocks_in(self, rect):
+        return np.flatnonzero(self.model.blocks_in(rect.left(), rect.top(),
+                                                   rect.right(), rect.bottom()))
+
+    def paint(self, painter, rect):
+        """绘制与 rect（场景坐标）相交的连线和方块"""
+        self.paint_edges(painter, self.edges_in(rect))
+        self.paint_blocks(painter, self.blocks_in(rect))
+
+    def paint_edges(self, painter, edges):
+        model = self.model
+        start, end = model.edge_rows()
+        cx, cy = model.centers()
+        painter.setBrush(Qt.NoBrush)
+        lines = model.edge_line[edges]
+        for number in np.unique(lines).tolist():
+            line_type = LineType.from_number(number)
+            painter.setPen(line_type.get_pen())
+            group = edges[lines == number]
+            if self.routes is not None:
+                routed = np.array([self.routes[i] is not None for i in group.tolist()], dtype=bool)
+                for i in group[routed].tolist():
+                    route = self.routes[i]
+                    for offset in line_type.get_offset():
+                        painter.drawPolyline(_polygon(
+                            route if offset == 0 else offset_polyline(route, offset)))
+                group = group[~routed]
+            # 直线按连线方向的法线平移，与 Connection.update_line 相同
+            sx, sy = cx[start[group]], cy[start[group]]
+            ex, ey = cx[end[group]], cy[end[group]]
+            length = np.hypot(ex - sx, ey - sy)
+            length[length == 0] = 1
+            nx, ny = (ey - sy) / length, (sx - ex) / length
+            segments = []
+            for offset in line_type.get_offset():
+                ox, oy = nx * offset, ny * offset
+                segments.extend(QLineF(a, b, c, d) for a, b, c, d in zip(
+                    (sx + ox).tolist(), (sy + oy).tolist(), (ex + ox).tolist(), (ey + oy).tolist()))
+            painter.drawLines(segments)
+
+    def paint_blocks(self, painter, rows):
+        model = self.model
+        x, y = model.x[rows].tolist(), model.y[rows].tolist()
+        width, height = model.width[rows].tolist(), model.height[rows].tolist()
+        painter.setPen(QPen(Qt.darkBlue, 2))
+        painter.setBrush(QBrush(QColor(173, 216, 230)))
+        painter.drawRects([QRectF(*rect) for rect in zip(x, y, width, height)])
+        if level_of_detail(painter) < LOD_HIDE_TEXT:
+            return
+        # 文字位置对应 BlockLabel 的 (5, 5) 加上文档边距
+        painter.setPen(Qt.black)
+        flags = Qt.AlignLeft | Qt.AlignTop | Qt.TextDontClip
+        for block_id, name, left, top in zip(model.ids[rows].tolist(), model.names[rows].tolist(),
+                                             x, y):
+            painter.drawText(QRectF(left + 9, top + 9, 0, 0), flags, f"ID: {block_id}\n{name}")
+
+
+class ExportWorker(QThread):
+    """
+    在后台线程把 DiagramPainter 的内容导出为 PNG、SVG 或 PDF。
+
+    PNG 按瓦片渲染，每凑满一行瓦片就交给压缩线程写入文件，同时渲染下一行，
+    内存占用与图片总尺寸无关；
+    SVG 和 PDF 分批绘制图元以便报告进度。取消或失败时删除未完成的文件。
+    """
+    progress = pyqtSignal(int, int)
+    exported = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, diagram, path, scale=1.0, parent=None):
+        super().__init__(parent)
+        self.diagram = diagram
+        self.path = path
+        self.scale = scale
+
+    def run(self):
+        suffix = os.path.splitext(self.path)[1].lower()
+        export = {".png": self._export_png, ".svg": self._export_svg,
+                  ".pdf": self._export_pdf}.get(suffix)
+        try:
+            if export is None:
+                raise ValueError(f"不支持的图片格式: {suffix}")
+            source = self.diagram.bounds()
+            if source is None:
+                raise ValueError("图表为空")
+            export(source)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if not self.isInterruptionRequested():
+            self.exported.emit(self.path)
+
+    def _export_png(self, source):
+        scale = self.scale
+        width = max(1, int(np.ceil(source.width() * scale)))
+        height = max(1, int(np.ceil(source.height() * scale)))
+        tile = EXPORT_TILE_SIZE
+        band = max(1, min(tile, EXPORT_BAND_BYTES // (width * 4)))
+        n_bands, n_columns = -(-height // band), -(-width // tile)
+        total = n_bands * n_columns
+        # 两块缓冲轮流使用：zlib 压缩时释放 GIL，与下一行的渲染并行
+        buffers = [np.empty((band, width, 3), dtype=np.uint8) for _ in range(min(2, n_bands))]
+        pending = None
+        with PngStreamWriter(self.path, width, height, level=EXPORT_PNG_LEVEL) as writer, \
+                ThreadPoolExecutor(max_workers=1) as compressor:
+            for b in range(n_bands):
+                top = b * band
+                rows = min(band, height - top)
+                pixels = buffers[b % len(buffers)]
+                for c in range(n_columns):
+                    if self.isInterruptionRequested():
+                        if pending is not None:
+                            pending.result()
+                        writer.abort()
+                        return
+                    left = c * tile
+                    columns = min(tile, width - left)
+                    image = QImage(columns, rows, QImage.Format_RGB32)
+                    image.fill(Qt.white)
+                    painter = QPainter(image)
+                    painter.setRenderHint(QPainter.Antialiasing)
+                    painter.scale(scale, scale)
+                    origin = QPointF(source.left() + left / scale, source.top() + top / scale)
+                    painter.translate(-origin)
+                    self.diagram.paint(painter, QRectF(origin, QSizeF(columns / scale, rows / scale)))
+                    painter.end()
+                    # Format_RGB32 在内存中按 B, G, R, 0xFF 排列
+                    bits = image.constBits()
+                    bits.setsize(image.byteCount())
+                    tile_pixels = np.frombuffer(bits, dtype=np.uint8).reshape(
+                        rows, image.bytesPerLine())[:, :columns * 4].reshape(rows, columns, 4)
+                    pixels[:rows, left:left + columns] = tile_pixels[:, :, 2::-1]
+                    self.progress.emit(b * n_columns + c + 1, total)
+                if pending is not None:
+                    pending.result()
+                pending = compressor.submit(writer.write_rows, pixels[:rows])
+            pending.result()
+
+    def _paint_vector(self, painter, source):
+        diagram = self.diagram
+        painter.setRenderHint(QPainter.Antialiasing)
+        edges, rows = diagram.edges_in(source), diagram.blocks_in(source)
+        total = len(edges) + len(rows)
+        done = 0
+        for items, paint in ((edges, diagram.paint_edges), (rows, diagram.paint_blocks)):
+            for i in range(0, len(items), EXPORT_VECTOR_CHUNK):
+                if self.isInterruptionRequested():
+                    return False
+                chunk = items[i:i + EXPORT_VECTOR_CHUNK]
+                paint(painter, chunk)
+                done += len(chunk)
+                self.progress.emit(done, total)
+        return True
+
+    def _export_svg(self, source):
+        # QtSvg 只有导出 SVG 时才用到，不在启动时加载
+        from PyQt5.QtSvg import QSvgGenerator
+        generator = QSvgGenerator()
+        generator.setFileName(self.path)
+        generator.setTitle("流程图")
+        generator.setSize(QSize(int(np.ceil(source.width())), int(np.ceil(source.height()))))
+        generator.setViewBox(QRectF(0, 0, source.width(), source.height()))
+        painter = QPainter(generator)
+        painter.translate(-source.topLeft())
+        completed = self._paint_vector(painter, source)
+        painter.end()
+        if not completed:
+            os.remove(self.path)
+
+    def _export_pdf(self, source):
+        # 页面按 1 点 = 1 个场景单位设置，超过 PDF 页面上限时整体缩小
+        scale = min(1.0, PDF_MAX_POINTS / max(source.width(), source.height()))
+        writer = QPdfWriter(self.path)
+        writer.setResolution(72)
+        writer.setPageSize(QPageSize(QSizeF(source.width() * scale, source.height() * scale),
+                                     QPageSize.Point))
+        writer.setPageMargins(QMarginsF(0, 0, 0, 0), QPageLayout.Point)
+        painter = QPainter(writer)
+        painter.scale(scale, scale)
+        painter.translate(-source.topLeft())
+        completed = self._paint_vector(painter, source)
+        painter.end()
+        if not completed:
+            os.remove(self.path)
+
+
+# ====================== 自动保存 ======================
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".flow_chart", "autosave")
+# 每个实例在 AUTOSAVE_DIR 下使用自己的会话目录，并持有 目录名 + ".lock" 的锁文件
+AUTOSAVE_SESSION_PREFIX = "session-"
+
+
+class AutosaveRecorder(QObject):
+    """
+    把场景的修改通知转换为日志操作写入 Journal。
+
+    拖动产生的移动先在内存中合并，定时写出每个方块的最终位置；分组变化整体写出一份分组表；
+    整图替换或日志过长时用当前状态（含分组）做一次压缩。
+    """
+    MOVE_INTERVAL_MS = 500
+    COMPACT_AFTER = 5000
+
+    def __init__(self, canvas, journal, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.journal = journal
+        self._moved = set()
+        self._move_timer = QTimer(self)
+        self._move_timer.setSingleShot(True)
+        self._move_timer.setInterval(self.MOVE_INTERVAL_MS)
+        self._move_timer.timeout.connect(self.flush_moves)
+        canvas.scene.diagram_changed.connect(self._record)
+
+    def compact(self):
+        self._moved.clear()
+        self._move_timer.stop()
+        blocks, relations = self.canvas.to_tables()
+        self.journal.compact(blocks, relations, self.canvas.scene.clusters.to_table(blocks.ids))
+
+    def flush_moves(self):
+        scene = self.canvas.scene
+        moved = [[block.id, block.x(), block.y()] for block in self._moved
+                 if scene.owns(block)]
+        self._moved.clear()
+        self._move_timer.stop()
+        if moved:
+            self.journal.append({"op": "move", "blocks": moved})
+
+    def _record(self, kind, payload):
+        if kind == "move":
+            self._moved.update(block for block, _ in payload)
+            if not self._move_timer.isActive():
+                self._move_timer.start()
+            return
+        if kind == "reset":
+            self.compact()
+            return
+        if kind == "clear":
+            return
+
+        # 先写出合并中的移动，保证回放顺序与编辑顺序一致
+        self.flush_moves()
+        if kind == "add_block":
+            rect = payload.rect()
+            self.journal.append({"op": "add_block", "id": payload.id, "name": payload.name,
+                                 "x": payload.x(), "y": payload.y(),
+                                 "w": rect.width(), "h": rect.height()})
+        elif kind == "remove_block":
+            self.journal.append({"op": "remove_block", "id": payload[0].id})
+        elif kind == "remove_items":
+            # 方块的连线随方块删除，只需另外记下其余的连线
+            blocks, relations = payload[:2]
+            other = ~(np.isin(relations.start, blocks.ids) | np.isin(relations.end, blocks.ids))
+            self.journal.append({"op": "remove_items", "blocks": blocks.ids.tolist(),
+                                 "connections": np.column_stack([
+                                     relations.start[other], relations.end[other],
+                                     relations.line[other]]).tolist()})
+        elif kind == "edit":
+            block, old = payload
+            rect = block.rect()
+            self.journal.append({"op": "edit", "old_id": old["id"], "id": block.id,
+                                 "name": block.name, "w": rect.width(), "h": rect.height()})
+        elif kind in ("add_connection", "remove_connection"):
+            self.journal.append({"op": "connect" if kind == "add_connection" else "disconnect",
+                                 "start": payload.start_block.id, "end": payload.end_block.id,
+                                 "line": payload.line_type.to_number()})
+        elif kind == "line_type":
+            self.journal.append({"op": "line_type", "connections": [
+                [conn.start_block.id, conn.end_block.id, old.to_number(),
+                 conn.line_type.to_number()] for conn, old in payload]})
+        elif kind == "clusters":
+            self.journal.append(clusters_op(self.canvas.scene.clusters.to_table()))
+
+        if self.journal.pending_ops >= self.COMPACT_AFTER:
+            self.compact()
+
+
+# ====================== 撤销重做 ======================
+UNDO_LIMIT = 200
+# 撤销历史保存的数据按估算超过这么多字节时，从最早的修改开始释放
+UNDO_MEMORY_LIMIT = 256 << 20
+# 名称等对象数组每个元素按这么多字节估算
+OBJECT_ITEM_BYTES = 64
+
+
+def _data_bytes(value, seen):
+    """
+    估算 value（数组、数据表及其组成的元组、列表、字典）占用的字节数。
+
+    seen 为已经计入的数组 id，相邻整图替换共享的快照只计一次。
+    """
+    if isinstance(value, np.ndarray):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        return value.nbytes + (value.size * OBJECT_ITEM_BYTES if value.dtype == object else 0)
+    if isinstance(value, (list, tuple)):
+        return sum(_data_bytes(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sum(_data_bytes(item, seen) for item in value.values())
+    if isinstance(value, (int, float, str)):
+        return 8
+    slots = getattr(type(value), "__slots__", ())
+    return sum(_data_bytes(getattr(value, name), seen) for name in slots)
+
+
+class DiagramCommand(QUndoCommand):
+    """
+    撤销栈中的一条修改，只保存按编号记录的增量，不保存图元本身。
+
+    修改在压栈之前已经发生，所以第一次 redo 不做任何事。
+    """
+
+    def __init__(self, recorder, text):
+        super().__init__(text)
+        self.recorder = recorder
+        self._pushed = False
+
+    def redo(self):
+        if not self._pushed:
+            self._pushed = True
+            return
+        with self.recorder.applying():
+            self.apply(True)
+
+    def undo(self):
+        with self.recorder.applying():
+            self.apply(False)
+
+    def apply(self, forward):
+        raise NotImplementedError
+
+    def nbytes(self, seen):
+        """估算保存的数据占用的字节数，见 _data_bytes"""
+        return _data_bytes([value for name, value in vars(self).items() if name != "recorder"],
+                           seen)
+
+    def release(self):
+        """
+        释放保存的数据并把修改标记为作废。
+
+        作废的修改被撤销时 QUndoStack 直接把它删除而不还原，撤销历史到此为止。
+        """
+        for name in list(vars(self)):
+            if name != "recorder":
+                setattr(self, name, None)
+        self.setObsolete(True)
+
+
+class MoveCommand(DiagramCommand):
+    """同一次拖动或布局中的移动合并为一条，保存编号和前后坐标数组"""
+
+    def __init__(self, recorder, group, ids, old, new):
+        super().__init__(recorder, "移动")
+        self.group = group
+        self.ids = ids
+        self.old = old
+        self.new = new
+
+    def id(self):
+        return 1
+
+    def mergeWith(self, other):
+        if other.group != self.group:
+            return False
+        index = {block_id: i for i, block_id in enumerate(self.ids.tolist())}
+        new = self.new.copy()
+        extra = []
+        for block_id, old, pos in zip(other.ids.tolist(), other.old, other.new):
+            i = index.get(block_id)
+            if i is None:
+                extra.append((block_id, old, pos))
+            else:
+                new[i] = pos
+        self.new = new
+        if extra:
+            ids, old, pos = zip(*extra)
+            self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+            self.old = np.concatenate([self.old, np.array(old)])
+            self.new = np.concatenate([self.new, np.array(pos)])
+        return True
+
+    def apply(self, forward):
+        positions = self.new if forward else self.old
+        canvas = self.recorder.canvas
+        bulk = len(self.ids) > BULK_THRESHOLD
+        with canvas.bulk_update() if bulk else nullcontext():
+            for block_id, (x, y) in zip(self.ids.tolist(), positions.tolist()):
+                block = canvas.scene.find_block(block_id)
+                if block is not None:
+                    block.setPos(x, y)
+            # 连线在每帧的合并更新中才重算，放在这里提交，否则会在索引恢复之后进行
+            canvas.scene.flush_connection_updates()
+
+
+class BlockCommand(DiagramCommand):
+    """新建或删除方块，删除时一并保存它的连线和所属的分组"""
+
+    def __init__(self, recorder, row, connections, added, cluster_id=0):
+        super().__init__(recorder, "新建工作组" if added else "删除工作组")
+        # row 为 (编号, 名称, X, Y, 宽, 高)，connections 为 [(起始编号, 结束编号, 线型编号)]
+        self.row = row
+        self.connections = connections
+        self.added = added
+        self.cluster_id = cluster_id
+
+    def apply(self, forward):
+        scene = self.recorder.canvas.scene
+        if forward != self.added:
+            scene.remove_block(scene.block_by_id(self.row[0]))
+            return
+        block_id, name, x, y, width, height = self.row
+        scene.add_block(DraggableBlock(name, x, y, width, height, block_id=block_id))
+        for start, end, line in self.connections:
+            scene.add_connection(scene.block_by_id(start), scene.block_by_id(end),
+                                 _LINE_TYPES_BY_NUMBER[line])
+        if self.cluster_id in scene.clusters:
+            scene.join_cluster([block_id], self.cluster_id)
+
+
+class RemoveItemsCommand(DiagramCommand):
+    """批量删除方块和连线，保存删除的方块、全部连线和方块所属的分组"""
+
+    def __init__(self, recorder, blocks, relations, clusters):
+        super().__init__(recorder, "删除")
+        # blocks / relations 为 remove_items 通知中的数据表，clusters 为 {方块编号: 分组编号}
+        self.blocks = blocks
+        self.relations = relations
+        self.clusters = clusters
+
+    def apply(self, forward):
+        scene = self.recorder.canvas.scene
+        blocks, relations = self.blocks, self.relations
+        if forward:
+            # 连线 uid 撤销后会变化，方块以外的连线按两端和线型重新查找，重复的连线各取一条
+            model = scene.model
+            other = ~(np.isin(relations.start, blocks.ids) | np.isin(relations.end, blocks.ids))
+            uids = set()
+            for start, end, line in zip(relations.start[other].tolist(),
+                                        relations.end[other].tolist(),
+                                        relations.line[other].tolist()):
+                match = model.edge_uid[(model.edge_start == start) & (model.edge_end == end)
+                                       & (model.edge_line == line)]
+                uids.add(next(uid for uid in match.tolist() if uid not in uids))
+            scene.remove_items(blocks.ids, sorted(uids))
+            return
+        for row in zip(blocks.ids.tolist(), blocks.names.tolist(), blocks.x.tolist(),
+                       blocks.y.tolist(), blocks.width.tolist(), blocks.height.tolist()):
+            block_id, name, x, y, width, height = row
+            scene.add_block(DraggableBlock(name, x, y, width, height, block_id=block_id))
+        for start, end, line in zip(relations.start.tolist(), relations.end.tolist(),
+                                    relations.line.tolist()):
+            scene.add_connection(scene.block_by_id(start), scene.block_by_id(end),
+                                 _LINE_TYPES_BY_NUMBER[line])
+        groups = {}
+        for block_id, cluster_id in self.clusters.items():
+            groups.setdefault(cluster_id, []).append(block_id)
+        for cluster_id, block_ids in groups.items():
+            if cluster_id in scene.clusters:
+                scene.join_cluster(block_ids, cluster_id)
+
+
+class ConnectionCommand(DiagramCommand):
+    def __init__(self, recorder, start, end, line, added):
+        super().__init__(recorder, "新建连线" if added else "删除连线")
+        self.key = (start, end, line)
+        self.added = added
+
+    def apply(self, forward):
+        scene = self.recorder.canvas.scene
+        start, end, line = self.key
+        if forward == self.added:
+            scene.add_connection(scene.block_by_id(start), scene.block_by_id(end),
+                                 _LINE_TYPES_BY_NUMBER[line])
+        else:
+            scene.remove_connection(scene.find_connection(start, end, line))
+
+
+class EditCommand(DiagramCommand):
+    def __init__(self, recorder, old, new):
+        super().__init__(recorder, "编辑工作组")
+        # old / new 为 {"id", "name", "w", "h"}
+        self.old = old
+        self.new = new
+
+    def apply(self, forward):
+        source, target = (self.old, self.new) if forward else (self.new, self.old)
+        scene = self.recorder.canvas.scene
+        scene.edit_block(scene.block_by_id(source["id"]), target["id"],
+                         target["name"], target["w"], target["h"])
+
+
+class LineTypeCommand(DiagramCommand):
+    """批量修改线型，每行为 (起始编号, 结束编号, 原线型编号, 新线型编号)"""
+
+    def __init__(self, recorder, changes):
+        super().__init__(recorder, "修改线型")
+        self.changes = changes
+
+    def apply(self, forward):
+        scene = self.recorder.canvas.scene
+        connections = []
+        line_types = []
+        for start, end, old, new in self.changes.tolist():
+            current, target = (old, new) if forward else (new, old)
+            connections.append(scene.find_connection(start, end, current))
+            line_types.append(_LINE_TYPES_BY_NUMBER[target])
+        scene.set_line_types(connections, line_types)
+
+
+class ClusterCommand(DiagramCommand):
+    """分组、取消分组、折叠、展开，前后状态以 ClusterTable 保存"""
+
+    def __init__(self, recorder, before, after):
+        super().__init__(recorder, "修改分组")
+        self.before = before
+        self.after = after
+
+    def apply(self, forward):
+        self.recorder.canvas.scene.set_clusters(self.after if forward else self.before)
+
+
+class ResetCommand(DiagramCommand):
+    """整图替换（导入、虚拟化模式下的布局），前后状态以列式数据表保存"""
+
+    def __init__(self, recorder, before, after, group=None):
+        super().__init__(recorder, "导入" if group is None else "布局")
+        self.before = before
+        self.after = after
+        self.group = group
+
+    def id(self):
+        return 2
+
+    def mergeWith(self, other):
+        if self.group is None or other.group != self.group:
+            return False
+        self.after = other.after
+        return True
+
+    def apply(self, forward):
+        blocks, relations, clusters = self.after if forward else self.before
+        self.recorder.canvas.load_tables(blocks, relations, clusters=clusters)
+
+
+class UndoRecorder(QObject):
+    """
+    监听场景的修改通知并压入 QUndoStack。
+
+    撤销或重做执行期间产生的通知不再记录；这些通知仍会被自动保存等其他监听者收到。
+
+    除条数上限 limit 外，保存的数据按估算超过 memory_limit 字节时，从最早的修改开始释放
+    （最近一条总是保留）。连续的整图替换共享快照：上一条的 after 就是下一条的 before。
+    """
+
+    def __init__(self, canvas, limit=UNDO_LIMIT, memory_limit=UNDO_MEMORY_LIMIT, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.stack = QUndoStack(self)
+        self.stack.setUndoLimit(limit)
+        self.memory_limit = memory_limit
+        self._applying = False
+        self._before_reset = None
+        # 最近一次整图替换之后的快照，之后有其他修改时作废
+        self._last_reset = None
+        canvas.scene.diagram_changed.connect(self._record)
+
+    @contextmanager
+    def applying(self):
+        self._applying = True
+        try:
+            yield
+            # 移动通知按帧延迟发出，在标记清除前主动刷新
+            self.canvas.scene.flush_connection_updates()
+        finally:
+            self._applying = False
+
+    def _record(self, kind, payload):
+        if kind not in ("clear", "reset") or self._applying:
+            self._last_reset = None
+        if self._applying:
+            return
+        command = None
+        if kind == "move":
+            ids = np.array([block.id for block, _ in payload], dtype=np.int64)
+            old = np.array([(pos.x(), pos.y()) for _, pos in payload], dtype=np.float64)
+            new = np.array([(block.x(), block.y()) for block, _ in payload], dtype=np.float64)
+            command = MoveCommand(self, self.canvas.scene.move_group, ids, old, new)
+        elif kind in ("add_block", "remove_block"):
+            block, connections, cluster_id = (payload, [], 0) if kind == "add_block" else payload
+            rect = block.rect()
+            row = (block.id, block.name, block.x(), block.y(), rect.width(), rect.height())
+            connections = [(conn.start_block.id, conn.end_block.id, conn.line_type.to_number())
+                           for conn in connections]
+            command = BlockCommand(self, row, connections, kind == "add_block", cluster_id)
+        elif kind == "remove_items":
+            blocks, relations, _, clusters = payload
+            command = RemoveItemsCommand(self, blocks, relations, dict(clusters))
+        elif kind in ("add_connection", "remove_connection"):
+            command = ConnectionCommand(self, payload.start_block.id, payload.end_block.id,
+                                        payload.line_type.to_number(), kind == "add_connection")
+        elif kind == "edit":
+            block, old = payload
+            rect = block.rect()
+            new = {"id": block.id, "name": block.name, "w": rect.width(), "h": rect.height()}
+            command = EditCommand(self, old, new)
+        elif kind == "line_type":
+            changes = np.array([(conn.start_block.id, conn.end_block.id, old.to_number(),
+                                 conn.line_type.to_number()) for conn, old in payload],
+                               dtype=np.int64)
+            command = LineTypeCommand(self, changes)
+        elif kind == "clusters":
+            command = ClusterCommand(self, payload, self.canvas.scene.clusters.to_table())
+        elif kind == "clear":
+            self._before_reset = (self._last_reset
+                                  or (*payload, self.canvas.scene.clusters.to_table()))
+        elif kind == "reset":
+            scene = self.canvas.scene
+            before = self._before_reset or (*scene.to_tables(), scene.clusters.to_table())
+            after = (*scene.to_tables(), scene.clusters.to_table())
+            self._before_reset = None
+            self._last_reset = after
+            command = ResetCommand(self, before, after, payload)
+        if command is not None:
+            self.stack.push(command)
+            self._trim()
+
+    def _trim(self):
+        """从最新的修改往前累计数据大小，超出 memory_limit 的部分连同更早的修改一起释放"""
+        stack = self.stack
+        seen = set()
+        total = 0
+        for i in range(stack.count() - 1, -1, -1):
+            command = stack.command(i)
+            parts = [command] if isinstance(command, DiagramCommand) else [
+                command.child(j) for j in range(command.childCount())]
+            total += sum(part.nbytes(seen) for part in parts if not part.isObsolete())
+            # 只释放已经生效的修改，且保留最近一条；可重做的修改作废后重做会跳过它
+            if total > self.memory_limit and i < stack.index() - 1:
+                break
+        else:
+            return
+        for k in range(i + 1):
+            command = stack.command(k)
+            if command.isObsolete():
+                continue
+            for j in range(command.childCount()):
+                command.child(j).release()
+            if isinstance(command, DiagramCommand):
+                command.release()
+            else:
+                command.setObsolete(True)
+
+
+# ====================== 搜索 ======================
+SEARCH_DELAY_MS = 150
+
+
+class SearchController(QObject):
+    """
+    维护方块名称和编号的搜索索引，把搜索框中的查询结果显示到画布上。
+
+    索引随修改通知增量更新；整图替换后先标记为过期，下一次搜索时再按 model 重建。
+    输入停顿 SEARCH_DELAY_MS 后才执行查询，结果变化后视图居中到第一个匹配的方块。
+    """
+    searched = pyqtSignal(str)
+
+    def __init__(self, canvas, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.index = SearchIndex()
+        self.stale = True
+        self.text = ""
+        self.rows = np.zeros(0, dtype=np.int64)
+        self._current = -1
+        self._line_aliases = {line_type.value: line_type.to_number() for line_type in LineType}
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(SEARCH_DELAY_MS)
+        self._timer.timeout.connect(self.run)
+        canvas.scene.diagram_changed.connect(self._diagram_changed)
+
+    def set_text(self, text):
+        self.text = text
+        self._timer.start()
+
+    def clear(self):
+        self.set_text("")
+        self._timer.stop()
+        self.run()
+
+    def run(self):
+        """立即执行当前查询"""
+        self._timer.stop()
+        canvas = self.canvas
+        self.rows = np.zeros(0, dtype=np.int64)
+        self._current = -1
+        try:
+            query = parse_query(self.text, self._line_aliases)
+        except ValueError as e:
+            canvas.clear_search_matches()
+            self.searched.emit(str(e))
+            return
+        if not query:
+            canvas.clear_search_matches()
+            self.searched.emit("")
+            return
+        model = canvas.scene.model
+        if self.stale:
+            self.index.rebuild(model.ids.tolist(), model.names.tolist())
+            self.stale = False
+        rows, edges = self.index.search(query, model)
+        canvas.set_search_matches(rows, edges)
+        self.rows = rows
+        self.searched.emit(f"{len(rows)} 个匹配")
+        self.next_match()
+
+    def next_match(self):
+        """视图居中到下一个匹配的方块"""
+        if not len(self.rows):
+            return
+        self._current = (self._current + 1) % len(self.rows)
+        row = self.rows[self._current]
+        model = self.canvas.scene.model
+        self.canvas.centerOn(QPointF(model.x[row] + model.width[row] / 2,
+                                     model.y[row] + model.height[row] / 2))
+
+    def _diagram_changed(self, kind, payload):
+        if kind == "move":
+            return
+        if kind in ("clear", "reset"):
+            self.stale = True
+        elif not self.stale:
+            if kind == "add_block":
+                self.index.add(payload.id, payload.name)
+            elif kind == "remove_block":
+                self.index.remove(payload[0].id)
+            elif kind == "remove_items":
+                for block_id in payload[0].ids.tolist():
+                    self.index.remove(block_id)
+            elif kind == "edit":
+                block, old = payload
+                self.index.remove(old["id"])
+                self.index.add(block.id, block.name)
+        # 名称、编号或连线变化后重新执行当前查询
+        if self.text:
+            self._timer.start()
+
+
+# ====================== 图分析面板 ======================
+ANALYTICS_LIST_LIMIT = 100
+ANALYTICS_PATH_LABELS = 8
+
+
+class AnalyticsPanel(QWidget):
+    """
+    图分析面板：连通分量、度和 PageRank 排名、按线型加权的最短路径、环检测。
+
+    计算直接读取 DiagramModel 的数组；选中一条结果后在画布上高亮并居中显示。
+    """
+
+    def __init__(self, canvas, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        layout = QVBoxLayout()
+
+        buttons = QGridLayout()
+        for i, (text, callback) in enumerate((("连通分量", self.show_components),
+                                              ("度排名", self.show_degrees),
+                                              ("中心性", self.show_pagerank),
+                                              ("环检测", self.show_cycles))):
+            button = QPushButton(text)
+            button.clicked.connect(callback)
+            buttons.addWidget(button, i // 2, i % 2)
+        layout.addLayout(buttons)
+
+        path_form = QFormLayout()
+        self.source_edit = QLineEdit()
+        self.source_edit.setPlaceholderText("留空时取选中的两个方块")
+        self.target_edit = QLineEdit()
+        self.directed_check = QCheckBox("按连线方向")
+        self.directed_check.setChecked(True)
+        path_form.addRow("起点编号:", self.source_edit)
+        path_form.addRow("终点编号:", self.target_edit)
+        path_form.addRow(self.directed_check)
+        layout.addLayout(path_form)
+        path_button = QPushButton("最短路径")
+        path_button.clicked.connect(self.show_shortest_path)
+        layout.addWidget(path_button)
+
+        self.summary = QLabel()
+        self.summary.setWordWrap(True)
+        layout.addWidget(self.summary)
+        self.results = QListWidget()
+        self.results.currentItemChanged.connect(self._result_selected)
+        layout.addWidget(self.results)
+        clear_button = QPushButton("清除高亮")
+        clear_button.clicked.connect(self.clear)
+        layout.addWidget(clear_button)
+        self.setLayout(layout)
+
+        canvas.scene.diagram_changed.connect(self._diagram_changed)
+
+    def _graph(self):
+        self.canvas.scene.flush_connection_updates()
+        return DiagramGraph.from_model(self.canvas.scene.model)
+
+    def _label(self, row):
+        model = self.canvas.scene.model
+        return f"{model.ids[row]} {model.names[row]}"
+
+    def _path_text(self, rows):
+        labels = [self._label(row) for row in rows.tolist()]
+        if len(labels) > ANALYTICS_PATH_LABELS:
+            labels = labels[:ANALYTICS_PATH_LABELS // 2] + ["…"] + labels[-ANALYTICS_PATH_LABELS // 2:]
+        return " → ".join(labels)
+
+    def _show(self, summary, entries):
+        """entries 为 [(文字, 方块行号数组, 连线下标数组)]"""
+        self.canvas.clear_highlight()
+        self.results.clear()
+        for text, rows, edges in entries:
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, (rows, edges))
+            self.results.addItem(item)
+        self.summary.setText(summary)
+
+    def clear(self):
+        self.results.clear()
+        self.summary.clear()
+        self.canvas.clear_highlight()
+
+    def _diagram_changed(self, kind, payload):
+        # 结果按行号保存，行号变化后不能再用
+        if (kind in ("remove_block", "remove_items", "remove_connection", "clear", "reset")
+                and self.results.count()):
+            self.clear()
+            self.summary.setText("图表已修改，请重新计算")
+
+    def _result_selected(self, current, previous):
+        if current is None:
+            return
+        rows, edges = current.data(Qt.UserRole)
+        self.canvas.set_highlight(rows, edges)
+        if len(rows):
+            model = self.canvas.scene.model
+            cx, cy = model.centers()
+            self.canvas.centerOn(QPointF((cx[rows].min() + cx[rows].max()) / 2,
+                                         (cy[rows].min() + cy[rows].max()) / 2))
+
+    # ---------- 分析 ----------
+    def show_components(self):
+        graph = self._graph()
+        labels, sizes = graph.components()
+        # 分量编号按大小排列，按编号排序后每个分量的行号连续
+        order = np.argsort(labels, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        entries = []
+        for k in range(min(len(sizes), ANALYTICS_LIST_LIMIT)):
+            rows = order[bounds[k]:bounds[k + 1]]
+            mask = np.zeros(graph.n, dtype=bool)
+            mask[rows] = True
+            entries.append((f"分量 {k + 1}：{sizes[k]} 个方块", rows, graph.edges_within(mask)))
+        summary = f"共 {len(sizes)} 个连通分量" if len(sizes) else "图表为空"
+        self._show(summary, entries)
+
+    def show_degrees(self):
+        graph = self._graph()
+        indeg, outdeg = graph.degrees()
+        total = indeg + outdeg
+        entries = [(f"{self._label(row)}：度 {total[row]}（入 {indeg[row]} / 出 {outdeg[row]}）",
+                    np.array([row]), graph.incident(row))
+                   for row in top_k(total, ANALYTICS_LIST_LIMIT).tolist()]
+        self._show(f"按连线数排序的前 {len(entries)} 个方块", entries)
+
+    def show_pagerank(self):
+        graph = self._graph()
+        rank = graph.pagerank()
+        entries = [(f"{self._label(row)}：{rank[row]:.4g}", np.array([row]), graph.incident(row))
+                   for row in top_k(rank, ANALYTICS_LIST_LIMIT).tolist()]
+        self._show(f"按 PageRank 排序的前 {len(entries)} 个方块", entries)
+
+    def show_cycles(self):
+        graph = self._graph()
+        on_cycles = graph.cycle_nodes()
+        cycle = graph.find_cycle()
+        if cycle is None:
+            self._show("没有有向环", [])
+            return
+        rows, edges = cycle
+        entries = [(f"环（{len(rows)} 个方块）：{self._path_text(np.append(rows, rows[0]))}", rows, edges)]
+        rows = np.flatnonzero(on_cycles)
+        entries.append((f"位于环上或环之间的方块：{len(rows)} 个", rows,
+                        graph.edges_within(on_cycles)))
+        self._show("存在有向环", entries)
+        self.results.setCurrentRow(0)
+
+    def show_shortest_path(self):
+        scene = self.canvas.scene
+        texts = [self.source_edit.text().strip(), self.target_edit.text().strip()]
+        try:
+            if any(texts):
+                ids = [int(text) for text in texts]
+            else:
+                ids = [item.id for item in scene.selectedItems() if isinstance(item, DraggableBlock)]
+                if len(ids) != 2:
+                    raise ValueError("请输入起点和终点编号，或选中两个方块")
+            for block_id in ids:
+                if not scene.has_block(block_id):
+                    raise ValueError(f"找不到编号为 {block_id} 的方块")
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+
+        graph = self._graph()
+        source, target = (scene.model.row_of[block_id] for block_id in ids)
+        result = graph.shortest_path(source, target, directed=self.directed_check.isChecked())
+        if result is None:
+            self._show(f"{ids[0]} 无法到达 {ids[1]}", [])
+            return
+        distance, rows, edges = result
+        self._show(f"最短路径：按线型加权的距离 {distance}，经过 {len(edges)} 条连线",
+                   [(self._path_text(rows), rows, edges)])
+        self.results.setCurrentRow(0)
+
+
+# ====================== 性能监视 ======================
+PROFILE_OVERLAY_INTERVAL = 250    # 浮层刷新间隔（毫秒）
+PROFILE_OVERLAY_TOP = 4           # 浮层列出累计耗时最多的函数数
+
+# 开启性能监视时替换为计时包装的热点函数，关闭后恢复原函数
+for _owner, _name in ((Connection, "update_line"), (Connection, "paint"),
+                      (DraggableBlock, "itemChange"), (DraggableBlock, "paint"),
+                      (BlockLabel, "paint"), (FlowScene, "_sync_model"),
+                      (FlowScene, "flush_connection_updates"), (VirtualDiagram, "paint_overview"),
+                      (CanvasBackground, "paint"), (Canvas, "drawForeground"),
+                      (Canvas, "update_virtual_items"), (Canvas, "load_tables"),
+                      (StreamingImport, "_step")):
+    PROFILER.instrument(_owner, _name)
+PROFILER.instrument(diagram_io, "read_diagram", "import.read")
+PROFILER.instrument(diagram_io, "write_diagram", "export.write")
+del _owner, _name
+
+# 每帧绘制的图元和连线更新扇出按这些名称的调用次数统计
+_PAINT_LABELS = ("Connection.paint", "DraggableBlock.paint", "BlockLabel.paint")
+_FANOUT_LABEL = "Connection.update_line"
+
+
+class ProfilerOverlay(QLabel):
+    """画布左上角的半透明浮层，显示帧率、每帧绘制的图元数和连线更新扇出"""
+
+    def __init__(self, canvas):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QLabel { background: rgba(0, 0, 0, 160); color: white;"
+                           " font-family: monospace; padding: 4px; }")
+        self.timer = QTimer(self)
+        self.timer.setInterval(PROFILE_OVERLAY_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.timer.start()
+        self.refresh()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        frame = PROFILER.last_frame
+        painted = sum(frame.get(label, 0) for label in _PAINT_LABELS)
+        lines = [f"FPS {PROFILER.fps():5.1f}   帧 {PROFILER.last_frame_ns / 1e6:6.2f} ms",
+                 f"绘制图元 {painted}   连线更新 {frame.get(_FANOUT_LABEL, 0)}"]
+        for label, stats in PROFILER.top(PROFILE_OVERLAY_TOP):
+            lines.append(f"{label} {stats.total / 1e6:.1f} ms / {stats.count} 次")
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(self.canvas.viewport().geometry().topLeft() + QPoint(8, 8))
+        self.raise_()
+
+
+# ====================== 小地图 ======================
+MINIMAP_SIZE = 512          # 缓存位图长边的像素数
+MINIMAP_UPDATE_MS = 100     # 修改后合并重画的间隔
+MINIMAP_FULL_REDRAW = 0.3   # 脏网格超过位图的这一比例时整张重画
+MINIMAP_VIEW_PEN = QPen(QColor(255, 0, 0), 2)
+MINIMAP_VIEW_BRUSH = QBrush(QColor(255, 0, 0, 40))
+_MINIMAP_COLORS = [QColor(*rgb).rgb() for rgb in PALETTE.tolist()]
+
+
+class Minimap(QWidget):
+    """
+    整张图表的缩略图：绘制 MinimapRaster 缓存的低分辨率位图，红框为画布的可见范围。
+
+    拖动红框或点击别处移动画布，滚轮缩放画布。图表修改只标记受影响的区域，
+    每 MINIMAP_UPDATE_MS 合并重画一次；隐藏时不做任何更新，重新显示时整张重画。
+    """
+
+    def __init__(self, canvas, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.raster = MinimapRaster(MINIMAP_SIZE)
+        self._image = None
+        self._drag_offset = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(MINIMAP_UPDATE_MS)
+        self._timer.timeout.connect(self.refresh)
+        self.setMinimumSize(160, 120)
+        canvas.scene.diagram_changed.connect(self._diagram_changed)
+        canvas.view_changed.connect(self.update)
+        canvas.zoom.changed.connect(self.update)
+
+    def sizeHint(self):
+        return QSize(240, 180)
+
+    # ---------- 更新 ----------
+    def _diagram_changed(self, kind, payload):
+        raster = self.raster
+        if not self.isVisible() or kind in ("clear", "reset", "edit"):
+            # 修改尺寸会移动方块中心，与整图替换一样整张重画
+            raster.invalidate()
+        elif kind == "move":
+            model = self.canvas.scene.model
+            raster.mark_moved(model, [model.row_of[block.id] for block, _ in payload],
+                              [old.x() for _, old in payload], [old.y() for _, old in payload])
+        elif kind in ("add_block", "remove_block"):
+            block, connections = (payload, []) if kind == "add_block" else payload[:2]
+            rect = block.sceneBoundingRect()
+            raster.mark(rect.left(), rect.top(), rect.right(), rect.bottom())
+            self._mark_connections(connections)
+        elif kind == "remove_items":
+            blocks, relations = payload[:2]
+            raster.mark(blocks.x, blocks.y, blocks.x + blocks.width, blocks.y + blocks.height)
+            self._mark_relations(blocks, relations)
+        elif kind in ("add_connection", "remove_connection"):
+            self._mark_connections([payload])
+        elif kind == "line_type":
+            self._mark_connections([conn for conn, _ in payload])
+        else:
+            return
+        if self.isVisible() and not self._timer.isActive():
+            self._timer.start()
+
+    def _mark_connections(self, connections):
+        if not connections:
+            return
+        points = np.array([(conn.start_block.get_center().x(), conn.start_block.get_center().y(),
+                            conn.end_block.get_center().x(), conn.end_block.get_center().y())
+                           for conn in connections])
+        self.raster.mark_segments(points[:, 0], points[:, 1], points[:, 2], points[:, 3])
+
+    def _mark_relations(self, blocks, relations):
+        # 删除的连线两端可能是同时删除的方块（在 blocks 中），也可能仍在 model 中
+        if not len(relations):
+            return
+        model = self.canvas.scene.model
+        cx, cy = model.centers()
+        ids = np.concatenate([blocks.ids, model.ids])
+        cx = np.concatenate([blocks.x + blocks.width / 2, cx])
+        cy = np.concatenate([blocks.y + blocks.height / 2, cy])
+        order = np.argsort(ids, kind="stable")
+        start = order[np.searchsorted(ids, relations.start, sorter=order)]
+        end = order[np.searchsorted(ids, relations.end, sorter=order)]
+        self.raster.mark_segments(cx[start], cy[start], cx[end], cy[end])
+
+    def refresh(self):
+        """重画位图中需要更新的部分"""
+        self._timer.stop()
+        if not self.isVisible():
+            return
+        with PROFILER.span("minimap.refresh"):
+            changed = self.raster.refresh(self.canvas.scene.model, MINIMAP_FULL_REDRAW)
+        if changed or self._image is None:
+            pixels = self.raster.pixels
+            height, width = pixels.shape
+            image = QImage(pixels.data, width, height, width, QImage.Format_Indexed8)
+            image.setColorTable(_MINIMAP_COLORS)
+            # 位图数组之后会被原地修改或替换，这里保留一份副本
+            self._image = image.copy()
+            self.update()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.raster.invalidate()
+        self.refresh()
+
+    # ---------- 坐标 ----------
+    def _target_rect(self):
+        """位图在控件中保持比例居中显示的区域"""
+        raster = self.raster
+        scale = min(self.width() / raster.width, self.height() / raster.height)
+        width, height = raster.width * scale, raster.height * scale
+        return QRectF((self.width() - width) / 2, (self.height() - height) / 2, width, height)
+
+    def _to_widget(self, x, y):
+        target = self._target_rect()
+        px, py = self.raster.to_pixels(x, y)
+        factor = target.width() / self.raster.width
+        return QPointF(target.left() + float(px) * factor, target.top() + float(py) * factor)
+
+    def _to_scene(self, pos):
+        target = self._target_rect()
+        factor = target.width() / self.raster.width
+        x, y = self.raster.to_scene((pos.x() - target.left()) / factor,
+                                    (pos.y() - target.top()) / factor)
+        return QPointF(x, y)
+
+    def view_rect(self):
+        """画布可见范围在控件中的矩形"""
+        canvas = self.canvas
+        visible = canvas.mapToScene(canvas.viewport().rect()).boundingRect()
+        return QRectF(self._to_widget(visible.left(), visible.top()),
+                      self._to_widget(visible.right(), visible.bottom()))
+
+    # ---------- 绘制与交互 ----------
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().window())
+        if self._image is None:
+            return
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawImage(self._target_rect(), self._image)
+        painter.setPen(MINIMAP_VIEW_PEN)
+        painter.setBrush(MINIMAP_VIEW_BRUSH)
+        painter.drawRect(self.view_rect())
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.LeftButton or self._image is None:
+            return
+        pos = QPointF(event.pos())
+        view = self.view_rect()
+        # 按在红框内时保持按下点在框内的位置，否则把画布中心移到按下点
+        self._drag_offset = pos - view.center() if view.contains(pos) else QPointF()
+        self._center_on(pos)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_offset is not None:
+            self._center_on(QPointF(event.pos()))
+
+    def mouseReleaseEvent(self, event):
+        self._drag_offset = None
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.canvas.zoom.zoom_by(ZOOM_STEP ** steps)
+        event.accept()
+
+    def _center_on(self, pos):
+        self.canvas.centerOn(self._to_scene(pos - self._drag_offset))
+
+
+# ====================== 主窗口类 ======================
+class MainWindow(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.canvas = Canvas()
+        self.layout_in_background = True
+        self.layout_worker = None
+        self.async_import = True
+        self.streaming_import = None
+        self.export_worker = None
+        self._export_progress = None
+        self.journal = None
+        self.autosave = None
+        self._autosave_lock = None
+        self.undo = UndoRecorder(self.canvas, parent=self)
+        self.analytics = AnalyticsPanel(self.canvas)
+        self.search = SearchController(self.canvas, self)
+        self.minimap = Minimap(self.canvas)
+        self.profiler_overlay = ProfilerOverlay(self.canvas)
+        self.profiler_overlay.hide()
+        self._init_ui()
+
+    def enable_autosave(self, directory=AUTOSAVE_DIR):
+        """
+        开启自动保存；留有异常退出的记录时询问是否恢复。
+
+        每个实例在 directory 下使用自己加锁的会话目录，多个窗口同时运行时互不读取、互不删除
+        对方的日志；锁已失效（所属进程已退出）的会话目录才是异常退出留下的记录。
+
+        参数:
+            directory: 各会话目录的上级目录
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._recover_autosave(directory)
+        # 先加锁再建目录，其他实例不会把还没加锁的新目录当作遗留记录
+        session = os.path.join(directory, AUTOSAVE_SESSION_PREFIX + uuid.uuid4().hex)
+        self._autosave_lock = QLockFile(session + ".lock")
+        self._autosave_lock.tryLock(0)
+        self.journal = Journal(session)
+        self.autosave = AutosaveRecorder(self.canvas, self.journal, self)
+        # 以当前状态开始新一代日志，旧的记录在快照写完后删除
+        self.autosave.compact()
+
+    def _recover_autosave(self, directory):
+        """
+        处理锁已失效的会话目录：有记录时询问是否恢复，之后删除。
+
+        一次只询问一个（最近修改的）会话，其余有记录的会话留到下次启动。
+        """
+        sessions = [path for path in glob.glob(os.path.join(directory, AUTOSAVE_SESSION_PREFIX + "*"))
+                    if os.path.isdir(path)]
+        asked = False
+        for path in sorted(sessions, key=os.path.getmtime, reverse=True):
+            lock = QLockFile(path + ".lock")
+            if not lock.tryLock(0):
+                # 另一个实例正在使用
+                continue
+            journal = Journal(path)
+            if journal.has_recovery():
+                if asked:
+                    journal.close()
+                    lock.unlock()
+                    continue
+                asked = True
+                answer = QMessageBox.question(self, "恢复", "检测到上次未正常关闭，是否恢复未保存的图表？",
+                                              QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+                if answer == QMessageBox.Yes:
+                    try:
+                        blocks, relations, clusters = journal.recover(clusters=True)
+                        self.canvas.load_tables(blocks, relations, clusters=clusters)
+                    except Exception as e:
+                        QMessageBox.critical(self, "错误", f"恢复失败: {str(e)}")
+            # 恢复的内容会写入本实例的新会话，原来的记录不再需要
+            journal.discard()
+            lock.unlock()
+
+    def closeEvent(self, event):
+        self.canvas.scene.stop_routing(wait=True)
+        self.stop_export(wait=True)
+        self.canvas.stop_background()
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+            self._autosave_lock.unlock()
+        super().closeEvent(event)
+
+    def _init_ui(self):
+        self.setWindowTitle("重大工作组流程图工具")
+        self.setGeometry(100, 100, 1200, 800)
+        self.setWindowIcon(QIcon(resource_path("logo.png")))  # 替换为你的图标文件路径
+        # 工具栏
+        toolbar = self.addToolBar("工具")
+        line_types = [
+            LineType.SINGLE,
+            LineType.DOUBLE,
+            LineType.TRIPLE,
+            LineType.QUADRUPLE
+        ]
+        for lt in line_types:
+            action = QAction(lt.value.capitalize(), self)
+            action.triggered.connect(lambda _,lt=lt: self.set_line_type(lt))
+            toolbar.addAction(action)
+
+        toolbar.addSeparator()
+        undo_action = self.undo.stack.createUndoAction(self, "撤销")
+        undo_action.setShortcut(QKeySequence.Undo)
+        toolbar.addAction(undo_action)
+        redo_action = self.undo.stack.createRedoAction(self, "重做")
+        redo_action.setShortcut(QKeySequence.Redo)
+        toolbar.addAction(redo_action)
+
+        toolbar.addSeparator()
+        layered_action = QAction("分层布局", self)
+        layered_action.triggered.connect(lambda: self.run_layout("layered"))
+        toolbar.addAction(layered_action)
+        force_action = QAction("力导向布局", self)
+        force_action.triggered.connect(lambda: self.run_layout("force"))
+        toolbar.addAction(force_action)
+
+        toolbar.addSeparator()
+        group_action = QAction("分组", self)
+        group_action.setShortcut(QKeySequence("Ctrl+G"))
+        group_action.triggered.connect(self.canvas.scene.group_selection)
+        toolbar.addAction(group_action)
+        expand_action = QAction("全部展开", self)
+        expand_action.triggered.connect(self.canvas.scene.expand_all)
+        toolbar.addAction(expand_action)
+
+        toolbar.addSeparator()
+        routing_group = QActionGroup(self)
+        for mode, text in ((routing.STRAIGHT, "直线"), (routing.ORTHOGONAL, "正交路由"),
+                           (routing.BUNDLED, "捆绑")):
+            action = QAction(text, self, checkable=True)
+            action.setChecked(mode == self.canvas.scene.routing_mode)
+            action.triggered.connect(lambda _, mode=mode: self.set_routing(mode))
+            routing_group.addAction(action)
+            toolbar.addAction(action)
+
+        # 图分析面板和小地图停靠在右侧，默认隐藏
+        toolbar.addSeparator()
+        analytics_dock = QDockWidget("图分析", self)
+        analytics_dock.setWidget(self.analytics)
+        self.addDockWidget(Qt.RightDockWidgetArea, analytics_dock)
+        analytics_dock.hide()
+        toolbar.addAction(analytics_dock.toggleViewAction())
+        minimap_dock = QDockWidget("小地图", self)
+        minimap_dock.setWidget(self.minimap)
+        self.addDockWidget(Qt.RightDockWidgetArea, minimap_dock)
+        minimap_dock.hide()
+        toolbar.addAction(minimap_dock.toggleViewAction())
+
+        # 搜索框：回车跳到下一个匹配
+        toolbar.addSeparator()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("搜索名称 / id:编号 / line:线型")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.setMaximumWidth(240)
+        self.search_edit.textChanged.connect(self.search.set_text)
+        self.search_edit.returnPressed.connect(self.search.next_match)
+        toolbar.addWidget(self.search_edit)
+        self.search_label = QLabel()
+        self.search.searched.connect(self.search_label.setText)
+        toolbar.addWidget(self.search_label)
+        find_action = QAction("查找", self)
+        find_action.setShortcut(QKeySequence.Find)
+        find_action.triggered.connect(lambda: self.search_edit.setFocus(Qt.ShortcutFocusReason))
+        self.addAction(find_action)
+
+        toolbar.addSeparator()
+        self.profile_action = QAction("性能监视", self, checkable=True)
+        self.profile_action.toggled.connect(self.set_profiling)
+        toolbar.addAction(self.profile_action)
+        trace_action = QAction("导出性能跟踪", self)
+        trace_action.triggered.connect(self._export_trace)
+        toolbar.addAction(trace_action)
+
+        # 控制面板
+        control_panel = QWidget()
+        layout = QVBoxLayout()
+        layout.addWidget(self._create_button("导出", self._export))
+        layout.addWidget(self._create_button("导入", self._import))
+        layout.addWidget(self._create_button("合并导入", self._merge_import))
+        layout.addWidget(self._create_button("导出图片", self._export_image))
+        control_panel.setLayout(layout)
+
+        # 缩放控件
+        zoom_layout = QHBoxLayout()
+        self.zoom_slider = QSlider(Qt.Horizontal)
+        self.zoom_slider.setMinimum(round(ZOOM_MIN * 100))
+        self.zoom_slider.setMaximum(round(ZOOM_MAX * 100))
+        self.zoom_slider.setValue(100)
+        self.zoom_slider.valueChanged.connect(self._zoom_canvas)
+        self.canvas.zoom.changed.connect(self._zoom_changed)
+
+        self.zoom_label = QLabel("100%")
+        self.zoom_label.setFixedWidth(40)
+
+        zoom_layout.addWidget(self.zoom_slider)
+        zoom_layout.addWidget(self.zoom_label)
+
+        layout.addLayout(zoom_layout)
+
+        control_panel.setLayout(layout)
+        # 主界面
+        central_widget = QWidget()
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(control_panel)
+        main_layout.addWidget(self.canvas)
+        central_widget.setLayout(main_layout)
+        self.setCentralWidget(central_widget)
+
+    def _zoom_canvas(self, value):
+        self.canvas.zoom.zoom_to(value / 100.0)
+
+    def _zoom_changed(self, scale):
+        value = round(scale * 100)
+        self.zoom_slider.blockSignals(True)
+        self.zoom_slider.setValue(value)
+        self.zoom_slider.blockSignals(False)
+        self.zoom_label.setText(f"{value}%")
+
+    def _create_button(self, text, callback):
+        btn = QPushButton(text)
+        btn.clicked.connect(callback)
+        return btn
+
+    def set_line_type(self, line_type):
+        self.canvas.current_line_type = line_type
+        # 更新选中连线的样式
+        selected = [item for item in self.canvas.scene.selectedItems()
+                    if isinstance(item, Connection)]
+        self.canvas.scene.set_line_type(selected, line_type)
+
+    def set_routing(self, mode):
+        self.canvas.scene.set_routing(mode)
+
+    def set_profiling(self, enabled):
+        """开启或关闭热点函数计时和画布上的性能浮层，开启时清空之前的记录"""
+        if enabled == PROFILER.enabled:
+            return
+        if enabled:
+            PROFILER.reset()
+            PROFILER.enable()
+        else:
+            PROFILER.disable()
+        self.profile_action.setChecked(enabled)
+        self.profiler_overlay.setVisible(enabled)
+        self.canvas.viewport().update()
+
+    def _export_trace(self):
+        if not PROFILER.trace:
+            QMessageBox.information(self, "提示", "没有性能记录，请先开启性能监视并操作画布")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出性能跟踪", "trace.json",
+                                                   "Chrome 跟踪文件 (*.json)")
+        if not file_path:
+            return
+        try:
+            count = PROFILER.write_chrome_trace(file_path)
+        except OSError as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+            return
+        QMessageBox.information(self, "导出成功", f"已导出 {count} 条记录，可在 chrome://tracing 中打开")
+
+    def run_layout(self, kind):
+        self.stop_layout()
+        # 一次布局的全部中间结果合并为一条撤销记录
+        self.canvas.scene.move_group += 1
+        blocks, src, dst, widths, heights, init = self.canvas.layout_inputs()
+        if not len(blocks):
+            return
+
+        if not self.layout_in_background:
+            x, y = compute_layout(kind, src, dst, widths, heights, init)
+            self.canvas.apply_layout(blocks, x, y)
+            return
+
+        worker = LayoutWorker(kind, src, dst, widths, heights, init, self)
+        worker.progress.connect(lambda x, y: self.canvas.apply_layout(blocks, x, y))
+        worker.finished_layout.connect(lambda x, y: self.canvas.apply_layout(blocks, x, y))
+        worker.finished.connect(lambda: self._layout_finished(worker))
+        self.layout_worker = worker
+        worker.start()
+
+    def _layout_finished(self, worker):
+        if self.layout_worker is worker:
+            self.layout_worker = None
+        worker.deleteLater()
+
+    def stop_layout(self):
+        worker = self.layout_worker
+        self.layout_worker = None
+        if worker is not None and worker.isRunning():
+            worker.requestInterruption()
+            worker.progress.disconnect()
+            worker.finished_layout.disconnect()
+
+    def _export(self):
+        try:
+            # 弹出保存文件对话框
+            options = QFileDialog.Options()
+            file_path, selected_filter = QFileDialog.getSaveFileName(
+                self,
+                "保存文件",
+                "diagram.xlsx",  # 默认文件名
+                ";;".join(FILE_FILTERS),  # 文件类型过滤
+                options=options
+            )
+
+            if not file_path:
+                return  # 用户取消操作
+
+            if not os.path.splitext(file_path)[1]:
+                file_path += FILE_SUFFIXES[selected_filter]
+
+            blocks, relations = self.canvas.to_tables()
+            clusters = self.canvas.scene.clusters.to_table(blocks.ids)
+            diagram_io.write_diagram(file_path, blocks, relations, clusters)
+
+            QMessageBox.information(self, "导出成功", f"数据已保存到\n{file_path}")
+
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+
+    def _export_image(self):
+        path, selected_filter = QFileDialog.getSaveFileName(
+            self, "导出图片", "diagram.png", ";;".join(IMAGE_FILTERS))
+        if not path:
+            return
+        if not os.path.splitext(path)[1]:
+            path += IMAGE_SUFFIXES[selected_filter]
+        scale = 1.0
+        if path.lower().endswith(".png"):
+            scale, ok = QInputDialog.getDouble(self, "导出图片", "缩放倍数:", 1.0, 0.01, 16.0, 2)
+            if not ok:
+                return
+        self.export_image(path, scale)
+
+    def export_image(self, path, scale=1.0):
+        """
+        在后台线程把当前图表导出为图片，格式由扩展名决定。
+
+        参数:
+            path: .png / .svg / .pdf 文件
+            scale: PNG 每个场景单位对应的像素数
+        """
+        self.stop_export()
+        scene = self.canvas.scene
+        scene.flush_connection_updates()
+        routes = scene.router.routes if scene.router is not None else None
+        worker = ExportWorker(DiagramPainter(scene.model, routes), path, scale, self)
+
+        progress = QProgressDialog("正在导出图片...", "取消", 0, 0, self)
+        progress.setWindowTitle("导出")
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(0)
+        progress.canceled.connect(worker.requestInterruption)
+
+        def update(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+        worker.progress.connect(update)
+        worker.exported.connect(
+            lambda path: QMessageBox.information(self, "导出成功", f"图片已保存到\n{path}"))
+        worker.failed.connect(
+            lambda message: QMessageBox.critical(self, "错误", f"导出失败: {message}"))
+        worker.finished.connect(lambda: self._export_finished(worker))
+        self.export_worker = worker
+        self._export_progress = progress
+        progress.show()
+        worker.start()
+
+    def stop_export(self, wait=False):
+        worker = self.export_worker
+        if worker is None:
+            return
+        worker.requestInterruption()
+        if wait:
+            worker.wait()
+            self._export_finished(worker)
+
+    def _export_finished(self, worker):
+        if self.export_worker is not worker:
+            return
+        self.export_worker = None
+        self._export_progress.close()
+        self._export_progress.deleteLater()
+        self._export_progress = None
+        worker.deleteLater()
+
+    def _import(self):
+        try:
+            path, _ = QFileDialog.getOpenFileName(
+                self, "打开文件", "", "流程图文件 (*.xlsx *.fcd);;" + ";;".join(FILE_FILTERS))
+            if not path:
+                return
+
+            if self.async_import:
+                self._start_streaming_import(path)
+                return
+
+            # 按列读取并校验模块和连接
+            blocks, relations, clusters = diagram_io.read_diagram(path, clusters=True)
+
+            # 完全没有坐标时按连线关系分层布局，部分缺失时自动分散放置
+            position_blocks(blocks, relations)
+
+            self.stop_layout()
+            self.canvas.load_tables(blocks, relations, clusters=clusters)
+            QMessageBox.information(self, "导入成功",
+                                    f"已导入 {len(blocks)} 个模块和 {len(relations)} 条连线")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导入失败: {str(e)}")
+
+    def _merge_import(self):
+        try:
+            path, _ = QFileDialog.getOpenFileName(
+                self, "合并文件", "", "流程图文件 (*.xlsx *.fcd);;" + ";;".join(FILE_FILTERS))
+            if not path:
+                return
+            blocks, relations = diagram_io.read_diagram(path)
+            diff = self.merge_diagram(blocks, relations)
+            QMessageBox.information(self, "合并成功",
+                                    diff.summary() if diff else "图表没有变化")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"合并失败: {str(e)}")
+
+    def merge_diagram(self, blocks, relations, keep_positions=True):
+        """增量合并数据表，全部修改合并为一条撤销记录"""
+        if self.streaming_import is not None:
+            self.streaming_import.cancel()
+        self.stop_layout()
+        diff = self.canvas.diff_tables(blocks, relations, keep_positions)
+        if diff:
+            stack = self.undo.stack
+            stack.beginMacro("合并导入")
+            try:
+                self.canvas.merge_tables(blocks, relations, diff)
+            finally:
+                stack.endMacro()
+        return diff
+
+    def _start_streaming_import(self, path):
+        if self.streaming_import is not None:
+            self.streaming_import.cancel()
+        self.stop_layout()
+        importer = StreamingImport(self.canvas, path, self)
+        importer.finished.connect(
+            lambda status, message: self._streaming_import_finished(importer, status, message))
+        self.streaming_import = importer
+        importer.start()
+
+    def _streaming_import_finished(self, importer, status, message):
+        if self.streaming_import is importer:
+            self.streaming_import = None
+        importer.deleteLater()
+        if status == "ok":
+            QMessageBox.information(self, "导入成功", message)
+        elif status == "failed":
+            QMessageBox.critical(self, "错误", message)
+
+
+
+# ====================== 启动 ======================
+# 从导入程序到窗口首次绘制完成、背景图就绪的目标耗时
+STARTUP_BUDGET_MS = 1500
+
+
+class FirstPaintWatcher(QObject):
+    """控件第一次绘制完成后调用 callback，之后不再过滤事件"""
+
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self.callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            # 过滤器在绘制之前调用，回到事件循环时绘制已经完成
+            QTimer.singleShot(0, self.callback)
+        return False
+
+
+def main(argv):
+    """
+    启动程序。带 --startup-report 参数时只测量启动耗时：窗口首次绘制完成且背景图就绪后
+    把各阶段耗时打印到标准错误并退出，超出 STARTUP_BUDGET_MS 时退出码为 1。
+    """
+    report_only = "--startup-report" in argv
+    STARTUP.mark("导入模块")
+    app = QApplication(argv)
+    window = MainWindow()
+    # 以任何方式退出事件循环时都先关闭窗口，等待后台线程结束
+    app.aboutToQuit.connect(window.close)
+    STARTUP.mark("创建主窗口")
+
+    def startup_finished():
+        print(STARTUP.report(STARTUP_BUDGET_MS), file=sys.stderr)
+        if report_only:
+            app.exit(int(STARTUP.elapsed_ms() > STARTUP_BUDGET_MS))
+
+    if report_only or os.environ.get("FLOW_CHART_STARTUP_REPORT"):
+        STARTUP.when_done(("首次绘制", "背景图就绪"), startup_finished)
+    window.canvas.background_ready.connect(lambda: STARTUP.mark("背景图就绪"))
+    FirstPaintWatcher(window.canvas.viewport(), lambda: STARTUP.mark("首次绘制"))
+    window.show()
+    if os.environ.get("FLOW_CHART_PROFILE"):
+        window.set_profiling(True)
+    if not report_only:
+        # 恢复询问和日志压缩放到窗口显示之后
+        QTimer.singleShot(0, window.enable_autosave)
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,244 @@
+"""
+流程图批量处理命令行工具，无需显示器即可运行。
+
+示例:
+    python flow_chart_batch.py diagrams/ -o out/ --layout layered --render png svg --jobs 8
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import diagram_io
+from graph_layout import position_blocks
+
+INPUT_SUFFIXES = (diagram_io.EXCEL_SUFFIX, diagram_io.NATIVE_SUFFIX)
+RENDER_FORMATS = ("png", "svg")
+RENDER_MARGIN = 40
+MAX_IMAGE_SIDE = 16384
+
+_app = None
+
+
+def ensure_application():
+    """以 offscreen 平台创建 QApplication，每个进程只创建一次"""
+    global _app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication([sys.argv[0]])
+    return _app
+
+
+# ====================== 库接口 ======================
+def load_diagram(path, clusters=False):
+    """读取并校验图表，连线两端必须引用已存在的编号；clusters 为 True 时一并返回分组"""
+    tables = diagram_io.read_diagram(path, clusters=clusters)
+    diagram_io.resolve_endpoints(tables[0].ids, tables[1])
+    return tables
+
+
+def build_scene(blocks, relations):
+    """用与编辑器相同的 DraggableBlock / Connection 构建场景"""
+    ensure_application()
+    from flow_chart import FlowScene
+    scene = FlowScene()
+    scene.setItemIndexMethod(FlowScene.NoIndex)
+    scene.populate(blocks, relations)
+    return scene
+
+
+def render_scene(scene, path, scale=1.0):
+    """按扩展名把场景渲染为 PNG 或 SVG"""
+    from PyQt5.QtCore import QRectF, QSize, Qt
+    from PyQt5.QtGui import QImage, QPainter
+    source = scene.itemsBoundingRect().adjusted(-RENDER_MARGIN, -RENDER_MARGIN,
+                                                RENDER_MARGIN, RENDER_MARGIN)
+    width = max(1, int(source.width() * scale))
+    height = max(1, int(source.height() * scale))
+    target = QRectF(0, 0, width, height)
+
+    if path.lower().endswith(".svg"):
+        from PyQt5.QtSvg import QSvgGenerator
+        generator = QSvgGenerator()
+        generator.setFileName(path)
+        generator.setSize(QSize(width, height))
+        generator.setViewBox(target)
+        painter = QPainter(generator)
+        scene.render(painter, target, source)
+        painter.end()
+        return
+
+    if max(width, height) > MAX_IMAGE_SIDE:
+        raise ValueError(f"图片尺寸 {width}x{height} 超出上限，请减小 --scale")
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    scene.render(painter, target, source)
+    painter.end()
+    if not image.save(path):
+        raise OSError(f"无法写入图片: {path}")
+
+
+def process_file(path, output_dir=None, output_format=None, layout="auto",
+                 render=(), scale=1.0):
+    """
+    处理单个图表文件：读取校验、定位、导出、渲染。
+
+    返回:
+        dict: 输入路径、输出文件、各阶段耗时（秒）以及错误信息
+    """
+    result = {"input": path, "outputs": [], "timings": {}, "error": None}
+    timings = result["timings"]
+    started = time.perf_counter()
+
+    def mark(stage, since):
+        now = time.perf_counter()
+        timings[stage] = round(now - since, 6)
+        return now
+
+    try:
+        t = time.perf_counter()
+        blocks, relations, clusters = load_diagram(path, clusters=True)
+        result["blocks"] = len(blocks)
+        result["relations"] = len(relations)
+        t = mark("read", t)
+
+        if layout != "none":
+            position_blocks(blocks, relations, mode=layout)
+        t = mark("layout", t)
+
+        base = os.path.splitext(os.path.basename(path))[0]
+        output_dir = output_dir or os.path.dirname(os.path.abspath(path))
+        os.makedirs(output_dir, exist_ok=True)
+        if output_format:
+            target = os.path.join(output_dir, base + "." + output_format)
+            if os.path.exists(target) and os.path.samefile(target, path):
+                raise ValueError(f"导出文件就是输入文件，不会覆盖: {path}，请用 -o 指定其他目录")
+            diagram_io.write_diagram(target, blocks, relations, clusters)
+            result["outputs"].append(target)
+            t = mark("write", t)
+
+        if render:
+            if blocks.missing_position().any():
+                raise ValueError("存在没有坐标的方块，渲染前请指定 --layout")
+            scene = build_scene(blocks, relations)
+            t = mark("build_scene", t)
+            for fmt in render:
+                target = os.path.join(output_dir, base + "." + fmt)
+                render_scene(scene, target, scale)
+                result["outputs"].append(target)
+                t = mark("render_" + fmt, t)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    timings["total"] = round(time.perf_counter() - started, 6)
+    return result
+
+
+def process_files(paths, jobs=None, **options):
+    """用进程池并行处理多个文件，按完成顺序逐个产出结果"""
+    if jobs == 1 or len(paths) <= 1:
+        for path in paths:
+            yield process_file(path, **options)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_file, path, **options) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def expand_inputs(inputs, output_dir=None):
+    """
+    展开目录和通配符，只保留支持的图表文件，重复给出的文件只保留一次。
+
+    输出文件名只取输入的文件名（不含扩展名），同一输出目录中同名的输入（如 a.xlsx 和 a.fcd）
+    会在并行处理时写同一批文件，这些输入都作为冲突返回。
+
+    参数:
+        output_dir: 输出目录，None 表示与各输入文件相同
+    返回:
+        (可以处理的路径列表, {冲突的路径: 错误信息})
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = sorted(glob.glob(os.path.join(item, "*")))
+        else:
+            candidates = sorted(glob.glob(item)) or [item]
+        paths.extend(p for p in candidates
+                     if os.path.splitext(p)[1].lower() in INPUT_SUFFIXES)
+    unique = {}
+    for p in paths:
+        unique.setdefault(os.path.normcase(os.path.abspath(p)), p)
+    paths = list(unique.values())
+
+    groups = {}
+    for p in paths:
+        directory = os.path.abspath(output_dir or os.path.dirname(os.path.abspath(p)))
+        base = os.path.splitext(os.path.basename(p))[0]
+        groups.setdefault(os.path.normcase(os.path.join(directory, base)), []).append(p)
+    conflicts = {}
+    for group in groups.values():
+        if len(group) > 1:
+            for p in group:
+                others = ", ".join(q for q in group if q is not p)
+                conflicts[p] = f"ValueError: 输出文件名与 {others} 相同，请分开处理或重命名"
+    return [p for p in paths if p not in conflicts], conflicts
+
+
+# ====================== 命令行 ======================
+def build_parser():
+    parser = argparse.ArgumentParser(description="流程图批量转换、布局和渲染工具")
+    parser.add_argument("inputs", nargs="+", help="图表文件、目录或通配符")
+    parser.add_argument("-o", "--output-dir", help="输出目录，默认与输入文件相同")
+    parser.add_argument("-f", "--format", choices=("xlsx", "fcd"), help="导出的图表格式")
+    parser.add_argument("--layout", choices=("auto", "scatter", "layered", "force", "none"),
+                        default="auto", help="定位方式，默认只补全缺失坐标")
+    parser.add_argument("--render", nargs="*", choices=RENDER_FORMATS, default=[],
+                        help="渲染的图片格式")
+    parser.add_argument("--scale", type=float, default=1.0, help="渲染缩放比例")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="并行进程数")
+    parser.add_argument("--report", help="把每个文件的耗时写入 JSON 报告")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    paths, conflicts = expand_inputs(args.inputs, args.output_dir)
+    if not (args.format or args.render):
+        # 不写任何文件时同名输入互不影响
+        paths, conflicts = paths + list(conflicts), {}
+    if not paths and not conflicts:
+        print("没有找到可处理的图表文件", file=sys.stderr)
+        return 2
+
+    options = dict(output_dir=args.output_dir, output_format=args.format,
+                   layout=args.layout, render=tuple(args.render), scale=args.scale)
+    started = time.perf_counter()
+    results = []
+    for path, error in conflicts.items():
+        results.append({"input": path, "outputs": [], "timings": {}, "error": error})
+        print(f"失败 {path}: {error}", file=sys.stderr)
+    for result in process_files(paths, jobs=args.jobs, **options):
+        results.append(result)
+        if result["error"]:
+            print(f"失败 {result['input']}: {result['error']}", file=sys.stderr)
+        else:
+            stages = " ".join(f"{k}={v:.3f}s" for k, v in result["timings"].items())
+            print(f"完成 {result['input']} ({result['blocks']} 模块, "
+                  f"{result['relations']} 连线) {stages}")
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for r in results if r["error"])
+    print(f"共 {len(results)} 个文件，失败 {failed} 个，用时 {elapsed:.2f}s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "files": results}, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
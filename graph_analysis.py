@@ -0,0 +1,298 @@
+import heapq
+
+import numpy as np
+
+# 最短路径中各线型编号（LineType.to_number()）的权重：编号越小优先级越高，代价越低
+LINE_WEIGHTS = {1: 1, 2: 2, 3: 3, 4: 4}
+PAGERANK_DAMPING = 0.85
+SMALL_FRONTIER = 64  # 最短路径中出桶节点少于这个数时逐个松弛，省去数组运算的固定开销
+
+
+def _csr(n, src, dst, edges):
+    """按起点排序的邻接表 (indptr, 终点, 边下标)"""
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order], edges[order]
+
+
+def _gather(indptr, nodes):
+    """nodes 的全部出边在 CSR 数组中的位置，以及每条边所属的节点"""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    owner = np.repeat(nodes, counts)
+    if total == 0:
+        return np.zeros(0, dtype=np.int64), owner
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total), owner
+
+
+def top_k(values, k):
+    """values 最大的 k 个下标，按值从大到小排列"""
+    k = min(k, len(values))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-values, k - 1)[:k]
+    return part[np.argsort(-values[part], kind="stable")]
+
+
+# ====================== 图结构 ======================
+class DiagramGraph:
+    """
+    方块为节点、连线为有向边的稀疏图，出边和入边各存一份 CSR。
+
+    节点是 DiagramModel 中的行号，边是连线在 model 中的下标；
+    查询结果用 node_ids / edge_uids 换回方块编号和连线 uid。
+    """
+
+    def __init__(self, n, src, dst, line, node_ids=None, edge_uids=None):
+        self.n = n
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.line = np.asarray(line, dtype=np.int64)
+        self.node_ids = np.arange(n) if node_ids is None else np.asarray(node_ids)
+        self.edge_uids = np.arange(len(self.src)) if edge_uids is None else np.asarray(edge_uids)
+        edges = np.arange(len(self.src), dtype=np.int64)
+        self.out_indptr, self.out_targets, self.out_edges = _csr(n, self.src, self.dst, edges)
+        self.in_indptr, self.in_sources, self.in_edges = _csr(n, self.dst, self.src, edges)
+
+    @classmethod
+    def from_model(cls, model):
+        src, dst = model.edge_rows()
+        return cls(len(model), src, dst, model.edge_line, model.ids, model.edge_uid)
+
+    @property
+    def n_edges(self):
+        return len(self.src)
+
+    def weights(self, line_weights=None):
+        """每条边的整数权重，由线型编号查表得到"""
+        line_weights = LINE_WEIGHTS if line_weights is None else line_weights
+        table = np.zeros(max(line_weights) + 1, dtype=np.int64)
+        for number, weight in line_weights.items():
+            table[number] = weight
+        return table[self.line]
+
+    # ---------- 度与中心性 ----------
+    def degrees(self):
+        """返回 (入度, 出度)"""
+        return np.diff(self.in_indptr), np.diff(self.out_indptr)
+
+    def pagerank(self, damping=PAGERANK_DAMPING, tol=1e-8, max_iter=100):
+        """幂迭代计算 PageRank，没有出边的节点把权重平均分给所有节点"""
+        n = self.n
+        if n == 0:
+            return np.zeros(0)
+        out_degree = np.diff(self.out_indptr).astype(np.float64)
+        dangling = out_degree == 0
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            share = rank / np.where(dangling, 1.0, out_degree)
+            incoming = np.bincount(self.dst, weights=share[self.src], minlength=n)
+            new = (1 - damping) / n + damping * (incoming + rank[dangling].sum() / n)
+            delta = np.abs(new - rank).sum()
+            rank = new
+            if delta < tol:
+                break
+        return rank
+
+    # ---------- 连通分量 ----------
+    def components(self):
+        """
+        弱连通分量（忽略方向），按分量大小从大到小编号。
+
+        返回:
+            (labels, sizes): 每个节点的分量编号，以及各分量的节点数
+        """
+        n = self.n
+        labels = np.arange(n, dtype=np.int64)
+        src, dst = self.src, self.dst
+        while True:
+            # 把每条边两端所在的树挂到较小的根上，再压缩路径
+            low = np.minimum(labels[src], labels[dst])
+            new = labels.copy()
+            np.minimum.at(new, labels[src], low)
+            np.minimum.at(new, labels[dst], low)
+            while True:
+                jumped = new[new]
+                if np.array_equal(jumped, new):
+                    break
+                new = jumped
+            if np.array_equal(new, labels):
+                break
+            labels = new
+        roots, labels = np.unique(labels, return_inverse=True)
+        sizes = np.bincount(labels, minlength=len(roots))
+        order = np.argsort(-sizes, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return rank[labels], sizes[order]
+
+    def incident(self, node):
+        """与节点相连的全部边下标（出边在前）"""
+        return np.concatenate([self.out_edges[self.out_indptr[node]:self.out_indptr[node + 1]],
+                               self.in_edges[self.in_indptr[node]:self.in_indptr[node + 1]]])
+
+    def edges_within(self, mask):
+        """两端都在节点掩码内的边下标"""
+        return np.flatnonzero(mask[self.src] & mask[self.dst])
+
+    # ---------- 最短路径 ----------
+    def shortest_path(self, source, target, directed=True, line_weights=None):
+        """
+        按线型权重计算 source 到 target 的最短路径（Dial 桶算法）。
+
+        距离相差不到最小边权的桶一起出桶；出桶节点多时整批向量化松弛，少时逐个松弛。
+
+        参数:
+            source, target: 节点下标
+            directed: False 时忽略连线方向
+
+        返回:
+            (距离, 节点下标数组, 边下标数组)，不可达时返回 None
+        """
+        n = self.n
+        weight = self.weights(line_weights)
+        indptr, targets, edges = self.out_indptr, self.out_targets, self.out_edges
+        if not directed:
+            src = np.concatenate([self.src, self.dst])
+            dst = np.concatenate([self.dst, self.src])
+            both = np.concatenate([np.arange(self.n_edges)] * 2)
+            indptr, targets, edges = _csr(n, src, dst, both)
+
+        dist = np.full(n, np.iinfo(np.int64).max)
+        pred = np.full(n, -1, dtype=np.int64)
+        done = np.zeros(n, dtype=bool)
+        dist[source] = 0
+        # 边权至少为 step 时，距离落在 [d, d + step) 内的节点不能再互相松弛，一起出桶
+        step = max(1, int(weight.min())) if len(weight) else 1
+        buckets = {0: [[source]]}
+        keys = [0]
+        narrow, adjacency = 0, None
+
+        def push(value, nodes):
+            if value in buckets:
+                buckets[value].append(nodes)
+            else:
+                buckets[value] = [nodes]
+                heapq.heappush(keys, value)
+
+        while keys:
+            limit = keys[0] + step
+            chunks = []
+            while keys and keys[0] < limit:
+                chunks.extend(buckets.pop(heapq.heappop(keys)))
+            # 向量化松弛放入数组、逐个松弛放入列表，np.concatenate 两者都接受
+            frontier = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+            if len(frontier) < SMALL_FRONTIER:
+                # 前沿很窄（例如长链）时用 Python 循环逐条松弛
+                frontier = [u for u in set(frontier) if not done[u]]
+                if not frontier:
+                    continue
+                done[frontier] = True
+                if done[target]:
+                    break
+                # 逐个松弛的节点多到与边数相称时，一次转成 Python 列表比每次切片更省
+                narrow += len(frontier)
+                if adjacency is None and narrow * 64 > len(targets):
+                    adjacency = (indptr.tolist(), targets.tolist(), edges.tolist(), weight.tolist())
+                reached = {}
+                for u in frontier:
+                    if adjacency is None:
+                        lo, hi = indptr[u], indptr[u + 1]
+                        via = edges[lo:hi]
+                        relaxed = zip(targets[lo:hi].tolist(), via.tolist(),
+                                      (dist[u] + weight[via]).tolist())
+                    else:
+                        starts, heads, vias, weights = adjacency
+                        base = int(dist[u])
+                        relaxed = ((heads[k], vias[k], base + weights[vias[k]])
+                                   for k in range(starts[u], starts[u + 1]))
+                    for head, edge, cost in relaxed:
+                        if cost < dist[head]:
+                            dist[head] = cost
+                            pred[head] = edge
+                            reached.setdefault(cost, []).append(head)
+                for value, nodes in reached.items():
+                    push(value, nodes)
+                continue
+            frontier = np.unique(frontier)
+            frontier = frontier[~done[frontier]]
+            done[frontier] = True
+            if done[target]:
+                break
+            slots, owner = _gather(indptr, frontier)
+            heads = targets[slots]
+            via = edges[slots]
+            cost = dist[owner] + weight[via]
+            better = cost < dist[heads]
+            heads, via, cost = heads[better], via[better], cost[better]
+            # 同一节点被多次松弛时取代价最小的一次
+            order = np.lexsort((cost, heads))
+            heads, via, cost = heads[order], via[order], cost[order]
+            first = np.ones(len(heads), dtype=bool)
+            first[1:] = heads[1:] != heads[:-1]
+            heads, via, cost = heads[first], via[first], cost[first]
+            dist[heads] = cost
+            pred[heads] = via
+            for value in np.unique(cost).tolist():
+                push(value, heads[cost == value])
+
+        if not done[target]:
+            return None
+        nodes = [target]
+        path_edges = []
+        while nodes[-1] != source:
+            edge = pred[nodes[-1]]
+            path_edges.append(edge)
+            node = nodes[-1]
+            nodes.append(self.src[edge] if self.dst[edge] == node else self.dst[edge])
+        return (int(dist[target]), np.array(nodes[::-1], dtype=np.int64),
+                np.array(path_edges[::-1], dtype=np.int64))
+
+    # ---------- 环 ----------
+    def cycle_nodes(self):
+        """
+        反复剥掉入度或出度为 0 的节点，剩下的节点都位于环上或夹在环之间。
+
+        返回:
+            布尔掩码；全为 False 时图中没有有向环
+        """
+        indeg, outdeg = (d.copy() for d in self.degrees())
+        alive = np.ones(self.n, dtype=bool)
+        while True:
+            removed = np.flatnonzero(alive & ((indeg == 0) | (outdeg == 0)))
+            if not len(removed):
+                return alive
+            alive[removed] = False
+            slots, _ = _gather(self.out_indptr, removed)
+            np.subtract.at(indeg, self.out_targets[slots], 1)
+            slots, _ = _gather(self.in_indptr, removed)
+            np.subtract.at(outdeg, self.in_sources[slots], 1)
+
+    def find_cycle(self):
+        """
+        找出一个有向环。
+
+        返回:
+            (节点下标数组, 边下标数组)，没有环时返回 None
+        """
+        alive = self.cycle_nodes()
+        if not alive.any():
+            return None
+        # 剥离后每个剩余节点都有指向剩余节点的出边，沿出边走必然回到走过的节点
+        node = int(np.flatnonzero(alive)[0])
+        seen = {}
+        walk_nodes, walk_edges = [], []
+        while node not in seen:
+            seen[node] = len(walk_nodes)
+            walk_nodes.append(node)
+            lo, hi = self.out_indptr[node], self.out_indptr[node + 1]
+            heads = self.out_targets[lo:hi]
+            k = int(np.flatnonzero(alive[heads])[0])
+            walk_edges.append(int(self.out_edges[lo + k]))
+            node = int(heads[k])
+        start = seen[node]
+        return (np.array(walk_nodes[start:], dtype=np.int64),
+                np.array(walk_edges[start:], dtype=np.int64))
@@ -0,0 +1,341 @@
+import numpy as np
+import diagram_io
+from placement import PlacementEngine, place_missing
+
+CENTER = (0, 0)        # 分布中心点
+SPREAD_RADIUS = 800    # 分散半径
+MIN_SPACING = 100      # 模块之间最小间距
+
+
+# ====================== 公共工具 ======================
+def _csr(n, src, dst):
+    """按起点排序的邻接表 (indptr, targets)"""
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order]
+
+
+def _gather(indptr, targets, nodes):
+    """取出 nodes 的所有出边终点"""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return targets[offsets + np.arange(total)]
+
+
+def _clean_edges(n, src, dst):
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    if len(src):
+        key = np.unique(src * n + dst)
+        src, dst = key // n, key % n
+    return src, dst
+
+
+# ====================== 分层布局 ======================
+def back_edges(n, src, dst):
+    """
+    迭代式深度优先搜索找出反向边，翻转这些边后图中不再有环。
+
+    返回:
+        与 src 等长的布尔数组
+    """
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    targets = dst[order].tolist()
+    bounds = indptr.tolist()
+    state = [0] * n            # 0 未访问，1 在栈上，2 已完成
+    back = np.zeros(len(src), dtype=bool)
+    for root in range(n):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, bounds[root])]
+        while stack:
+            node, edge = stack[-1]
+            if edge == bounds[node + 1]:
+                state[node] = 2
+                stack.pop()
+                continue
+            stack[-1] = (node, edge + 1)
+            target = targets[edge]
+            if state[target] == 1:
+                back[order[edge]] = True
+            elif state[target] == 0:
+                state[target] = 1
+                stack.append((target, bounds[target]))
+    return back
+
+
+def assign_layers(n, src, dst):
+    """最长路径分层（src/dst 须为无环图），按入度为 0 的前沿逐层向量化推进"""
+    indptr, targets = _csr(n, src, dst)
+    indeg = np.bincount(dst, minlength=n).astype(np.int64)
+    layer = np.zeros(n, dtype=np.int64)
+    level = 0
+    frontier = np.flatnonzero(indeg == 0)
+    while len(frontier):
+        layer[frontier] = level
+        level += 1
+        reached = _gather(indptr, targets, frontier)
+        np.subtract.at(indeg, reached, 1)
+        reached = np.unique(reached)
+        frontier = reached[indeg[reached] == 0]
+    return layer
+
+
+def _insert_dummies(layer, src, dst, budget):
+    """
+    把跨越多层的边拆成相邻层之间的短边，返回扩展后的层号和边。
+
+    虚拟节点总数超过 budget 时不再拆分，长边直接参与重心排序。
+    """
+    n = len(layer)
+    span = layer[dst] - layer[src]
+    long_edges = span > 1
+    extra = span[long_edges] - 1
+    total = int(extra.sum())
+    if total == 0 or total > budget:
+        return layer, src, dst
+
+    dummy_ids = n + np.arange(total)
+    edge_of_dummy = np.repeat(np.flatnonzero(long_edges), extra)
+    step = np.arange(total) - np.repeat(np.cumsum(extra) - extra, extra) + 1
+    dummy_layer = layer[src[edge_of_dummy]] + step
+
+    # 每条长边变为 src -> d1 -> ... -> dk -> dst
+    chain_prev = np.where(step == 1, src[edge_of_dummy], dummy_ids - 1)
+    last = step == np.repeat(extra, extra)
+    new_src = np.concatenate([src[~long_edges], chain_prev, dummy_ids[last]])
+    new_dst = np.concatenate([dst[~long_edges], dummy_ids, dst[edge_of_dummy[last]]])
+    return np.concatenate([layer, dummy_layer]), new_src, new_dst
+
+
+def _order_layers(layer, src, dst, sweeps):
+    """重心法减少交叉：交替按上层、下层邻居的平均位置在层内重新排序"""
+    n = len(layer)
+    order = np.lexsort((np.arange(n), layer))
+    rank = np.empty(n, dtype=np.float64)
+    layer_start = np.searchsorted(layer[order], layer[order])
+    rank[order] = np.arange(n) - layer_start
+
+    for sweep in range(sweeps):
+        # 偶数次参考上层，奇数次参考下层
+        ref, own = (src, dst) if sweep % 2 == 0 else (dst, src)
+        total = np.bincount(own, weights=rank[ref], minlength=n)
+        count = np.bincount(own, minlength=n)
+        bary = np.where(count > 0, total / np.maximum(count, 1), rank)
+        order = np.lexsort((rank, bary, layer))
+        rank[order] = np.arange(n) - layer_start
+    return rank
+
+
+def layered_layout(n, src, dst, widths=None, heights=None,
+                   layer_gap=160, node_gap=60, sweeps=8):
+    """
+    Sugiyama 风格的分层布局。
+
+    参数:
+        n: 节点数
+        src, dst: 边的起点、终点下标数组
+        widths, heights: 节点尺寸，默认 100 x 60
+        layer_gap: 相邻层之间的垂直间距
+        node_gap: 同层节点之间的水平间距
+        sweeps: 重心排序的迭代次数
+
+    返回:
+        (x, y): 节点中心坐标数组，整体以 (0, 0) 为中心
+    """
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    widths = np.full(n, 100.0) if widths is None else np.asarray(widths, dtype=np.float64)
+    heights = np.full(n, 60.0) if heights is None else np.asarray(heights, dtype=np.float64)
+    src, dst = _clean_edges(n, src, dst)
+
+    # 翻转反向边得到无环图
+    flip = back_edges(n, src, dst)
+    src, dst = np.where(flip, dst, src), np.where(flip, src, dst)
+    layer = assign_layers(n, src, dst)
+    full_layer, full_src, full_dst = _insert_dummies(layer, src, dst, 10 * (n + len(src)))
+    rank = _order_layers(full_layer, full_src, full_dst, sweeps)[:n]
+
+    # 同层节点按排序结果从左到右排列，虚拟节点只参与排序，不占位置
+    order = np.lexsort((rank, layer))
+    step = widths.max() + node_gap
+    layer_sorted = layer[order]
+    first = np.searchsorted(layer_sorted, layer_sorted)
+    layer_size = np.bincount(layer)
+    x = np.empty(n)
+    x[order] = (np.arange(n) - first - (layer_size[layer_sorted] - 1) / 2) * step
+    y = (layer - layer.max() / 2) * (heights.max() + layer_gap)
+    return x, y.astype(np.float64)
+
+
+# ====================== 力导向布局 ======================
+class _QuadPyramid:
+    """
+    Barnes-Hut 用的四叉树，按层存成网格金字塔。
+
+    第 l 层是 2^l x 2^l 的网格，每个格子记录质量（节点数）和质心，
+    向量化遍历时用 (节点, 格子) 对代替逐节点递归。
+    """
+
+    def __init__(self, pos, depth):
+        self.origin = pos.min(axis=0)
+        self.size = max(float((pos.max(axis=0) - self.origin).max()), 1e-6) * (1 + 1e-9)
+        self.depth = depth
+        self.cells = []
+        self.mass = []
+        self.centroid = []
+        norm = (pos - self.origin) / self.size
+        for level in range(depth + 1):
+            side = 1 << level
+            ij = np.minimum((norm * side).astype(np.int64), side - 1)
+            cell = ij[:, 0] * side + ij[:, 1]
+            mass = np.bincount(cell, minlength=side * side).astype(np.float64)
+            cx = np.bincount(cell, weights=pos[:, 0], minlength=side * side)
+            cy = np.bincount(cell, weights=pos[:, 1], minlength=side * side)
+            safe = np.maximum(mass, 1)
+            self.cells.append(cell)
+            self.mass.append(mass)
+            self.centroid.append(np.stack([cx / safe, cy / safe], axis=1))
+
+    def repulsion(self, pos, k2, theta):
+        """所有节点受到的斥力 k^2 * m / d，远处格子按质心近似，最底层相邻格子精确计算"""
+        n = len(pos)
+        force = np.zeros_like(pos)
+
+        def accumulate(node, delta, mass):
+            dist2 = np.maximum((delta ** 2).sum(axis=1), 1e-2)
+            scale = k2 * mass / dist2
+            force[:, 0] += np.bincount(node, weights=delta[:, 0] * scale, minlength=n)
+            force[:, 1] += np.bincount(node, weights=delta[:, 1] * scale, minlength=n)
+
+        node = np.repeat(np.arange(n), 4)
+        cell = np.tile(np.arange(4), n)
+        for level in range(1, self.depth + 1):
+            mass = self.mass[level][cell]
+            live = mass > 0
+            node, cell, mass = node[live], cell[live], mass[live]
+            own = cell == self.cells[level][node]
+            delta = pos[node] - self.centroid[level][cell]
+            width = self.size / (1 << level)
+            accept = ~own & (width * width < theta * theta * (delta ** 2).sum(axis=1))
+            accumulate(node[accept], delta[accept], mass[accept])
+            node, cell = node[~accept], cell[~accept]
+            if level == self.depth:
+                break
+            # 未被接受的格子展开为下一层的 4 个子格子
+            side = 1 << level
+            ci, cj = cell // side, cell % side
+            child = (((2 * ci)[:, None] + np.array([0, 0, 1, 1])) * (2 * side)
+                     + (2 * cj)[:, None] + np.array([0, 1, 0, 1]))
+            node = np.repeat(node, 4)
+            cell = child.ravel()
+
+        # 最底层仍需展开的格子逐个成员精确计算
+        leaf = self.cells[self.depth]
+        members = np.argsort(leaf, kind="stable")
+        starts = np.searchsorted(leaf[members], cell)
+        counts = self.mass[self.depth][cell].astype(np.int64)
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        other = members[np.repeat(starts, counts) + offsets]
+        node = np.repeat(node, counts)
+        keep = other != node
+        node, other = node[keep], other[keep]
+        accumulate(node, pos[node] - pos[other], np.ones(len(node)))
+        return force
+
+
+def force_directed_layout(n, src, dst, init=None, iterations=150, edge_length=220.0,
+                          theta=1.2, seed=0, callback=None, callback_every=10):
+    """
+    Barnes-Hut 加速的 Fruchterman-Reingold 力导向布局。
+
+    参数:
+        n: 节点数
+        src, dst: 边的起点、终点下标数组
+        init: 初始坐标 (n, 2)，默认随机
+        iterations: 迭代次数
+        edge_length: 理想边长
+        theta: Barnes-Hut 近似阈值，越大越快越粗糙
+        callback: callback(iteration, positions) 用于渐进更新，返回 False 时提前结束
+        callback_every: 每隔多少次迭代回调一次
+
+    返回:
+        (x, y): 节点中心坐标数组
+    """
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    rng = np.random.default_rng(seed)
+    src, dst = _clean_edges(n, src, dst)
+    k = float(edge_length)
+    extent = k * np.sqrt(n)
+    if init is None:
+        pos = rng.uniform(-extent / 2, extent / 2, size=(n, 2))
+    else:
+        pos = np.array(init, dtype=np.float64)
+        # 重合的点会互相抵消斥力，加一点抖动
+        pos += rng.uniform(-1, 1, size=pos.shape)
+    depth = int(np.clip(np.ceil(np.log2(np.sqrt(n))), 2, 10))
+    temperature = extent / 10
+    cooling = temperature / (iterations + 1)
+
+    for iteration in range(iterations):
+        force = _QuadPyramid(pos, depth).repulsion(pos, k * k, theta)
+        if len(src):
+            delta = pos[dst] - pos[src]
+            dist = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 1e-6)
+            pull = delta * (dist / k)[:, None]
+            for axis in (0, 1):
+                force[:, axis] += np.bincount(src, weights=pull[:, axis], minlength=n)
+                force[:, axis] -= np.bincount(dst, weights=pull[:, axis], minlength=n)
+        length = np.maximum(np.sqrt((force ** 2).sum(axis=1)), 1e-9)
+        pos += force * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+        if callback is not None and (iteration + 1) % callback_every == 0:
+            if callback(iteration + 1, pos - pos.mean(axis=0)) is False:
+                break
+    pos -= pos.mean(axis=0)
+    return pos[:, 0].copy(), pos[:, 1].copy()
+
+
+# ====================== 方块定位 ======================
+def position_blocks(blocks, relations, mode="auto", center=CENTER,
+                    spread=SPREAD_RADIUS, spacing=MIN_SPACING):
+    """
+    为 BlockTable 中的方块确定位置，结果写回 blocks.x / blocks.y。
+
+    参数:
+        mode: "auto" 在完全没有坐标且有连线时分层布局，否则只为缺失坐标的方块分散放置；
+              "scatter" 只分散放置缺失的方块；"layered" / "force" 重新布局所有方块
+    """
+    missing = blocks.missing_position()
+    if mode == "auto":
+        mode = "layered" if len(relations) and missing.all() else "scatter"
+
+    if mode in ("layered", "force"):
+        start, end = diagram_io.resolve_endpoints(blocks.ids, relations)
+        n = len(blocks)
+        if mode == "layered":
+            cx, cy = layered_layout(n, start, end, blocks.width, blocks.height)
+        else:
+            init = None
+            if n and not missing.any():
+                init = np.stack([blocks.x + blocks.width / 2, blocks.y + blocks.height / 2], axis=1)
+            cx, cy = force_directed_layout(n, start, end, init=init)
+        blocks.x = cx - blocks.width / 2 + center[0]
+        blocks.y = cy - blocks.height / 2 + center[1]
+    elif missing.any():
+        # 工程文件的坐标列是只读映射，放置前先拷贝
+        blocks.x, blocks.y = blocks.x.copy(), blocks.y.copy()
+        engine = PlacementEngine(center=center, spread=spread, spacing=spacing)
+        place_missing(engine, blocks.x, blocks.y, blocks.width, blocks.height, missing)
+    return blocks
@@ -0,0 +1,289 @@
+import collections
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+import diagram_io
+from clusters import ClusterTree
+
+# 文件命名: snapshot.<代>.fcd 为某一代开始时的完整快照，journal.<代>.log 为此后的操作记录
+SNAPSHOT_NAME = "snapshot.{}.fcd"
+SEGMENT_NAME = "journal.{}.log"
+_FILE_PATTERN = re.compile(r"^(snapshot|journal)\.(\d+)\.(fcd|log)$")
+FSYNC_INTERVAL = 1.0
+
+
+def clusters_op(table):
+    """把 ClusterTable 转换为整体替换分组的日志操作"""
+    return {"op": "clusters",
+            "clusters": [list(row) for row in zip(table.ids.tolist(), table.names.tolist(),
+                                                  table.parents.tolist(),
+                                                  table.collapsed.tolist())],
+            "members": [list(row) for row in zip(table.block_ids.tolist(),
+                                                 table.block_clusters.tolist())]}
+
+
+# ====================== 回放状态 ======================
+class DiagramState:
+    """
+    回放日志用的纯数据图表状态，不依赖 Qt。
+
+    方块以 编号 -> [名称, X, Y, 宽, 高] 保存，连线以 [起始编号, 结束编号, 线型编号] 保存，
+    分组保存在 ClusterTree 中。
+    """
+
+    def __init__(self, blocks=None, relations=None, clusters=None):
+        self.blocks = {}
+        self.connections = []
+        self.clusters = ClusterTree.from_table(clusters)
+        if blocks is not None:
+            for row in zip(blocks.ids.tolist(), blocks.names.tolist(), blocks.x.tolist(),
+                           blocks.y.tolist(), blocks.width.tolist(), blocks.height.tolist()):
+                self.blocks[row[0]] = list(row[1:])
+        if relations is not None:
+            self.connections = [list(row) for row in zip(
+                relations.start.tolist(), relations.end.tolist(), relations.line.tolist())]
+
+    def apply(self, op):
+        kind = op["op"]
+        if kind == "move":
+            for block_id, x, y in op["blocks"]:
+                if block_id in self.blocks:
+                    self.blocks[block_id][1:3] = [x, y]
+        elif kind == "add_block":
+            self.blocks[op["id"]] = [op["name"], op["x"], op["y"], op["w"], op["h"]]
+        elif kind == "remove_block":
+            block_id = op["id"]
+            self.blocks.pop(block_id, None)
+            self.connections = [c for c in self.connections
+                                if c[0] != block_id and c[1] != block_id]
+            self.clusters.remove_blocks([block_id])
+        elif kind == "remove_items":
+            removed = set(op["blocks"])
+            for block_id in removed:
+                self.blocks.pop(block_id, None)
+            # 其余连线按 (起始编号, 结束编号, 线型编号) 逐条删除，重复的连线各删一条
+            targets = collections.Counter(map(tuple, op["connections"]))
+            kept = []
+            for c in self.connections:
+                if c[0] in removed or c[1] in removed:
+                    continue
+                if targets[tuple(c)]:
+                    targets[tuple(c)] -= 1
+                    continue
+                kept.append(c)
+            self.connections = kept
+            self.clusters.remove_blocks(removed)
+        elif kind == "edit":
+            old_id, new_id = op["old_id"], op["id"]
+            row = self.blocks.pop(old_id, None)
+            if row is None:
+                return
+            row[0], row[3], row[4] = op["name"], op["w"], op["h"]
+            self.blocks[new_id] = row
+            if old_id != new_id:
+                self.clusters.rekey_block(old_id, new_id)
+                for c in self.connections:
+                    c[0] = new_id if c[0] == old_id else c[0]
+                    c[1] = new_id if c[1] == old_id else c[1]
+        elif kind == "connect":
+            self.connections.append([op["start"], op["end"], op["line"]])
+        elif kind == "disconnect":
+            self._remove_connection([op["start"], op["end"], op["line"]])
+        elif kind == "line_type":
+            for start, end, old, new in op["connections"]:
+                for c in self.connections:
+                    if c == [start, end, old]:
+                        c[2] = new
+                        break
+        elif kind == "clusters":
+            clusters = op["clusters"]
+            names = np.empty(len(clusters), dtype=object)
+            names[:] = [c[1] for c in clusters]
+            members = np.array(op["members"], dtype=np.int64).reshape(-1, 2)
+            self.clusters = ClusterTree.from_table(diagram_io.ClusterTable(
+                ids=np.array([c[0] for c in clusters], dtype=np.int64), names=names,
+                parents=np.array([c[2] for c in clusters], dtype=np.int64),
+                collapsed=np.array([c[3] for c in clusters], dtype=bool),
+                block_ids=members[:, 0], block_clusters=members[:, 1]))
+        else:
+            raise ValueError(f"未知的日志操作: {kind}")
+
+    def _remove_connection(self, target):
+        for i, c in enumerate(self.connections):
+            if c == target:
+                del self.connections[i]
+                return
+
+    def to_tables(self):
+        """返回 (BlockTable, RelationTable, ClusterTable)"""
+        ids = list(self.blocks)
+        rows = list(self.blocks.values())
+        blocks = diagram_io.BlockTable(
+            ids=np.array(ids, dtype=np.int64),
+            names=np.array([r[0] for r in rows], dtype=object),
+            x=np.array([r[1] for r in rows], dtype=np.float64),
+            y=np.array([r[2] for r in rows], dtype=np.float64),
+            width=np.array([r[3] for r in rows], dtype=np.float64),
+            height=np.array([r[4] for r in rows], dtype=np.float64),
+        )
+        relations = diagram_io.RelationTable(
+            start=np.array([c[0] for c in self.connections], dtype=np.int64),
+            end=np.array([c[1] for c in self.connections], dtype=np.int64),
+            line=np.array([c[2] for c in self.connections], dtype=np.int8),
+        )
+        return blocks, relations, self.clusters.to_table(blocks.ids)
+
+
+# ====================== 操作日志 ======================
+class Journal:
+    """
+    追加写入的操作日志，所有磁盘写入都在后台线程完成。
+
+    compact() 切换到新一代日志并在后台写出快照；快照写完之前旧一代文件保留，
+    任何时刻崩溃都能用 最新快照 + 其后各代日志 恢复。
+    一个目录只能由一个 Journal 使用，compact() 和 discard() 会删除目录中的旧文件。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.generation = max(self._generations(), default=0)
+        self.pending_ops = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- 文件 ----------
+    def _path(self, template, generation):
+        return os.path.join(self.directory, template.format(generation))
+
+    def _files(self):
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            match = _FILE_PATTERN.match(os.path.basename(path))
+            if match:
+                yield match.group(1), int(match.group(2)), path
+
+    def _generations(self):
+        return {generation for _, generation, _ in self._files()}
+
+    # ---------- 恢复 ----------
+    def has_recovery(self):
+        """是否存在上次未正常关闭时留下的快照或日志"""
+        for kind, _, path in self._files():
+            if kind == "snapshot" or os.path.getsize(path) > 0:
+                return True
+        return False
+
+    def recover(self, clusters=False):
+        """
+        用最新的完整快照加上其后的日志回放，返回 (BlockTable, RelationTable)。
+
+        参数:
+            clusters: 为 True 时同时返回 ClusterTable
+        """
+        snapshots = sorted(g for kind, g, _ in self._files() if kind == "snapshot")
+        segments = sorted(g for kind, g, _ in self._files() if kind == "journal")
+        state = DiagramState()
+        base = 0
+        if snapshots:
+            base = snapshots[-1]
+            state = DiagramState(*diagram_io.read_native(self._path(SNAPSHOT_NAME, base),
+                                                         clusters=True))
+        for generation in segments:
+            if generation < base:
+                continue
+            with open(self._path(SEGMENT_NAME, generation), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能没有写完整
+                        break
+                    state.apply(op)
+        tables = state.to_tables()
+        return tables if clusters else tables[:2]
+
+    # ---------- 写入 ----------
+    def append(self, op):
+        """记录一条操作，立即返回"""
+        self.pending_ops += 1
+        self._queue.put(("op", json.dumps(op, ensure_ascii=False)))
+
+    def compact(self, blocks, relations, clusters=None):
+        """以给定的当前状态开始新一代日志，快照在后台写出后删除旧文件"""
+        self.generation += 1
+        self.pending_ops = 0
+        self._queue.put(("rotate", self.generation))
+        self._queue.put(("snapshot", self.generation, blocks, relations, clusters))
+
+    def discard(self):
+        """正常关闭时删除目录中的全部日志和快照，目录随之变空时一并删除"""
+        self._queue.put(("discard",))
+        self.close()
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    def close(self):
+        """写完已排队的内容后停止后台线程，文件全部保留"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def flush(self):
+        """等待已排队的写入全部完成"""
+        done = threading.Event()
+        self._queue.put(("event", done))
+        done.wait()
+
+    def _run(self):
+        segment = None
+        current = self.generation
+        last_sync = time.monotonic()
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            kind = task[0]
+            if kind == "op":
+                if segment is None:
+                    segment = open(self._path(SEGMENT_NAME, current), "a", encoding="utf-8")
+                segment.write(task[1] + "\n")
+            elif kind == "rotate":
+                if segment is not None:
+                    segment.close()
+                current = task[1]
+                segment = open(self._path(SEGMENT_NAME, current), "a", encoding="utf-8")
+            elif kind == "snapshot":
+                _, generation, blocks, relations, clusters = task
+                diagram_io.write_native(self._path(SNAPSHOT_NAME, generation), blocks, relations,
+                                        clusters)
+                for _, old, path in list(self._files()):
+                    if old < generation:
+                        os.remove(path)
+            elif kind == "discard":
+                if segment is not None:
+                    segment.close()
+                    segment = None
+                for _, _, path in list(self._files()):
+                    os.remove(path)
+            elif kind == "event":
+                if segment is not None:
+                    segment.flush()
+                task[1].set()
+
+            # 队列空闲时落盘，fsync 限频
+            if segment is not None and self._queue.empty():
+                segment.flush()
+                now = time.monotonic()
+                if now - last_sync >= FSYNC_INTERVAL:
+                    os.fsync(segment.fileno())
+                    last_sync = now
+        if segment is not None:
+            segment.close()
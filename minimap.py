@@ -0,0 +1,327 @@
+import numpy as np
+
+# 位图按调色板编号保存：0 为背景，1~4 为线型编号（与 LineType.to_number 一致），5 为方块；
+# 颜色与编辑器一致，即 LineType.get_color
+BACKGROUND = 0
+BLOCK = 5
+PALETTE = np.array([[255, 255, 255], [255, 0, 0], [255, 204, 0], [0, 255, 0], [0, 0, 0],
+                    [173, 216, 230]], dtype=np.uint8)
+# 脏标记的网格边长（像素）
+TILE_SIZE = 32
+# 连线按像素逐点采样，每批最多处理的采样点数
+SAMPLE_BATCH = 1 << 20
+
+
+# ====================== 光栅化 ======================
+def _fill_rects(tile, x0, y0, x1, y1, color):
+    """
+    用二维差分数组填充一组像素矩形（闭区间，坐标相对 tile，已裁剪到 tile 内）。
+    """
+    height, width = tile.shape
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.add.at(diff, (y0, x0), 1)
+    np.add.at(diff, (y0, x1 + 1), -1)
+    np.add.at(diff, (y1 + 1, x0), -1)
+    np.add.at(diff, (y1 + 1, x1 + 1), 1)
+    tile[diff.cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0] = color
+
+
+def _draw_lines(tile, ax, ay, bx, by, colors):
+    """
+    按像素逐点采样绘制线段（坐标相对 tile），后面的线段覆盖前面的。
+
+    采样点按整条线段的长度等分，只生成落在 tile 附近的那一段，
+    因此同一条线段在不同窗口中画出的像素与整张绘制时一致。
+    """
+    height, width = tile.shape
+    flat = tile.reshape(-1)
+    dx, dy = bx - ax, by - ay
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+    # Liang-Barsky 裁剪到外扩一个像素的窗口，得到参数区间 [t0, t1]
+    t0 = np.zeros(len(ax))
+    t1 = np.ones(len(ax))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, ax + 1), (dx, width - ax), (-dy, ay + 1), (dy, height - ay)):
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+            t1 = np.where((p == 0) & (q < 0), -1.0, t1)
+    first = np.maximum(np.floor(t0 * steps).astype(np.int64) - 1, 0)
+    last = np.minimum(np.ceil(t1 * steps).astype(np.int64) + 1, steps)
+    keep = last >= first
+    ax, ay, dx, dy, colors = ax[keep], ay[keep], dx[keep], dy[keep], colors[keep]
+    steps, first = steps[keep], first[keep]
+    samples = last[keep] - first + 1
+    ends = np.cumsum(samples)
+    lo = 0
+    while lo < len(samples):
+        # 每批取到采样点累计数超过 SAMPLE_BATCH 为止，至少一条
+        base = ends[lo - 1] if lo else 0
+        hi = max(lo + 1, int(np.searchsorted(ends, base + SAMPLE_BATCH, side="right")))
+        k = samples[lo:hi]
+        edge = np.repeat(np.arange(lo, hi), k)
+        j = np.arange(int(k.sum())) - np.repeat(ends[lo:hi] - k - base, k) + first[edge]
+        t = j / np.maximum(steps, 1)[edge]
+        px = np.floor(ax[edge] + t * dx[edge] + 0.5).astype(np.int64)
+        py = np.floor(ay[edge] + t * dy[edge] + 0.5).astype(np.int64)
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        flat[py[inside] * width + px[inside]] = colors[edge[inside]]
+        lo = hi
+
+
+# ====================== 小地图位图 ======================
+class MinimapRaster:
+    """
+    整张图表的低分辨率位图，直接由 DiagramModel 的数组光栅化，不经过图元。
+
+    pixels 为 (高, 宽) 的调色板编号数组，长边为 size 像素，rgb() 换算为颜色。修改通过 mark 按场景矩形
+    标记到 TILE_SIZE 的网格上，refresh 只重画被标记的网格；标记超出覆盖范围或
+    调用 invalidate 后整张重画，并按当前图表重新确定覆盖范围。
+
+    连线超过 edge_limit 条时按 uid 等间隔抽样绘制，抽样间隔在整张重画时确定，
+    局部重画与整张重画画出的连线相同。
+    """
+
+    def __init__(self, size=512, margin=0.05, edge_limit=20000):
+        self.size = size
+        self.margin = margin
+        self.edge_limit = edge_limit
+        self.edge_step = 1
+        self.origin = (0.0, 0.0)
+        self.scale = 1.0
+        self.pixels = np.zeros((1, 1), dtype=np.uint8)
+        self.stale = True
+        self._dirty = np.zeros((1, 1), dtype=bool)
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    def rgb(self):
+        return PALETTE[self.pixels]
+
+    def scene_rect(self):
+        """位图覆盖的场景范围 (x0, y0, x1, y1)"""
+        x0, y0 = self.origin
+        return x0, y0, x0 + self.width / self.scale, y0 + self.height / self.scale
+
+    def to_pixels(self, x, y):
+        return (np.asarray(x) - self.origin[0]) * self.scale, (np.asarray(y) - self.origin[1]) * self.scale
+
+    def to_scene(self, px, py):
+        return self.origin[0] + px / self.scale, self.origin[1] + py / self.scale
+
+    # ---------- 脏标记 ----------
+    def invalidate(self):
+        self.stale = True
+
+    def mark(self, x0, y0, x1, y1):
+        """
+        标记一组场景矩形需要重画。
+
+        参数:
+            x0, y0, x1, y1: 矩形四边的数组（或单个数值）
+        """
+        if self.stale:
+            return
+        x0, y0, x1, y1 = (np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x0, y0, x1, y1))
+        if not len(x0):
+            return
+        sx0, sy0, sx1, sy1 = self.scene_rect()
+        if x0.min() < sx0 or y0.min() < sy0 or x1.max() > sx1 or y1.max() > sy1:
+            self.stale = True
+            return
+        # 多留一个像素，抗锯齿取整时的边缘也被覆盖
+        (px0, py0), (px1, py1) = self.to_pixels(x0, y0), self.to_pixels(x1, y1)
+        rows, cols = self._dirty.shape
+        c0 = np.clip((px0 - 1) // TILE_SIZE, 0, cols - 1).astype(np.int64)
+        c1 = np.clip((px1 + 1) // TILE_SIZE, 0, cols - 1).astype(np.int64)
+        r0 = np.clip((py0 - 1) // TILE_SIZE, 0, rows - 1).astype(np.int64)
+        r1 = np.clip((py1 + 1) // TILE_SIZE, 0, rows - 1).astype(np.int64)
+        diff = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+        np.add.at(diff, (r0, c0), 1)
+        np.add.at(diff, (r0, c1 + 1), -1)
+        np.add.at(diff, (r1 + 1, c0), -1)
+        np.add.at(diff, (r1 + 1, c1 + 1), 1)
+        self._dirty |= diff.cumsum(axis=0).cumsum(axis=1)[:rows, :cols] > 0
+
+    def mark_moved(self, model, rows, old_x, old_y):
+        """
+        标记移动的方块：新旧位置以及与它们相连的连线新旧两段经过的网格。
+
+        参数:
+            model: 已写入新位置的 DiagramModel
+            rows: 移动的方块行号
+            old_x, old_y: 移动前的左上角坐标
+        """
+        if self.stale:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        old_x = np.asarray(old_x, dtype=np.float64)
+        old_y = np.asarray(old_y, dtype=np.float64)
+        width, height = model.width[rows], model.height[rows]
+        self.mark(np.concatenate([old_x, model.x[rows]]), np.concatenate([old_y, model.y[rows]]),
+                  np.concatenate([old_x + width, model.x[rows] + width]),
+                  np.concatenate([old_y + height, model.y[rows] + height]))
+        if not model.n_edges:
+            return
+        moved = np.zeros(len(model), dtype=bool)
+        moved[rows] = True
+        start, end = model.edge_rows()
+        incident = (moved[start] | moved[end]) & self._shown_edges(model)
+        if not incident.any():
+            return
+        cx, cy = model.centers()
+        old_cx, old_cy = cx.copy(), cy.copy()
+        old_cx[rows] = old_x + width / 2
+        old_cy[rows] = old_y + height / 2
+        start, end = start[incident], end[incident]
+        for xs, ys in ((cx, cy), (old_cx, old_cy)):
+            self.mark_segments(xs[start], ys[start], xs[end], ys[end])
+            if self.stale:
+                return
+
+    def mark_segments(self, ax, ay, bx, by):
+        """
+        标记一组场景线段经过的网格。
+
+        长连线的外接矩形往往覆盖大半张图，这里沿线段每隔半个网格取一点，
+        标记所在网格及其相邻网格，取整误差落到相邻网格中的像素也会被重画。
+        """
+        if self.stale:
+            return
+        ax, ay, bx, by = (np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (ax, ay, bx, by))
+        if not len(ax):
+            return
+        sx0, sy0, sx1, sy1 = self.scene_rect()
+        if (min(ax.min(), bx.min()) < sx0 or min(ay.min(), by.min()) < sy0
+                or max(ax.max(), bx.max()) > sx1 or max(ay.max(), by.max()) > sy1):
+            self.stale = True
+            return
+        (pax, pay), (pbx, pby) = self.to_pixels(ax, ay), self.to_pixels(bx, by)
+        steps = np.ceil(np.maximum(np.abs(pbx - pax), np.abs(pby - pay)) / (TILE_SIZE / 2))
+        steps = steps.astype(np.int64) + 1
+        owner = np.repeat(np.arange(len(ax)), steps)
+        t = (np.arange(len(owner)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps - 1, steps).clip(1)
+        rows, cols = self._dirty.shape
+        col = ((pax[owner] + (pbx - pax)[owner] * t) // TILE_SIZE).astype(np.int64)
+        row = ((pay[owner] + (pby - pay)[owner] * t) // TILE_SIZE).astype(np.int64)
+        hit = np.zeros((rows + 2, cols + 2), dtype=bool)
+        hit[np.clip(row, -1, rows) + 1, np.clip(col, -1, cols) + 1] = True
+        # 向四周扩展一格
+        grown = hit.copy()
+        grown[1:] |= hit[:-1]
+        grown[:-1] |= hit[1:]
+        hit = grown.copy()
+        grown[:, 1:] |= hit[:, :-1]
+        grown[:, :-1] |= hit[:, 1:]
+        self._dirty |= grown[1:-1, 1:-1]
+
+    def _shown_edges(self, model):
+        if self.edge_step == 1:
+            return np.ones(model.n_edges, dtype=bool)
+        return model.edge_uid % self.edge_step == 0
+
+    def dirty_fraction(self):
+        return float(self._dirty.mean()) if not self.stale else 1.0
+
+    # ---------- 重画 ----------
+    def refresh(self, model, full_ratio=0.3):
+        """
+        重画需要更新的部分，返回是否有像素改变。
+
+        参数:
+            full_ratio: 脏网格超过这一比例时整张重画
+        """
+        if self.stale or self.dirty_fraction() > full_ratio:
+            self.rebuild(model)
+            return True
+        if not self._dirty.any():
+            return False
+        self._redraw_dirty(model)
+        return True
+
+    def rebuild(self, model):
+        """按当前图表重新确定覆盖范围并整张重画"""
+        bounds = model.bounds()
+        x0, y0, x1, y1 = bounds if bounds is not None else (-500.0, -500.0, 500.0, 500.0)
+        span = max(x1 - x0, y1 - y0, 1.0)
+        pad = span * self.margin
+        x0, y0, x1, y1 = x0 - pad, y0 - pad, x1 + pad, y1 + pad
+        self.scale = self.size / max(x1 - x0, y1 - y0)
+        width = max(1, int(np.ceil((x1 - x0) * self.scale)))
+        height = max(1, int(np.ceil((y1 - y0) * self.scale)))
+        self.origin = (x0, y0)
+        self.edge_step = max(1, -(-model.n_edges // self.edge_limit))
+        self.pixels = np.empty((height, width), dtype=np.uint8)
+        self._dirty = np.zeros((-(-height // TILE_SIZE), -(-width // TILE_SIZE)), dtype=bool)
+        self.stale = False
+        self._draw(model, [(0, 0, width, height)])
+
+    def _redraw_dirty(self, model):
+        # 每行网格中连续的脏网格合并成一个窗口
+        windows = []
+        for r, row in enumerate(self._dirty):
+            cols = np.flatnonzero(row)
+            if not len(cols):
+                continue
+            breaks = np.flatnonzero(np.diff(cols) > 1)
+            for first, last in zip(np.r_[cols[0], cols[breaks + 1]], np.r_[cols[breaks], cols[-1]]):
+                windows.append((int(first) * TILE_SIZE, r * TILE_SIZE,
+                                min(int(last + 1) * TILE_SIZE, self.width),
+                                min((r + 1) * TILE_SIZE, self.height)))
+        self._dirty[:] = False
+        self._draw(model, windows)
+
+    def _draw(self, model, windows):
+        """
+        重画一组像素窗口 (px0, py0, px1, py1)。
+
+        先按全部窗口的外接范围挑出方块和连线并换算为像素坐标，每个窗口再从中筛选。
+        """
+        px0 = min(w[0] for w in windows)
+        py0 = min(w[1] for w in windows)
+        px1 = max(w[2] for w in windows)
+        py1 = max(w[3] for w in windows)
+        sx0, sy0 = self.to_scene(px0 - 1, py0 - 1)
+        sx1, sy1 = self.to_scene(px1 + 1, py1 + 1)
+
+        blocks = np.flatnonzero(model.blocks_in(sx0, sy0, sx1, sy1))
+        bx0, by0 = self.to_pixels(model.x[blocks], model.y[blocks])
+        bx1, by1 = self.to_pixels(model.x[blocks] + model.width[blocks],
+                                  model.y[blocks] + model.height[blocks])
+        bx0, by0 = np.floor(bx0).astype(np.int64), np.floor(by0).astype(np.int64)
+        bx1, by1 = np.floor(bx1).astype(np.int64), np.floor(by1).astype(np.int64)
+
+        if model.n_edges:
+            edges = np.flatnonzero(model.edges_through(sx0, sy0, sx1, sy1) & self._shown_edges(model))
+            # 线条多的线型最后画，重叠处显示更粗的线型
+            edges = edges[np.argsort(-model.edge_line[edges], kind="stable")]
+            start, end = model.edge_rows()
+            cx, cy = model.centers()
+            ax, ay = self.to_pixels(cx[start[edges]], cy[start[edges]])
+            ex, ey = self.to_pixels(cx[end[edges]], cy[end[edges]])
+            colors = model.edge_line[edges].astype(np.uint8)
+        else:
+            ax = ay = ex = ey = np.zeros(0)
+            colors = np.zeros(0, dtype=np.uint8)
+
+        for wx0, wy0, wx1, wy1 in windows:
+            # 局部窗口的切片不连续，画在连续的数组上再写回
+            tile = np.full((wy1 - wy0, wx1 - wx0), BACKGROUND, dtype=np.uint8)
+            if len(ax):
+                hit = ((np.minimum(ax, ex) <= wx1) & (np.maximum(ax, ex) >= wx0 - 1)
+                       & (np.minimum(ay, ey) <= wy1) & (np.maximum(ay, ey) >= wy0 - 1))
+                _draw_lines(tile, ax[hit] - wx0, ay[hit] - wy0, ex[hit] - wx0, ey[hit] - wy0,
+                            colors[hit])
+            hit = (bx0 < wx1) & (bx1 >= wx0) & (by0 < wy1) & (by1 >= wy0)
+            if hit.any():
+                h, w = tile.shape
+                _fill_rects(tile, np.clip(bx0[hit] - wx0, 0, w - 1), np.clip(by0[hit] - wy0, 0, h - 1),
+                            np.clip(bx1[hit] - wx0, 0, w - 1), np.clip(by1[hit] - wy0, 0, h - 1),
+                            BLOCK)
+            self.pixels[wy0:wy1, wx0:wx1] = tile
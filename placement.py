@@ -0,0 +1,132 @@
+import math
+import random
+
+
+# ====================== 均匀网格空间索引 ======================
+class GridIndex:
+    """
+    已放置矩形的均匀网格索引。
+
+    每个矩形登记到它覆盖的所有网格单元中，重叠检测只需要检查
+    查询区域覆盖的少数几个单元，与已放置矩形的总数无关。
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.rects = []
+
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return (math.floor(x0 / size), math.floor(y0 / size),
+                math.floor(x1 / size), math.floor(y1 / size))
+
+    def insert(self, x, y, width, height):
+        index = len(self.rects)
+        self.rects.append((x, y, width, height))
+        cx0, cy0, cx1, cy1 = self._cell_range(x, y, x + width, y + height)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells.setdefault((cx, cy), []).append(index)
+        return index
+
+    def intersects(self, x, y, width, height, spacing=0):
+        """与 is_overlapping 判定规则一致，但只检查附近的网格单元"""
+        cx0, cy0, cx1, cy1 = self._cell_range(x - spacing, y - spacing,
+                                              x + width + spacing, y + height + spacing)
+        rects = self.rects
+        cells = self.cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for index in cells.get((cx, cy), ()):
+                    px, py, pw, ph = rects[index]
+                    if not (x + width < px - spacing or
+                            x > px + pw + spacing or
+                            y + height < py - spacing or
+                            y > py + ph + spacing):
+                        return True
+        return False
+
+    def __len__(self):
+        return len(self.rects)
+
+
+# ====================== 散布放置引擎 ======================
+class PlacementEngine:
+    """
+    在中心点周围为模块寻找不重叠位置的放置引擎。
+
+    参数:
+        center: 分布中心点 (x, y)
+        spread: 初始随机分布范围（半径）
+        spacing: 模块之间最小间距
+        attempts: 每个半径下的采样次数，全部失败后扩大半径
+        growth: 半径扩大倍数
+        fill_ratio: 期望的面积占用率，布局变满时半径随之增长
+        rng: 随机数生成器，默认使用 random 模块
+    """
+
+    def __init__(self, center=(0, 0), spread=1000, spacing=200,
+                 attempts=30, growth=1.25, fill_ratio=0.3, rng=None):
+        self.center = center
+        self.spread = max(int(spread), 1)
+        self.spacing = spacing
+        self.attempts = attempts
+        self.growth = growth
+        self.fill_ratio = fill_ratio
+        self.rng = rng if rng is not None else random
+        self.index = None
+        self._occupied_area = 0.0
+
+    def _ensure_index(self, width, height):
+        if self.index is None:
+            self.index = GridIndex(max(width, height, 1) + self.spacing)
+
+    def add(self, x, y, width, height):
+        """登记一个已经确定位置的矩形"""
+        self._ensure_index(width, height)
+        self.index.insert(x, y, width, height)
+        self._occupied_area += (width + self.spacing) * (height + self.spacing)
+
+    def _required_spread(self):
+        # 按当前占用面积估算需要的半径，使采样命中空位的概率保持稳定
+        return int(math.sqrt(self._occupied_area / self.fill_ratio) / 2)
+
+    def place(self, width, height):
+        """返回一个不与已放置矩形重叠的 (x, y)，并把它登记到索引中"""
+        cx, cy = self.center
+        # 第一个模块直接放在中心
+        if self.index is None or not len(self.index):
+            self.add(cx, cy, width, height)
+            return cx, cy
+
+        self.spread = max(self.spread, self._required_spread())
+        randint = self.rng.randint
+        intersects = self.index.intersects
+        while True:
+            spread = self.spread
+            for _ in range(self.attempts):
+                x = cx + randint(-spread, spread)
+                y = cy + randint(-spread, spread)
+                if not intersects(x, y, width, height, self.spacing):
+                    self.add(x, y, width, height)
+                    return x, y
+            # 当前范围内找不到空位，扩大分布半径后重试
+            self.spread = int(spread * self.growth) + 1
+
+
+def place_missing(engine, x, y, width, height, missing):
+    """
+    为 missing 标记的模块分配位置，结果直接写回 x / y 数组。
+
+    已有坐标的模块先全部登记到引擎中，避免新放置的模块压在它们上面。
+    """
+    missing = list(missing)
+    widths = list(width)
+    heights = list(height)
+    for i, is_missing in enumerate(missing):
+        if not is_missing:
+            engine.add(float(x[i]), float(y[i]), widths[i], heights[i])
+    for i, is_missing in enumerate(missing):
+        if is_missing:
+            x[i], y[i] = engine.place(widths[i], heights[i])
@@ -0,0 +1,110 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 压缩数据每攒够这么多字节写出一个 IDAT 块
+IDAT_CHUNK_SIZE = 1 << 20
+# 每次交给压缩器的原始数据量
+WRITE_BATCH_BYTES = 4 << 20
+PNG_MAX_SIDE = (1 << 31) - 1
+
+
+def _chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+# ====================== 流式 PNG ======================
+class PngStreamWriter:
+    """
+    按行分批写出的 PNG 文件，内存中只保留当前一批像素和压缩器状态。
+
+    参数:
+        path: 输出文件
+        width, height: 图片尺寸
+        channels: 3 为 RGB，4 为 RGBA，每通道 8 位
+    """
+
+    def __init__(self, path, width, height, channels=3, level=6):
+        if not (0 < width <= PNG_MAX_SIDE and 0 < height <= PNG_MAX_SIDE):
+            raise ValueError(f"图片尺寸无效: {width} x {height}")
+        if channels not in (3, 4):
+            raise ValueError(f"不支持的通道数: {channels}")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(level)
+        self._pending = []
+        self._pending_size = 0
+        self._file = open(path, "wb")
+        color_type = 2 if channels == 3 else 6
+        self._file.write(PNG_SIGNATURE)
+        self._file.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type,
+                                                     0, 0, 0)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_rows(self, pixels):
+        """
+        追加若干行像素。
+
+        参数:
+            pixels: 形状为 (行数, width, channels) 的 uint8 数组
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.shape[1:] != (self.width, self.channels):
+            raise ValueError(f"像素数组形状不匹配: {pixels.shape}")
+        if self.rows_written + len(pixels) > self.height:
+            raise ValueError("写入的行数超过图片高度")
+        # 每行前加一个过滤类型字节 0（不过滤），分批拼接以免整批复制
+        stride = self.width * self.channels + 1
+        step = max(1, WRITE_BATCH_BYTES // stride)
+        for i in range(0, len(pixels), step):
+            batch = pixels[i:i + step]
+            rows = np.zeros((len(batch), stride), dtype=np.uint8)
+            rows[:, 1:] = batch.reshape(len(batch), -1)
+            self._emit(self._compressor.compress(rows.data))
+        self.rows_written += len(pixels)
+
+    def _emit(self, data, final=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= IDAT_CHUNK_SIZE or (final and self._pending):
+            self._file.write(_chunk(b"IDAT", b"".join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f"只写入了 {self.rows_written} / {self.height} 行")
+        self._emit(self._compressor.flush(), final=True)
+        self._file.write(_chunk(b"IEND", b""))
+        self._file.close()
+        self._file = None
+
+    def abort(self):
+        """放弃写入并删除未完成的文件"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
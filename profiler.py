@@ -0,0 +1,273 @@
+import collections
+import functools
+import json
+import threading
+import time
+
+# 跟踪记录最多保留的事件数，超出后丢弃最早的事件
+TRACE_LIMIT = 500000
+# 计算帧率时保留的最近帧数
+FRAME_HISTORY = 240
+
+
+class SpanStats:
+    """同一名称的计时汇总，时间单位为纳秒"""
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "label", "start")
+
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.label, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class _Frame(_Span):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.end_frame(self.start)
+        return False
+
+
+# ====================== 性能剖析 ======================
+class Profiler:
+    """
+    热点函数的计时、计数和跟踪记录。
+
+    通过 instrument 登记要计时的函数，enable 时才把它们替换为计时包装，
+    disable 后恢复原函数，关闭状态下热点路径没有任何额外开销。
+    """
+
+    def __init__(self, trace_limit=TRACE_LIMIT):
+        self.enabled = False
+        self.stats = {}
+        self.trace = collections.deque(maxlen=trace_limit)
+        # 自上一帧结束以来各名称的调用次数
+        self.frame_counts = collections.Counter()
+        self.last_frame = {}
+        self.last_frame_ns = 0
+        self._frame_times = collections.deque(maxlen=FRAME_HISTORY)
+        self._targets = []
+        self._originals = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def instrument(self, owner, name, label=None):
+        """
+        登记 owner（类或模块）上名为 name 的函数，label 默认为 "类名.函数名"。
+        """
+        label = label or f"{getattr(owner, '__name__', owner)}.{name}"
+        self._targets.append((owner, name, label))
+        if self.enabled:
+            self._patch(owner, name, label)
+
+    def _patch(self, owner, name, label):
+        key = (owner, name)
+        if key in self._originals:
+            return
+        func = getattr(owner, name)
+        self._originals[key] = func
+        setattr(owner, name, self._timed(label, func))
+
+    def _timed(self, label, func):
+        clock = time.perf_counter_ns
+        record = self.record
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(label, start, clock() - start)
+        return wrapper
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, name, label in self._targets:
+            self._patch(owner, name, label)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for (owner, name), func in self._originals.items():
+            setattr(owner, name, func)
+        self._originals = {}
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.trace.clear()
+            self.frame_counts.clear()
+            self.last_frame = {}
+            self.last_frame_ns = 0
+            self._frame_times.clear()
+
+    # ---------- 记录 ----------
+    def record(self, label, start, duration):
+        """记录一次耗时，start 和 duration 为 perf_counter_ns 的纳秒值"""
+        with self._lock:
+            stats = self.stats.get(label)
+            if stats is None:
+                stats = self.stats[label] = SpanStats()
+            stats.add(duration)
+            self.frame_counts[label] += 1
+            self.trace.append((label, start, duration, threading.get_ident()))
+
+    def span(self, label):
+        """
+        为一段代码计时的上下文管理器，关闭时返回空操作对象。
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, label)
+
+    # ---------- 帧 ----------
+    def frame(self):
+        """把一次视口重绘记为一帧的上下文管理器，关闭时返回空操作对象"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Frame(self, "frame")
+
+    def end_frame(self, start):
+        """
+        结束一帧绘制：记录帧耗时，把本帧的调用次数存入 last_frame 并清零。
+
+        参数:
+            start: 本帧开始时的 perf_counter_ns
+        """
+        now = time.perf_counter_ns()
+        self.record("frame", start, now - start)
+        with self._lock:
+            self.last_frame = dict(self.frame_counts)
+            self.frame_counts.clear()
+            self.last_frame_ns = now - start
+            self._frame_times.append(now)
+
+    def fps(self, window=1.0):
+        """最近 window 秒内的绘制帧率"""
+        times = self._frame_times
+        if not times:
+            return 0.0
+        since = time.perf_counter_ns() - int(window * 1e9)
+        return sum(1 for t in times if t >= since) / window
+
+    def top(self, k=5):
+        """累计耗时最多的 k 个名称，返回 [(名称, SpanStats)]"""
+        with self._lock:
+            items = [(label, stats) for label, stats in self.stats.items() if label != "frame"]
+        items.sort(key=lambda item: item[1].total, reverse=True)
+        return items[:k]
+
+    # ---------- 导出 ----------
+    def chrome_trace(self):
+        """
+        Chrome 跟踪格式（chrome://tracing、Perfetto 可直接打开）的事件字典。
+        """
+        with self._lock:
+            trace = list(self.trace)
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        origin = self._origin
+        events = [{"name": label, "cat": label.split(".", 1)[0], "ph": "X", "pid": 1, "tid": tid,
+                   "ts": (start - origin) / 1000, "dur": duration / 1000}
+                  for label, start, duration, tid in trace]
+        for tid in {event["tid"] for event in events}:
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": names.get(tid, f"thread-{tid}")}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+        return len(self.trace)
+
+
+# 全局剖析器，界面中的热点函数登记在它上面
+PROFILER = Profiler()
+
+
+# ====================== 启动计时 ======================
+class StartupTimer:
+    """
+    记录程序启动各阶段完成的时刻，起点为本模块被导入的时刻。
+
+    when_done 登记需要等待的阶段，全部到达后调用回调一次。
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.marks = []
+        self._waiting = set()
+        self._callback = None
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+        self._waiting.discard(name)
+        if not self._waiting and self._callback is not None:
+            callback, self._callback = self._callback, None
+            callback()
+
+    def when_done(self, names, callback):
+        self._waiting = set(names) - {name for name, _ in self.marks}
+        self._callback = callback
+        if not self._waiting:
+            self._callback = None
+            callback()
+
+    def elapsed_ms(self):
+        """到最后一个阶段为止的总耗时"""
+        if not self.marks:
+            return 0.0
+        return (self.marks[-1][1] - self.origin) * 1000
+
+    def report(self, budget_ms=None):
+        lines = ["启动耗时（自导入程序起）:"]
+        previous = self.origin
+        for name, moment in self.marks:
+            lines.append(f"  {name:<12} {(moment - self.origin) * 1000:8.1f} ms"
+                         f"  (+{(moment - previous) * 1000:.1f})")
+            previous = moment
+        total = f"总计 {self.elapsed_ms():.1f} ms"
+        if budget_ms is not None:
+            over = self.elapsed_ms() > budget_ms
+            total += f"，{'超出' if over else '未超出'}预算 {budget_ms} ms"
+        lines.append(total)
+        return "\n".join(lines)
+
+
+STARTUP = StartupTimer()
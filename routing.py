@@ -0,0 +1,698 @@
+import math
+
+import numpy as np
+
+STRAIGHT = "straight"
+ORTHOGONAL = "orthogonal"
+BUNDLED = "bundled"
+ROUTING_MODES = (STRAIGHT, ORTHOGONAL, BUNDLED)
+
+ROUTE_MARGIN = 12        # 正交线路与方块之间保留的距离
+BEND_PENALTY = 40        # 每个拐弯折算的长度
+CROSS_PENALTY = 100000   # 穿过一个方块折算的长度
+ROUTE_ROUNDS = 2         # 绕开障碍的候选通道迭代次数
+ROUTE_BLOCKERS = 4       # 每轮只在最先挡路的几个障碍两侧开辟通道
+SEARCH_LIMIT = 20000     # 候选线路都被挡住时在网格上搜索，区域内障碍超过这个数量时放弃
+SEARCH_LINES = 64        # 搜索网格每个方向最多的网格线数，过密的网格线按区间合并
+BUNDLE_CELL = 400        # 捆绑层次（四叉树）最细一层的网格尺寸
+BUNDLE_STRENGTH = 0.85   # 捆绑强度 beta，0 为直线
+BUNDLE_SMOOTHING = 2     # Chaikin 平滑次数
+GRID_REBUILD_LIMIT = 256 # 索引建立后变化的方块超过这个数量时重建
+CROSSING_CHECK_LIMIT = 64  # 一次变化的方块更多时，所有正交线路都失效
+
+
+# ====================== 障碍索引 ======================
+class ObstacleGrid:
+    """
+    方块矩形的静态网格索引，按中心所在单元排序存放行号。
+
+    同一列的单元在排序后连续，区域查询每列只需要一次二分查找。
+    超过单元尺寸的方块不进网格，查询时总是返回。
+    """
+
+    def __init__(self, rects):
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        self.n_rows = len(rects)
+        x, y, w, h = rects.T
+        size = np.maximum(w, h)
+        self.cell = float(max(4 * np.median(size), 64.0)) if len(rects) else 64.0
+        small = size <= self.cell
+        self.oversize = np.flatnonzero(~small)
+        rows = np.flatnonzero(small)
+        cx = np.floor((x[rows] + w[rows] / 2) / self.cell).astype(np.int64)
+        cy = np.floor((y[rows] + h[rows] / 2) / self.cell).astype(np.int64)
+        self.origin = (int(cx.min(initial=0)), int(cy.min(initial=0)))
+        self.span = (int(cx.max(initial=0)) - self.origin[0] + 1,
+                     int(cy.max(initial=0)) - self.origin[1] + 1)
+        keys = (cx - self.origin[0]) * self.span[1] + (cy - self.origin[1])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rows = rows[order]
+
+    def query(self, x0, y0, x1, y1):
+        """中心可能落在区域内的方块行号（未去重、未精确判定）"""
+        pad = self.cell / 2
+        ox, oy = self.origin
+        cx0 = max(math.floor((x0 - pad) / self.cell) - ox, 0)
+        cx1 = min(math.floor((x1 + pad) / self.cell) - ox, self.span[0] - 1)
+        cy0 = max(math.floor((y0 - pad) / self.cell) - oy, 0)
+        cy1 = min(math.floor((y1 + pad) / self.cell) - oy, self.span[1] - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return self.oversize
+        columns = np.arange(cx0, cx1 + 1, dtype=np.int64) * self.span[1]
+        lo = np.searchsorted(self.keys, columns + cy0)
+        hi = np.searchsorted(self.keys, columns + cy1, side="right")
+        counts = hi - lo
+        total = int(counts.sum())
+        if not total:
+            return self.oversize
+        offsets = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        return np.concatenate([self.rows[offsets + np.arange(total)], self.oversize])
+
+
+def _obstacles_in(grid, stale, rects, x0, y0, x1, y1):
+    """与区域相交的方块行号，stale 为索引建立之后位置或尺寸变化过的行"""
+    rows = grid.query(x0, y0, x1, y1)
+    if stale:
+        rows = np.unique(np.concatenate([rows, np.fromiter(stale, dtype=np.int64)]))
+    r = rects[rows]
+    hit = ((r[:, 0] <= x1) & (r[:, 0] + r[:, 2] >= x0)
+           & (r[:, 1] <= y1) & (r[:, 1] + r[:, 3] >= y0))
+    return rows[hit]
+
+
+# ====================== 正交路由 ======================
+def _route_length(points):
+    """长度加拐弯折算，不考虑障碍"""
+    length = sum(abs(x1 - x0) + abs(y1 - y0)
+                 for (x0, y0), (x1, y1) in zip(points[:-1], points[1:]))
+    return length + BEND_PENALTY * (len(points) - 2)
+
+
+def _crossings(candidates, obstacles, margin):
+    """返回 (n_candidates, n_obstacles) 布尔矩阵：每条候选线路穿过了哪些障碍"""
+    if not len(obstacles):
+        return np.zeros((len(candidates), 0), dtype=bool)
+    # 全部候选的线段一次性判定；线段都是水平或竖直的，与收缩后的障碍矩形做区间相交
+    a = np.array([p for points in candidates for p in points[:-1]], dtype=np.float64)
+    b = np.array([p for points in candidates for p in points[1:]], dtype=np.float64)
+    first = np.cumsum([0] + [len(points) - 1 for points in candidates[:-1]])
+    inset = margin / 2
+    sx0 = np.minimum(a[:, 0], b[:, 0])[:, None]
+    sx1 = np.maximum(a[:, 0], b[:, 0])[:, None]
+    sy0 = np.minimum(a[:, 1], b[:, 1])[:, None]
+    sy1 = np.maximum(a[:, 1], b[:, 1])[:, None]
+    ox0, oy0, ox1, oy1 = obstacles.T
+    hit = ((sx0 < ox1 + inset) & (sx1 > ox0 - inset)
+           & (sy0 < oy1 + inset) & (sy1 > oy0 - inset))
+    return np.logical_or.reduceat(hit, first, axis=0)
+
+
+def _simplify(points):
+    """去掉重合点和共线的中间点"""
+    out = [points[0]]
+    for p in points[1:]:
+        if p == out[-1]:
+            continue
+        if len(out) >= 2:
+            (x0, y0), (x1, y1) = out[-2], out[-1]
+            if (x0 == x1 == p[0]) or (y0 == y1 == p[1]):
+                out[-1] = p
+                continue
+        out.append(p)
+    return out
+
+
+def _channel_routes(a, b, mids, horizontal, margin):
+    """
+    经过给定通道坐标的三段线路。
+
+    horizontal 为 True 时从方块左右两侧出入、在 x=mid 处竖直换行，否则对调。
+    通道坐标落在任一端方块范围内的候选会穿过方块自身，直接跳过。
+    """
+    if not horizontal:
+        a, b = a[[1, 0, 3, 2]], b[[1, 0, 3, 2]]
+    ax0, ay0, ax1, ay1 = a
+    bx0, by0, bx1, by1 = b
+    acy, bcy = (ay0 + ay1) / 2, (by0 + by1) / 2
+    routes = []
+    for mid in mids:
+        if ax0 - margin < mid < ax1 + margin or bx0 - margin < mid < bx1 + margin:
+            continue
+        sx = ax1 if mid > ax1 else ax0
+        tx = bx1 if mid > bx1 else bx0
+        points = [(sx, acy), (mid, acy), (mid, bcy), (tx, bcy)]
+        if not horizontal:
+            points = [(y, x) for x, y in points]
+        routes.append(points)
+    return routes
+
+
+def _candidate_routes(a, b, margin):
+    ax0, ay0, ax1, ay1 = a
+    bx0, by0, bx1, by1 = b
+    acx, acy = (ax0 + ax1) / 2, (ay0 + ay1) / 2
+    bcx, bcy = (bx0 + bx1) / 2, (by0 + by1) / 2
+    routes = []
+
+    # 两个方块在某个方向上有重叠时可以走一条直线
+    lo, hi = max(ay0, by0), min(ay1, by1)
+    if lo <= hi and (bx0 > ax1 or ax0 > bx1):
+        y = (lo + hi) / 2
+        routes.append([(ax1, y), (bx0, y)] if bx0 > ax1 else [(ax0, y), (bx1, y)])
+    lo, hi = max(ax0, bx0), min(ax1, bx1)
+    if lo <= hi and (by0 > ay1 or ay0 > by1):
+        x = (lo + hi) / 2
+        routes.append([(x, ay1), (x, by0)] if by0 > ay1 else [(x, ay0), (x, by1)])
+
+    # 一个拐弯：先水平后竖直，或先竖直后水平
+    if not ax0 <= bcx <= ax1 and not by0 <= acy <= by1:
+        routes.append([(ax1 if bcx > acx else ax0, acy), (bcx, acy),
+                       (bcx, by0 if acy < bcy else by1)])
+    if not ay0 <= bcy <= ay1 and not bx0 <= acx <= bx1:
+        routes.append([(acx, ay1 if bcy > acy else ay0), (acx, bcy),
+                       (bx0 if acx < bcx else bx1, bcy)])
+
+    # 两个拐弯：两方块之间的中线，以及绕到两者外侧的通道
+    for horizontal, (lo0, hi0, lo1, hi1) in ((True, (ax0, ax1, bx0, bx1)),
+                                             (False, (ay0, ay1, by0, by1))):
+        mids = [(max(lo0, lo1) + min(hi0, hi1)) / 2 if hi0 < lo1 or hi1 < lo0 else None,
+                min(lo0, lo1) - 2 * margin, max(hi0, hi1) + 2 * margin]
+        routes.extend(_channel_routes(a, b, [m for m in mids if m is not None],
+                                      horizontal, margin))
+    return routes
+
+
+def _index_ranges(coords, lo, hi):
+    """coords（升序）中严格落在 (lo, hi) 内的下标闭区间"""
+    return np.searchsorted(coords, lo, side="right"), np.searchsorted(coords, hi, side="left") - 1
+
+
+def _cover(shape, r0, r1, c0, c1):
+    """一组下标矩形（闭区间，可能为空）覆盖到的格子，用二维差分数组一次算出"""
+    rows, cols = shape
+    r0, c0 = np.maximum(r0, 0), np.maximum(c0, 0)
+    r1, c1 = np.minimum(r1, rows - 1), np.minimum(c1, cols - 1)
+    keep = (r0 <= r1) & (c0 <= c1)
+    r0, r1, c0, c1 = r0[keep], r1[keep], c0[keep], c1[keep]
+    diff = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    np.add.at(diff, (r0, c0), 1)
+    np.add.at(diff, (r0, c1 + 1), -1)
+    np.add.at(diff, (r1 + 1, c0), -1)
+    np.add.at(diff, (r1 + 1, c1 + 1), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:rows, :cols] > 0
+
+
+def _ports(box, margin):
+    """方块四边中点出发的 (边上的点, 外移 margin 后的点, 方向)，方向 0 为水平、1 为竖直"""
+    x0, y0, x1, y1 = (float(v) for v in box)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    return [((x1, cy), (x1 + margin, cy), 0), ((x0, cy), (x0 - margin, cy), 0),
+            ((cx, y0), (cx, y0 - margin), 1), ((cx, y1), (cx, y1 + margin), 1)]
+
+
+def _grid_lines(values, fixed, margin):
+    """
+    搜索网格的坐标：values 排序去重后按 max(margin, 范围 / SEARCH_LINES) 的区间合并，
+    每个区间只保留第一条（保持与障碍的间距），fixed 中的端口坐标总是保留。
+    """
+    values = np.unique(values)
+    step = max(margin, float(values[-1] - values[0]) / SEARCH_LINES)
+    bucket = np.floor((values - values[0]) / step)
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = bucket[1:] != bucket[:-1]
+    return np.unique(np.concatenate([values[keep], fixed]))
+
+
+def _run_ids(link):
+    """每行中由可通行格边连成的段的编号（行内从 1 起），link[:, i] 为格点 i 与 i + 1 之间可通行"""
+    breaks = np.ones((link.shape[0], link.shape[1] + 1), dtype=bool)
+    breaks[:, 1:] = ~link
+    return np.cumsum(breaks, axis=1)
+
+
+def _relax(cost, coords, runs, big):
+    """
+    沿每一行在同一段内传播代价：cost[i] = min_k cost[k] + |coords[i] - coords[k]|。
+
+    段内的前缀最小值用一次 np.minimum.accumulate 算出：正向扫描时各段减去 段号 * big，
+    反向扫描时加上，已扫过的段的值总是更大，不会传进当前段。
+    """
+    offset = runs * big
+    forward = np.minimum.accumulate(cost - coords - offset, axis=1) + offset + coords
+    backward = (np.minimum.accumulate((cost + coords + offset)[:, ::-1], axis=1)[:, ::-1]
+                - offset - coords)
+    result = np.minimum(forward, backward)
+    result[result >= big / 2] = np.inf
+    return result
+
+
+def grid_route(a, b, found, margin=ROUTE_MARGIN):
+    """
+    在稀疏正交网格上搜索不穿过障碍的线路，找不到时返回 None。
+
+    网格线取各障碍以及两端方块外侧 margin 处的坐标（见 _grid_lines）和两端方块的中线，
+    障碍按 margin / 2 外扩（与 _crossings 的判定一致）后挡住的格点和格边用二维差分数组一次算出。
+    代价为长度加拐弯折算：每一轮先沿各行、再沿各列用 _relax 整体传播一次，
+    每一轮多允许一个拐弯；本轮变小的格点都不比已到达终点的代价小时停止，最后从终点倒推出拐点。
+
+    参数:
+        a, b: 起止方块 (x0, y0, x1, y1)
+        found: 区域内障碍矩形的 (n, 4) 数组，不含 a、b；线路不会走出它们和 a、b 的范围
+    """
+    boxes = np.vstack([np.reshape(found, (-1, 4)), a, b])
+    starts, goals = _ports(a, margin), _ports(b, margin)
+    xs = _grid_lines(np.concatenate([boxes[:, 0] - margin, boxes[:, 2] + margin]),
+                     [p[1][0] for p in starts + goals], margin)
+    ys = _grid_lines(np.concatenate([boxes[:, 1] - margin, boxes[:, 3] + margin]),
+                     [p[1][1] for p in starts + goals], margin)
+    nx, ny = len(xs), len(ys)
+    inset = margin / 2
+    c0, c1 = _index_ranges(xs, boxes[:, 0] - inset, boxes[:, 2] + inset)
+    r0, r1 = _index_ranges(ys, boxes[:, 1] - inset, boxes[:, 3] + inset)
+    free = ~_cover((ny, nx), r0, r1, c0, c1)
+    # 格边 (j, i) 连接格点 (j, i) 和 (j, i + 1)，与外扩障碍的开区间相交即被挡住
+    link_x = ~_cover((ny, nx - 1), r0, r1, c0 - 1, c1) & free[:, :-1] & free[:, 1:]
+    link_y = ~_cover((ny - 1, nx), r0 - 1, r1, c0, c1) & free[:-1] & free[1:]
+    runs_x = _run_ids(link_x)
+    runs_y = _run_ids(link_y.T)
+
+    # 起点：从起点方块各边出来的第一段决定初始方向，0 为水平、1 为竖直
+    col = {x: i for i, x in enumerate(xs.tolist())}
+    row = {y: j for j, y in enumerate(ys.tolist())}
+    init = np.full((2, ny, nx), np.inf)
+    for _, (px, py), direction in starts:
+        j, i = row[py], col[px]
+        if free[j, i]:
+            init[direction, j, i] = margin
+    if np.isinf(init).all():
+        return None
+    # 终点：从外侧的点进入终点方块，到达方向不同时多一个拐弯
+    ends = [(k, row[py], col[px], arrive,
+             margin + (BEND_PENALTY if arrive != direction else 0))
+            for k, (_, (px, py), direction) in enumerate(goals) for arrive in (0, 1)]
+    big = 4.0 * (float(np.abs(xs).max() + np.abs(ys).max()) + 1.0) * (nx + ny)
+    cost = init.copy()
+    best = None
+    for _ in range(nx + ny):
+        horizontal = _relax(np.minimum(cost[0], cost[1] + BEND_PENALTY), xs[None, :], runs_x, big)
+        vertical = _relax(np.minimum(cost[1], horizontal + BEND_PENALTY).T, ys[None, :], runs_y,
+                          big).T
+        changed = np.concatenate([horizontal[horizontal != cost[0]], vertical[vertical != cost[1]]])
+        cost = np.stack([horizontal, vertical])
+        for k, j, i, arrive, extra in ends:
+            total = cost[arrive, j, i] + extra
+            if np.isfinite(total) and (best is None or total < best[0]):
+                best = (total, k, j, i, arrive)
+        # 之后的改进都要经过本轮变小的格点，它们已不比当前终点代价小时停止
+        if not len(changed) or (best is not None and changed.min() >= best[0]):
+            break
+    if best is None:
+        return None
+    _, k, j, i, direction = best
+    points = [goals[k][0], goals[k][1]]
+    while True:
+        points.append((float(xs[i]), float(ys[j])))
+        # 在同一段内找到上一个拐点（或起点）
+        if direction == 0:
+            line = np.flatnonzero(runs_x[j] == runs_x[j, i])
+            base = np.minimum(init[0, j, line], cost[1, j, line] + BEND_PENALTY)
+            total = base + np.abs(xs[line] - xs[i])
+        else:
+            line = np.flatnonzero(runs_y[i] == runs_y[i, j])
+            base = np.minimum(init[1, line, i], cost[0, line, i] + BEND_PENALTY)
+            total = base + np.abs(ys[line] - ys[j])
+        m = line[int(np.argmin(total))]
+        if direction == 0:
+            i, reached = m, init[0, j, m] <= cost[1, j, m] + BEND_PENALTY
+        else:
+            j, reached = m, init[1, m, i] <= cost[0, m, i] + BEND_PENALTY
+        points.append((float(xs[i]), float(ys[j])))
+        if reached:
+            break
+        direction = 1 - direction
+    x, y = points[-1]
+    side = next(p[0] for p in starts if p[1] == (x, y))
+    points.append(side)
+    return _simplify(points[::-1])
+
+
+def orthogonal_route(a, b, obstacles, margin=ROUTE_MARGIN):
+    """
+    在两个方块之间寻找只含水平、竖直线段的线路，尽量不穿过其他方块。
+
+    参数:
+        a, b: 起止方块 (x0, y0, x1, y1)
+        obstacles: 函数 (x0, y0, x1, y1) -> 区域内障碍矩形的 (n, 4) 数组，不含 a、b
+        margin: 线路与方块之间保留的距离
+
+    返回:
+        (k, 2) 折线顶点数组
+
+    候选线路按长度、拐弯数和穿过的障碍数计算代价取最小的一条；被挡住时在挡住它的
+    障碍两侧生成新的通道再试，最多 ROUTE_ROUNDS 轮。仍被挡住时交给 grid_route 在
+    两端方块附近搜索，找不到再扩大一次区域，区域内障碍过多时保留穿过障碍的候选。
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    candidates = _candidate_routes(a, b, margin)
+    if not candidates:
+        # 两个方块重叠，直接连接中心
+        return np.array([[(a[0] + a[2]) / 2, (a[1] + a[3]) / 2],
+                         [(b[0] + b[2]) / 2, (b[1] + b[3]) / 2]])
+
+    region = None
+    best = None
+    for _ in range(ROUTE_ROUNDS + 1):
+        # 本轮全部候选共用一次障碍查询，范围不够时扩大
+        p = np.vstack([np.asarray(points) for points in candidates])
+        box = (p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max())
+        if (region is None or box[0] < region[0] or box[1] < region[1]
+                or box[2] > region[2] or box[3] > region[3]):
+            region = box if region is None else (min(region[0], box[0]), min(region[1], box[1]),
+                                                 max(region[2], box[2]), max(region[3], box[3]))
+            found = obstacles(*region)
+        hits = _crossings(candidates, found, margin)
+        costs = [_route_length(points) for points in candidates] + CROSS_PENALTY * hits.sum(axis=1)
+        i = int(np.argmin(costs))
+        if best is None or costs[i] < best[0]:
+            best = (costs[i], candidates[i], np.flatnonzero(hits[i]))
+        if not len(best[2]):
+            break
+        # 在最靠近起点的几个挡路障碍两侧开辟新的通道
+        blockers = found[np.flatnonzero(hits[i])]
+        start = np.asarray(candidates[i][0])
+        nearest = np.argsort(np.abs(blockers[:, :2] - start).sum(axis=1))[:ROUTE_BLOCKERS]
+        blockers = blockers[nearest]
+        x_mids = np.concatenate([blockers[:, 0] - margin, blockers[:, 2] + margin]).tolist()
+        y_mids = np.concatenate([blockers[:, 1] - margin, blockers[:, 3] + margin]).tolist()
+        candidates = (_channel_routes(a, b, x_mids, True, margin)
+                      + _channel_routes(a, b, y_mids, False, margin))
+        if not candidates:
+            break
+    if len(best[2]):
+        best = _search_route(a, b, obstacles, margin, best)
+    return np.array(_simplify(best[1]), dtype=np.float64)
+
+
+def _search_route(a, b, obstacles, margin, best):
+    """候选线路都被挡住时的网格搜索，结果穿过的障碍更少时替换 best"""
+    size = max(a[2] - a[0], a[3] - a[1], b[2] - b[0], b[3] - b[1])
+    span = max(max(a[2], b[2]) - min(a[0], b[0]), max(a[3], b[3]) - min(a[1], b[1]))
+    for pad in (2 * size + 4 * margin, span / 2 + 4 * size):
+        region = (min(a[0], b[0]) - pad, min(a[1], b[1]) - pad,
+                  max(a[2], b[2]) + pad, max(a[3], b[3]) + pad)
+        found = obstacles(*region)
+        if len(found) > SEARCH_LIMIT:
+            break
+        points = grid_route(a, b, found, margin)
+        if points is None:
+            continue
+        # 网格坐标可能略超出查询区域，按线路自身的范围重新确认
+        p = np.asarray(points)
+        near = obstacles(p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max())
+        crossed = np.flatnonzero(_crossings([points], near, margin)[0])
+        cost = _route_length(points) + CROSS_PENALTY * len(crossed)
+        if cost < best[0]:
+            best = (cost, points, crossed)
+        if not len(best[2]):
+            break
+    return best
+
+
+# ====================== 捆绑路由 ======================
+def bundled_route(p, q, cell=BUNDLE_CELL, beta=BUNDLE_STRENGTH, smoothing=BUNDLE_SMOOTHING):
+    """
+    以空间四叉树为层次的分层捆绑（Holten 2006）。
+
+    控制点依次为起点所在的各级网格中心、终点所在的各级网格中心，层级按两点距离确定；
+    出入同一片区域的连线经过相同的控制点，因此汇成一束。beta 把控制点向直线方向收拢。
+
+    返回:
+        (k, 2) 折线顶点数组
+    """
+    p = np.asarray(p, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
+    distance = float(np.hypot(*(q - p)))
+    levels = int(math.ceil(math.log2(distance / cell))) if distance > cell else 0
+    if levels <= 0:
+        return np.array([p, q])
+    sizes = cell * 2.0 ** np.arange(levels)
+    up = (np.floor(p / sizes[:, None]) + 0.5) * sizes[:, None]
+    down = (np.floor(q / sizes[:, None]) + 0.5) * sizes[:, None]
+    if np.array_equal(up[-1], down[-1]):
+        down = down[:-1]
+    control = np.vstack([p, up, down[::-1], q])
+
+    t = np.linspace(0.0, 1.0, len(control))[:, None]
+    control = beta * control + (1 - beta) * (p + t * (q - p))
+    for _ in range(smoothing):
+        # Chaikin 切角，逼近二次 B 样条，保留两端点
+        a, b = control[:-1], control[1:]
+        cut = np.empty((2 * len(a), 2))
+        cut[0::2] = 0.75 * a + 0.25 * b
+        cut[1::2] = 0.25 * a + 0.75 * b
+        control = np.vstack([p, cut[1:-1], q])
+    return control
+
+
+# ====================== 折线偏移 ======================
+def offset_polyline(points, offset):
+    """把折线沿法线方向平移 offset，拐角处按斜接计算，用于多线连线"""
+    points = np.asarray(points, dtype=np.float64)
+    d = np.diff(points, axis=0)
+    length = np.hypot(d[:, 0], d[:, 1])
+    length[length == 0] = 1.0
+    normal = np.column_stack([-d[:, 1], d[:, 0]]) / length[:, None]
+    n_prev = np.vstack([normal[:1], normal])
+    n_next = np.vstack([normal, normal[-1:]])
+    miter = n_prev + n_next
+    denom = 1 + (n_prev * n_next).sum(axis=1)
+    # 接近折返的拐角斜接长度无界，按普通法线处理
+    sharp = denom < 0.1
+    miter[sharp] = n_next[sharp]
+    denom[sharp] = 1.0
+    return points + offset * miter / denom[:, None]
+
+
+# ====================== 路由缓存 ======================
+class EdgeRouter:
+    """
+    按连线 uid 缓存的线路，数据取自 DiagramModel。
+
+    方块移动或改尺寸后只让相关的线路失效：它自己的连线，以及（正交模式下）
+    外接矩形与它移动前后位置相交的线路。每条线路带版本号，后台计算期间又失效的
+    线路，计算结果不会被采用。
+    """
+
+    def __init__(self, mode=ORTHOGONAL, margin=ROUTE_MARGIN):
+        if mode not in (ORTHOGONAL, BUNDLED):
+            raise ValueError(f"未知的路由方式: {mode}")
+        self.mode = mode
+        self.margin = margin
+        self.routes = {}
+        self.pending = set()
+        self.generation = 0
+        self._rects = None
+        self._grid = None
+        self._stale_rows = set()
+        self._boxes = np.full((0, 4), np.nan)
+        self._versions = np.zeros(0, dtype=np.int64)
+
+    def reset(self):
+        self.generation += 1
+        self.routes.clear()
+        self.pending.clear()
+        self._rects = None
+        self._grid = None
+        self._stale_rows.clear()
+        self._boxes = np.full((0, 4), np.nan)
+        self._versions = np.zeros(0, dtype=np.int64)
+
+    def _reserve(self, uid):
+        if uid < len(self._versions):
+            return
+        size = max(2 * len(self._versions), uid + 1, 1024)
+        boxes = np.full((size, 4), np.nan)
+        boxes[:len(self._boxes)] = self._boxes
+        versions = np.zeros(size, dtype=np.int64)
+        versions[:len(self._versions)] = self._versions
+        self._boxes, self._versions = boxes, versions
+
+    def _store(self, uid, points):
+        self._reserve(uid)
+        self.routes[uid] = points
+        self._boxes[uid] = (points[:, 0].min(), points[:, 1].min(),
+                            points[:, 0].max(), points[:, 1].max())
+
+    # ---------- 障碍 ----------
+    def _rect_array(self, model):
+        """全部方块的 (n, 4) 数组 (x, y, w, h)，变化的行在 blocks_changed 中更新"""
+        if self._rects is None or len(self._rects) != len(model):
+            self._rects = np.column_stack([model.x, model.y, model.width, model.height])
+        return self._rects
+
+    def _obstacle_index(self, model):
+        if (self._grid is None or len(self._stale_rows) > GRID_REBUILD_LIMIT
+                or self._grid.n_rows > len(model)):
+            self._grid = ObstacleGrid(self._rect_array(model))
+            self._stale_rows = set()
+        return self._grid
+
+    # ---------- 失效 ----------
+    def invalidate(self, uids):
+        """丢弃给定连线的线路，返回实际被丢弃的 uid 数组"""
+        uids = np.asarray(uids, dtype=np.int64)
+        if not len(uids):
+            return uids
+        self._reserve(int(uids.max()))
+        self._versions[uids] += 1
+        self._boxes[uids] = np.nan
+        for uid in uids.tolist():
+            self.routes.pop(uid, None)
+        return uids
+
+    def _crossing(self, rects):
+        """穿过给定矩形 (x, y, w, h) 的已缓存正交线路"""
+        if self.mode != ORTHOGONAL or not len(rects) or not self.routes:
+            return np.zeros(0, dtype=np.int64)
+        if len(rects) > CROSSING_CHECK_LIMIT:
+            return np.fromiter(self.routes, dtype=np.int64)
+        rects = np.asarray(rects, dtype=np.float64)
+        inset = self.margin / 2
+        x0, y0 = rects[:, 0] - inset, rects[:, 1] - inset
+        x1, y1 = rects[:, 0] + rects[:, 2] + inset, rects[:, 1] + rects[:, 3] + inset
+        # 先用外接矩形筛选，再逐段精确判定
+        box = self._boxes[:, None, :]
+        near = np.flatnonzero(((box[..., 0] < x1) & (box[..., 2] > x0)
+                               & (box[..., 1] < y1) & (box[..., 3] > y0)).any(axis=1))
+        if not len(near):
+            return near
+        routes = [self.routes[uid] for uid in near.tolist()]
+        a = np.concatenate([r[:-1] for r in routes])
+        b = np.concatenate([r[1:] for r in routes])
+        owner = np.repeat(near, [len(r) - 1 for r in routes])
+        sx0 = np.minimum(a[:, 0], b[:, 0])[:, None]
+        sx1 = np.maximum(a[:, 0], b[:, 0])[:, None]
+        sy0 = np.minimum(a[:, 1], b[:, 1])[:, None]
+        sy1 = np.maximum(a[:, 1], b[:, 1])[:, None]
+        hit = ((sx0 < x1) & (sx1 > x0) & (sy0 < y1) & (sy1 > y0)).any(axis=1)
+        return np.unique(owner[hit])
+
+    def blocks_changed(self, model, ids):
+        """
+        方块移动、改尺寸或新建之后调用，返回失效的连线 uid 数组。
+
+        失效的是方块自己的连线和现在穿过它的线路；原先为避开它而绕行的线路
+        保持不变，直到下次重新计算。
+        """
+        rows = np.array([model.row_of[block_id] for block_id in ids], dtype=np.int64)
+        if self._grid is not None:
+            self._stale_rows.update(rows.tolist())
+        rects = np.column_stack([model.x[rows], model.y[rows],
+                                 model.width[rows], model.height[rows]])
+        if self._rects is not None and len(self._rects) == len(model):
+            self._rects[rows] = rects
+        incident = model.edge_uid[np.isin(model.edge_start, ids) | np.isin(model.edge_end, ids)]
+        return self.invalidate(np.union1d(incident, self._crossing(rects)))
+
+    def block_removed(self, removed_uids):
+        """方块及其连线被删除；行号随之变化，障碍索引下次使用时重建"""
+        self._rects = None
+        self._grid = None
+        self._stale_rows.clear()
+        return self.invalidate(removed_uids)
+
+    # ---------- 计算 ----------
+    def route(self, model, uid):
+        """返回连线的线路，没有缓存时立即计算"""
+        points = self.routes.get(uid)
+        if points is None:
+            i = model.edge_index(uid)
+            start, end = model.edge_rows()
+            grid = self._obstacle_index(model) if self.mode == ORTHOGONAL else None
+            points = compute_route(self.mode, self._rect_array(model), int(start[i]), int(end[i]),
+                                   grid, self._stale_rows, self.margin)
+            self._store(uid, points)
+        return points
+
+    def job(self, model, uids):
+        """为后台计算准备一份与界面线程无关的数据快照，uids 标记为等待中"""
+        uids = np.asarray(sorted(uids), dtype=np.int64)
+        self._reserve(int(uids.max(initial=0)))
+        self.pending.update(uids.tolist())
+        start, end = model.edge_rows()
+        index = np.searchsorted(model.edge_uid, uids)
+        grid = self._obstacle_index(model) if self.mode == ORTHOGONAL else None
+        return RouteJob(self.generation, self.mode, self.margin, uids, self._versions[uids].copy(),
+                        start[index], end[index],
+                        self._rect_array(model).copy(), grid, set(self._stale_rows))
+
+    def accept(self, job, uids, routes):
+        """采用后台计算的结果，返回版本仍然有效、已写入缓存的 uid 列表"""
+        accepted = []
+        if job.generation != self.generation:
+            return accepted
+        current = self._versions[uids]
+        expected = job.versions[np.searchsorted(job.uids, uids)]
+        for uid, points, valid in zip(uids.tolist(), routes, (current == expected).tolist()):
+            self.pending.discard(uid)
+            if valid:
+                self._store(uid, points)
+                accepted.append(uid)
+        return accepted
+
+
+def compute_route(mode, rects, start_row, end_row, grid=None, stale=(), margin=ROUTE_MARGIN):
+    """计算一条连线的线路，rects 为全部方块的 (n, 4) 数组 (x, y, w, h)"""
+    a = rects[start_row]
+    b = rects[end_row]
+    if mode == BUNDLED:
+        return bundled_route(a[:2] + a[2:] / 2, b[:2] + b[2:] / 2)
+
+    def obstacles(x0, y0, x1, y1):
+        rows = _obstacles_in(grid, stale, rects, x0, y0, x1, y1)
+        r = rects[rows[(rows != start_row) & (rows != end_row)]]
+        return np.column_stack([r[:, 0], r[:, 1], r[:, 0] + r[:, 2], r[:, 1] + r[:, 3]])
+
+    return orthogonal_route((a[0], a[1], a[0] + a[2], a[1] + a[3]),
+                            (b[0], b[1], b[0] + b[2], b[1] + b[3]), obstacles, margin)
+
+
+def route_crossings(points, rects, start_row, end_row, margin=ROUTE_MARGIN):
+    """线路穿过的方块数（不含两端方块），判定与路由时相同；用于基准和检查"""
+    keep = np.ones(len(rects), dtype=bool)
+    keep[[start_row, end_row]] = False
+    r = rects[keep]
+    boxes = np.column_stack([r[:, 0], r[:, 1], r[:, 0] + r[:, 2], r[:, 1] + r[:, 3]])
+    return int(_crossings([[tuple(p) for p in points]], boxes, margin)[0].sum())
+
+
+class RouteJob:
+    """一批连线的后台路由任务，只读取创建时的快照"""
+
+    def __init__(self, generation, mode, margin, uids, versions, start_rows, end_rows, rects,
+                 grid, stale):
+        self.generation = generation
+        self.mode = mode
+        self.margin = margin
+        self.uids = uids
+        self.versions = versions
+        self.start_rows = start_rows
+        self.end_rows = end_rows
+        self.rects = rects
+        self.grid = grid
+        self.stale = stale
+
+    def __len__(self):
+        return len(self.uids)
+
+    def run(self, chunk_size=2000, should_stop=None):
+        """分块计算，逐块产出 (uids, 线路列表)"""
+        for lo in range(0, len(self.uids), chunk_size):
+            if should_stop is not None and should_stop():
+                return
+            hi = min(lo + chunk_size, len(self.uids))
+            routes = [compute_route(self.mode, self.rects, a, b, self.grid, self.stale, self.margin)
+                      for a, b in zip(self.start_rows[lo:hi].tolist(), self.end_rows[lo:hi].tolist())]
+            yield self.uids[lo:hi], routes
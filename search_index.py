@@ -0,0 +1,198 @@
+import bisect
+import re
+
+import numpy as np
+
+# 名称按二元组和三元组建立倒排表；单个字符的查询按名称前缀在有序表中二分查找
+GRAM_SIZES = (2, 3)
+_TOKEN = re.compile(r"(?:(id|line|线型):)?(\S+)", re.IGNORECASE)
+
+
+def _grams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+# ====================== 查询 ======================
+class Query:
+    """
+    解析后的搜索条件，多个条件之间取交集。
+
+    terms: 名称子串（纯数字时也匹配编号前缀）
+    id_prefixes: id:<数字> 指定的编号前缀
+    lines: line:<编号> 指定的线型编号，只保留带有这些线型连线的方块
+    """
+    __slots__ = ("terms", "id_prefixes", "lines")
+
+    def __init__(self, terms=(), id_prefixes=(), lines=()):
+        self.terms = list(terms)
+        self.id_prefixes = list(id_prefixes)
+        self.lines = list(lines)
+
+    def __bool__(self):
+        return bool(self.terms or self.id_prefixes or self.lines)
+
+
+def parse_query(text, line_aliases=None):
+    """
+    解析搜索框中的文字，例如 "财务 id:12 line:3"。
+
+    参数:
+        line_aliases: 线型名称 -> 线型编号，line: 后面也可以写名称
+    """
+    query = Query()
+    line_aliases = line_aliases or {}
+    for key, value in _TOKEN.findall(text.strip()):
+        key = key.lower()
+        if key == "id":
+            if not value.isdigit():
+                raise ValueError(f"编号必须是数字: {value}")
+            query.id_prefixes.append(value)
+        elif key:
+            number = line_aliases.get(value, value)
+            try:
+                query.lines.append(int(number))
+            except ValueError:
+                raise ValueError(f"未知的线型: {value}") from None
+        else:
+            query.terms.append(value.lower())
+    return query
+
+
+# ====================== 索引 ======================
+class SearchIndex:
+    """
+    方块名称和编号的搜索索引，按方块编号增量维护。
+
+    名称统一转为小写：两个字符的查询直接取二元组倒排表，三个及以上字符取各三元组
+    倒排表的交集后再确认子串；编号和单字符查询在有序数组中按前缀二分查找。
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._postings = {}
+        # 有序的 (名称, 编号) 和 (编号字符串, 编号)，用于前缀查找
+        self._by_name = []
+        self._by_id = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, block_id):
+        return block_id in self._names
+
+    def rebuild(self, ids, names):
+        """按整张图表重建索引"""
+        self._names = {}
+        self._postings = {}
+        for block_id, name in zip(ids, names):
+            self._index(block_id, str(name).lower())
+        self._by_name = sorted((name, block_id) for block_id, name in self._names.items())
+        self._by_id = sorted((str(block_id), block_id) for block_id in self._names)
+
+    def add(self, block_id, name):
+        if block_id in self._names:
+            self.remove(block_id)
+        name = str(name).lower()
+        self._index(block_id, name)
+        bisect.insort(self._by_name, (name, block_id))
+        bisect.insort(self._by_id, (str(block_id), block_id))
+
+    def remove(self, block_id):
+        name = self._names.pop(block_id, None)
+        if name is None:
+            return
+        for size in GRAM_SIZES:
+            for gram in _grams(name, size):
+                posting = self._postings[gram]
+                posting.discard(block_id)
+                if not posting:
+                    del self._postings[gram]
+        self._discard(self._by_name, (name, block_id))
+        self._discard(self._by_id, (str(block_id), block_id))
+
+    def _index(self, block_id, name):
+        self._names[block_id] = name
+        for size in GRAM_SIZES:
+            for gram in _grams(name, size):
+                posting = self._postings.get(gram)
+                if posting is None:
+                    self._postings[gram] = {block_id}
+                else:
+                    posting.add(block_id)
+
+    @staticmethod
+    def _discard(entries, entry):
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    @staticmethod
+    def _prefixed(entries, prefix):
+        lo = bisect.bisect_left(entries, (prefix,))
+        hi = bisect.bisect_left(entries, (prefix + "\uffff",))
+        return {block_id for _, block_id in entries[lo:hi]}
+
+    # ---------- 查找 ----------
+    def find_name(self, text):
+        """名称包含 text 的方块编号集合；单个字符只匹配名称开头"""
+        text = text.lower()
+        if len(text) < min(GRAM_SIZES):
+            return self._prefixed(self._by_name, text)
+        if len(text) in GRAM_SIZES:
+            return set(self._postings.get(text, ()))
+        size = max(GRAM_SIZES)
+        postings = sorted((self._postings.get(gram, set()) for gram in _grams(text, size)), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        names = self._names
+        return {block_id for block_id in candidates if text in names[block_id]}
+
+    def find_id(self, prefix):
+        """编号以 prefix 开头的方块编号集合"""
+        return self._prefixed(self._by_id, prefix)
+
+    def match(self, query):
+        """
+        满足全部名称和编号条件的方块编号集合；没有这类条件时返回 None，表示不限制。
+        """
+        matched = None
+        for term in query.terms:
+            found = self.find_name(term)
+            if term.isdigit():
+                found |= self.find_id(term)
+            matched = found if matched is None else matched & found
+            if not matched:
+                return matched
+        for prefix in query.id_prefixes:
+            found = self.find_id(prefix)
+            matched = found if matched is None else matched & found
+        return matched
+
+    def search(self, query, model):
+        """
+        在 DiagramModel 上执行查询。
+
+        返回:
+            (方块行号数组, 连线下标数组)。有线型条件时连线为与匹配方块相连的该类连线，
+            否则为两端都匹配的连线。
+        """
+        matched = self.match(query)
+        if matched is not None:
+            row_of = model.row_of
+            rows = np.fromiter((row_of[block_id] for block_id in matched), dtype=np.int64,
+                               count=len(matched))
+        start, end = model.edge_rows()
+        if query.lines:
+            edges = np.isin(model.edge_line, query.lines)
+            if matched is not None:
+                mask = np.zeros(len(model), dtype=bool)
+                mask[rows] = True
+                edges &= mask[start] | mask[end]
+                rows = rows[np.isin(rows, np.concatenate([start[edges], end[edges]]))]
+            else:
+                rows = np.unique(np.concatenate([start[edges], end[edges]]))
+            return np.sort(rows), np.flatnonzero(edges)
+        if matched is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        mask = np.zeros(len(model), dtype=bool)
+        mask[rows] = True
+        return np.sort(rows), np.flatnonzero(mask[start] & mask[end])